@@ -0,0 +1,224 @@
+import argparse
+import contextlib
+import io
+import json
+import matplotlib.pyplot as plt
+import numpy as np
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from boxplots import plot_box_chart
+from cache import CACHE_FOLDER
+from catalog import Catalog
+from distribution import process_data
+from generate_sample_data import generate
+from helpers import (
+    load_dataset,
+    num_to_mass,
+    process_file,
+    read_merged,
+    save_figure,
+    mm,
+    ro,
+    corr_fact,
+)
+from merge_mini_wras_data import merge_data
+
+# Differences from the baseline below these are considered noise,
+# whatever the tolerance
+NOISE = {'seconds': 0.01, 'peak_mb': 1}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure time and peak memory versus data size.'
+    )
+    parser.add_argument(
+        '--days',
+        default='1,7,30',
+        help='Comma-separated numbers of days of data to measure',
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='Run each case N times, reporting the best time',
+    )
+    parser.add_argument(
+        '--json', metavar='PATH', help='Save the results as JSON to PATH'
+    )
+    parser.add_argument(
+        '--baseline',
+        metavar='PATH',
+        help='Compare with results saved by --json, exit 1 on regressions',
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.25,
+        help='Allowed relative increase over the baseline (default 0.25)',
+    )
+    args = parser.parse_args()
+
+    # Figures are only saved, never shown
+    plt.switch_backend('Agg')
+
+    results = []
+    for days in (int(days) for days in args.days.split(',')):
+        with tempfile.TemporaryDirectory(prefix='mini-wras-bench-') as root:
+            results.extend(run_cases(root, days, args.repeat))
+
+    print_results(results)
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(regression)
+        if regressions:
+            sys.exit(1)
+
+
+def run_cases(root, days, repeat=3):
+    """Generate `days` days of data in `root` and measure every case."""
+
+    generate(os.path.join(root, 'data'), days)
+    catalog = Catalog(os.path.join(root, 'data'))
+    catalog.scan()
+    c_files = catalog.files('location', 'C.dat')
+    # Merged data is saved two levels up from the data files
+    merged_path = os.path.join(
+        os.path.dirname(os.path.dirname(c_files[0])), 'merged-data'
+    )
+
+    def merge():
+        # Start from scratch, so that every run parses all the files
+        for folder, _, names in os.walk(root):
+            if os.path.basename(folder) in ('merged-data', CACHE_FOLDER):
+                for name in names:
+                    os.remove(os.path.join(folder, name))
+        merge_data(c_files, ['total', 'nano'])
+
+    def plot():
+        plot_box_chart(
+            df,
+            'total counts',
+            [df.index.year, df.index.month, df.index.day],
+            (150 * mm, 90 * mm),
+            'Benchmark',
+            df.index.strftime('%d/%m').unique(),
+            'Number concentration',
+        )
+
+    def plot_and_close():
+        plot()
+        plt.close()
+
+    def plot_and_save():
+        plot()
+        save_figure('benchmark', os.path.join(root, 'benchmark.png'), True)
+
+    cases = [
+        ('process_file', lambda: process_file(c_files[0], use_cache=False)),
+        ('process_file (cached)', lambda: process_file(c_files[0])),
+        (
+            'load_dataset (float32)',
+            lambda: load_dataset(c_files[0], np.float32),
+        ),
+        ('merge_data', merge),
+    ]
+    results = []
+    for name, function in cases:
+        results.append(measure(name, function, days, repeat))
+
+    # Cases working on the merged data
+    df = next(read_merged(os.path.join(merged_path, 'total.csv')))
+    cases = [
+        ('num_to_mass', lambda: num_to_mass(df, ro, corr_fact)),
+        ('distribution.process_data', lambda: process_data(df)),
+        ('plot_box_chart', plot_and_close),
+        ('plot_box_chart + save_figure', plot_and_save),
+    ]
+    for name, function in cases:
+        results.append(measure(name, function, days, repeat, len(df)))
+
+    return results
+
+
+def measure(name, function, days, repeat=3, rows=None):
+    """Return the best time and the peak memory of calling `function`.
+
+    The peak memory is traced in a separate call, as tracemalloc slows
+    down the calls considerably. Memory allocated outside of Python's
+    and numpy's allocators, e.g. by matplotlib's renderer, is missed.
+    """
+
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Warm up, e.g. lazy imports and the first figure of matplotlib
+        function()
+
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            function()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'case': name,
+        'days': days,
+        'rows': rows,
+        'seconds': min(times),
+        'peak_mb': peak / 2**20,
+    }
+
+
+def print_results(results):
+    print(
+        f"{'case':<30} {'days':>5} {'rows':>8} "
+        f"{'time [s]':>9} {'peak [MB]':>10}"
+    )
+    for result in results:
+        rows = result['rows'] if result['rows'] is not None else ''
+        print(
+            f"{result['case']:<30} {result['days']:>5} {rows:>8} "
+            f"{result['seconds']:>9.3f} {result['peak_mb']:>10.1f}"
+        )
+
+
+def compare(results, baseline, tolerance=0.25):
+    """List the cases slower or using more memory than the baseline."""
+
+    previous = {
+        (result['case'], result['days']): result for result in baseline
+    }
+    regressions = []
+    for result in results:
+        before = previous.get((result['case'], result['days']))
+        if before is None:
+            continue
+        for key, label in [('seconds', 'time'), ('peak_mb', 'peak memory')]:
+            if result[key] > before[key] * (1 + tolerance) + NOISE[key]:
+                regressions.append(
+                    f"Regression in {result['case']} ({result['days']} days): "
+                    f'{label} {result[key]:.3f} vs {before[key]:.3f}'
+                )
+    return regressions
+
+
+if __name__ == '__main__':
+    main()
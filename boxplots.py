@@ -3,18 +3,20 @@ import math
 import matplotlib.pyplot as plt
 import os
 import pandas as pd
-import seaborn as sns
 import sys
 
+import rollup
+
 from matplotlib import ticker
+from catalog import Catalog
 from helpers import (
     determine_data_file,
-    directory_tree,
-    get_path,
+    merged_data_path,
+    new_figure,
     num_to_mass,
-    save_figure,
     parse_arguments,
-    tell_parent,
+    read_merged,
+    render_figures,
     y_formatter_function,
     mm,
     path,
@@ -23,15 +25,35 @@ from helpers import (
     title_font,
     label_font,
     tick_font,
+    within,
 )
+from profiling import stage
+from sketch import Summary
 
 
 def main():
+    # Parse the command-line arguments
+    args = parse_arguments(
+        batch=True,
+        days=True,
+        instrument=True,
+        jobs=True,
+        mass=True,
+        max_memory=True,
+        nano=True,
+        period=True,
+        profile=True,
+        raw=True,
+        separately=True,
+        sketch=True,
+    )
+
     # Ensure proper language formatting, e.g. months' names
     locale.setlocale(locale.LC_ALL, 'en_US')
 
-    # Parse the command-line arguments
-    args = parse_arguments(days=True, mass=True, nano=True, separately=True)
+    # Ensure proper using of flags
+    if args.days and args.separately:
+        sys.exit('Only one flag can be used: -d or -s.')
 
     # Variables to properly name chart files
     fig_suffix, fig_suffix2 = '', ''
@@ -39,71 +61,92 @@ def main():
     # Determine the usage of total.csv or nano.csv
     data_file, column_name, fig_suffix = determine_data_file(args)
 
-    # Load data
-    dir_tree = directory_tree(path)
-    df = pd.read_csv(get_path(dir_tree, data_file, path), index_col=0)
-
-    # Conversion of MINI-WRAS dates to datetime format
-    df.index = pd.to_datetime(df.index, dayfirst=True)
-
     # Logic for determining mass concentration
     if args.mass:
-        df = num_to_mass(df, ro, corr_fact)
         column_name = 'total mass'
         fig_suffix2 = '-mass'
+
+    # Load daily summaries from the rollups saved by the merge, unless
+    # the raw merged data is requested
+    data_path = merged_data_path(
+        Catalog.open(path), data_file, args.instrument
+    )
+    daily = None
+    if not args.raw:
+        daily = read_rollups(data_path, args.mass, args.start, args.stop)
+
+    # Otherwise load data, keeping only the plotted column of each chunk
+    # or its daily summaries
+    if daily is None and args.sketch:
+        daily = summarize_days(
+            read_merged(data_path, args.max_memory, args.start, args.stop),
+            column_name,
+            args.mass,
+        )
+    if daily is not None:
+        days = pd.DatetimeIndex([pd.Timestamp(*key) for key in daily])
+    else:
+        columns = []
+        for chunk in read_merged(
+            data_path, args.max_memory, args.start, args.stop
+        ):
+            if args.mass:
+                chunk = num_to_mass(chunk, ro, corr_fact)
+            columns.append(chunk[[column_name]])
+        df = pd.concat(columns)
+        days = df.index
+
+    # Nothing to plot, e.g. before or after the measurements
+    if len(days) == 0:
+        sys.exit('No data in the given period.')
+
+    if daily is not None:
+        maximum = max(summary.max for summary in daily.values())
+    else:
+        maximum = df[column_name].max()
+
+    # Logic for determining mass concentration
+    if args.mass:
         ylabel = 'Mass concentration [$\mathregular{mg/m^3}$]'
 
         # Determine coefficient to calculate ylim based on the maximum
         # value in the column
-        if df[column_name].max() < 0.2:
+        if maximum < 0.2:
             coeff = 0.01
-        elif df[column_name].max() < 2:
+        elif maximum < 2:
             coeff = 0.1
         else:
             coeff = 1
 
     else:
         ylabel = 'Number concentration [particles/$\mathregular{cm^3}$]'
-        coeff = 5e3 if df[column_name].max() < 4e4 else 1e4
+        coeff = 5e3 if maximum < 4e4 else 1e4
 
     # Logic for plotting box charts by day or month
     if args.days:
-        # Ensure proper using of flags
-        if args.days and args.separately:
-            sys.exit('Only one flag can be used: -d or -s.')
-
-        title = f'{df.first_valid_index():%Y}'
-        xticks_labels = df.index.strftime('%d/%m').unique()
+        title = f'{days[0]:%Y}'
+        xticks_labels = days.strftime('%d/%m').unique()
         figsize = (240 * mm, 150 * mm)
         name_suffix = '-days'
 
         # Plot data grouped by days
-        plot_box_chart(
-            df,
-            column_name,
-            [df.index.year, df.index.month, df.index.day],
-            figsize,
-            title,
-            xticks_labels,
-            ylabel,
-            args.mass,
-            coeff,
-        )
-
-    # Logic to plot box charts by day and save figures separately for each month
-    elif args.separately:
-        figsize = (150 * mm, 90 * mm)
-
-        for _, group in df.groupby([df.index.year, df.index.month]):
-            title = f'{group.first_valid_index():%B} {group.first_valid_index():%Y}'
-            xticks_labels = group.index.strftime('%a, %d').unique()
-            name_suffix = '-' + title.replace(' ', '-')
-
-            # Plot data grouped by days for each month
-            plot_box_chart(
-                group,
+        if daily is not None:
+            plot = plot_box_summaries
+            arguments = (
+                list(daily.values()),
+                figsize,
+                title,
+                xticks_labels,
+                ylabel,
+                args.mass,
+                coeff,
+            )
+        else:
+            plot = plot_box_chart
+            arguments = (
+                df,
                 column_name,
-                [group.index.year, group.index.month, group.index.day],
+                [df.index.year, df.index.month, df.index.day],
                 figsize,
                 title,
                 xticks_labels,
@@ -112,39 +155,152 @@ def main():
                 coeff,
             )
 
+    # Logic to plot box charts by day and save figures separately for each month
+    elif args.separately:
+        figsize = (150 * mm, 90 * mm)
+
+        if daily is not None:
+            groups = [
+                (days[days.to_period('M') == month], month)
+                for month in days.to_period('M').unique()
+            ]
+        else:
+            groups = [
+                (group.index, group)
+                for _, group in df.groupby([df.index.year, df.index.month])
+            ]
+
+        # Figures of the months are independent, so they are collected
+        # first and rendered together
+        figures = []
+        for index, group in groups:
+            title = f'{index[0]:%B} {index[0]:%Y}'
+            xticks_labels = index.strftime('%a, %d').unique()
+            name_suffix = '-' + title.replace(' ', '-')
+
+            # Plot data grouped by days for each month
+            if daily is not None:
+                plot = plot_box_summaries
+                arguments = (
+                    [
+                        daily[key]
+                        for key in daily
+                        if key[:2] == (group.year, group.month)
+                    ],
+                    figsize,
+                    title,
+                    xticks_labels,
+                    ylabel,
+                    args.mass,
+                    coeff,
+                )
+            else:
+                plot = plot_box_chart
+                arguments = (
+                    group,
+                    column_name,
+                    [group.index.year, group.index.month, group.index.day],
+                    figsize,
+                    title,
+                    xticks_labels,
+                    ylabel,
+                    args.mass,
+                    coeff,
+                )
+
             # Save figure if requested
             fig_name = f'boxplots{name_suffix}{fig_suffix}{fig_suffix2}'
-            fig_path = os.path.join(path, 'merged-data', f'{fig_name}.png')
-            save_figure(fig_name, fig_path)
+            fig_path = os.path.join(
+                os.path.dirname(data_path), f'{fig_name}.png'
+            )
+            figures.append((plot, arguments, fig_name, fig_path))
+
+        render_figures(figures, args)
 
         # Exit to avoid saving the plots again
         sys.exit()
 
     # Logic for plotting box charts by month
     else:
-        title = f'{df.first_valid_index():%Y}'
-        xticks_labels = df.index.strftime('%B').unique()
+        title = f'{days[0]:%Y}'
+        xticks_labels = days.strftime('%B').unique()
         figsize = (150 * mm, 90 * mm)
         name_suffix = '-months'
 
         # Plot data grouped by month
-        plot_box_chart(
-            df,
-            column_name,
-            [df.index.year, df.index.month],
-            figsize,
-            title,
-            xticks_labels,
-            ylabel,
-            args.mass,
-            coeff,
-        )
+        if daily is not None:
+            months = {}
+            for key, summary in daily.items():
+                months.setdefault(key[:2], []).append(summary)
+            plot = plot_box_summaries
+            arguments = (
+                [Summary.combine(month) for month in months.values()],
+                figsize,
+                title,
+                xticks_labels,
+                ylabel,
+                args.mass,
+                coeff,
+            )
+        else:
+            plot = plot_box_chart
+            arguments = (
+                df,
+                column_name,
+                [df.index.year, df.index.month],
+                figsize,
+                title,
+                xticks_labels,
+                ylabel,
+                args.mass,
+                coeff,
+            )
 
     # Save figure when there is the only one
-    up = tell_parent(get_path(dir_tree, data_file, path))
     fig_name = f'boxplots{name_suffix}{fig_suffix}{fig_suffix2}'
-    fig_path = os.path.join(get_path(dir_tree, up, path), f'{fig_name}.png')
-    save_figure(fig_name, fig_path)
+    fig_path = os.path.join(os.path.dirname(data_path), f'{fig_name}.png')
+    render_figures([(plot, arguments, fig_name, fig_path)], args)
+
+
+def read_rollups(data_path, mass=False, start=None, stop=None):
+    """Return daily summaries of the merged data from its rollups.
+
+    With `start` and/or `stop` (datetime64), return the days from
+    `start` up to `stop` (excluded) only. Return None if the rollups are
+    missing or older than the data.
+    """
+
+    data_rollup = rollup.load(data_path, mass)
+    if data_rollup is None:
+        print('Rollups are missing or outdated, reading the merged data.')
+        return None
+    return {
+        key: summary
+        for key, summary in data_rollup.summaries('day').items()
+        if within(pd.Timestamp(*key), start, stop)
+    }
+
+
+def summarize_days(chunks, column, mass=False):
+    """Summarize values of `column` per day, chunk by chunk.
+
+    Return a dictionary mapping (year, month, day) to a Summary, sorted
+    by date.
+    """
+
+    daily = {}
+    for chunk in chunks:
+        if mass:
+            chunk = num_to_mass(chunk, ro, corr_fact)
+
+        index = chunk.index
+        with stage('grouping', rows=len(chunk)):
+            for key, group in chunk[column].groupby(
+                [index.year, index.month, index.day]
+            ):
+                daily.setdefault(key, Summary()).update(group.to_numpy())
+
+    return dict(sorted(daily.items()))
 
 
 def plot_box_chart(
@@ -159,24 +315,81 @@ def plot_box_chart(
     coeff=1,
 ):
     """Plot a boxplot from the provided `dataframe`."""
-    
-    # Group data by grouped_by variable
-    boxplot_data = [
-        group[column] for _, group in dataframe.groupby(grouped_by)
-    ]
+
+    # seaborn is slow to import and needed for plotting only
+    import seaborn as sns
+
+    # Group data by grouped_by variable, passing plain arrays, as
+    # seaborn >= 0.13 aligns a list of Series on their (datetime) index
+    with stage('grouping', rows=len(dataframe)):
+        boxplot_data = [
+            group[column].to_numpy()
+            for _, group in dataframe.groupby(grouped_by)
+        ]
 
     # Create a boxplot
-    plt.figure(figsize=figsize, dpi=300, layout='constrained')
+    new_figure(figsize, layout='constrained')
     sns.boxplot(data=boxplot_data, linewidth=0.7, flierprops={'marker': 'x'})
 
+    set_axes(
+        dataframe[column].max(), title, xticks_labels, ylabel, mass, coeff
+    )
+
+
+def plot_box_summaries(
+    summaries,
+    figsize,
+    title,
+    xticks_labels,
+    ylabel,
+    mass=False,
+    coeff=1,
+):
+    """Plot a boxplot from the provided Summary objects."""
+
+    import seaborn as sns
+
+    # Draw the boxes like seaborn does, with desaturated palette colors
+    # and dark gray lines
+    colors = [
+        sns.desaturate(color, 0.75)
+        for color in sns.color_palette(n_colors=len(summaries))
+    ]
+    line = {'color': '.26', 'linewidth': 0.7}
+
+    new_figure(figsize, layout='constrained')
+    boxes = plt.gca().bxp(
+        [summary.stats() for summary in summaries],
+        positions=range(len(summaries)),
+        widths=0.8,
+        patch_artist=True,
+        boxprops={'edgecolor': '.26', 'linewidth': 0.7},
+        whiskerprops=line,
+        capprops=line,
+        medianprops=line,
+        flierprops={
+            'marker': 'x',
+            'markeredgecolor': '.26',
+            'markersize': 5,
+            'linestyle': 'none',
+        },
+    )
+    for box, color in zip(boxes['boxes'], colors):
+        box.set_facecolor(color)
+
+    maximum = max(summary.max for summary in summaries)
+    set_axes(maximum, title, xticks_labels, ylabel, mass, coeff)
+
+
+def set_axes(maximum, title, xticks_labels, ylabel, mass=False, coeff=1):
+    """Set properties of the axes."""
+
     # X-axis
     plt.xticks(range(len(xticks_labels)), xticks_labels, **tick_font)
 
     # Y-axis
     if mass:
-        ylocator = ticker.LinearLocator(
-            math.ceil(dataframe[column].max() / coeff) + 1
-        )
+        ylocator = ticker.LinearLocator(math.ceil(maximum / coeff) + 1)
         plt.gca().yaxis.set_major_locator(ylocator)
 
     plt.ylabel(ylabel, **label_font)
@@ -185,7 +398,7 @@ def plot_box_chart(
     )
 
     # Calculate y-axis limits
-    yupper = math.ceil(dataframe[column].max() / coeff) * coeff
+    yupper = math.ceil(maximum / coeff) * coeff
     plt.ylim(0, yupper)
 
     plt.title(title, **title_font)
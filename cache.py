@@ -0,0 +1,79 @@
+import hashlib
+import numpy as np
+import os
+
+# Bump when the layout of the cached arrays changes, so old entries are
+# treated as stale instead of being misread
+CACHE_VERSION = 2
+
+# Name of the cache folder created next to the data files
+CACHE_FOLDER = '.mini-wras-cache'
+
+
+def cache_path(file_path, cache_dir=None, kind=None):
+    """Return the location of the cache entry for `file_path`.
+
+    Entries of another `kind` than the parsed data, e.g. 'rollups',
+    are kept in separate files.
+    """
+
+    file_path = os.path.abspath(file_path)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(file_path), CACHE_FOLDER)
+
+    # The hash of the full path keeps entries of equally named files
+    # from different folders apart when a shared cache_dir is used
+    digest = hashlib.sha1(file_path.encode('utf-8')).hexdigest()[:12]
+    suffix = '' if kind is None else f'.{kind}'
+    return os.path.join(
+        cache_dir, f'{os.path.basename(file_path)}.{digest}{suffix}.npz'
+    )
+
+
+def source_key(file_path):
+    """Identify the current state of `file_path` by its size and mtime."""
+
+    stat = os.stat(file_path)
+    return np.array(
+        [CACHE_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64
+    )
+
+
+def load(file_path, cache_dir=None, kind=None, names=None):
+    """Return cached arrays for `file_path` or None if missing or stale.
+
+    With `names`, only the arrays of these names are read, e.g. a few
+    of the many arrays of the rollups. None is returned if any of them
+    is missing.
+    """
+
+    try:
+        with np.load(cache_path(file_path, cache_dir, kind)) as entry:
+            if not np.array_equal(entry['key'], source_key(file_path)):
+                return None
+            return {name: entry[name] for name in names or entry.files}
+    except (OSError, KeyError, ValueError):
+        # Missing, truncated or foreign file - parse the source again
+        return None
+
+
+def store(file_path, key, arrays, cache_dir=None, kind=None):
+    """Save `arrays` parsed from `file_path` in the state given by `key`.
+
+    The `key` has to be taken with source_key() before the file is
+    parsed, so that data appended during parsing invalidates the entry.
+    """
+
+    entry_path = cache_path(file_path, cache_dir, kind)
+    # Write to a temporary file first, so that concurrent readers never
+    # see a partially written entry
+    tmp_path = f'{entry_path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, key=key, **arrays)
+        os.replace(tmp_path, entry_path)
+    except OSError:
+        # Caching is an optimization only, e.g. the data may be read-only
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,369 @@
+import datetime
+import fnmatch
+import json
+import os
+import re
+
+from profiling import stage
+
+# Name of the file persisting the catalog in the catalogued folder
+CATALOG_FILE = '.mini-wras-catalog.json'
+CATALOG_VERSION = 1
+
+# Dates in file names, e.g. 2023-04-17_sample_location-C.dat, and
+# months in folder names, e.g. 2023-04
+_DATE = re.compile(r'(\d{4})-(\d{2})-(\d{2})')
+_MONTH = re.compile(r'(\d{4})-(\d{2})')
+# Separators of the keywords in file names
+_TOKENS = re.compile(r'[-_. ]+')
+
+
+class Entry:
+    """File in the catalog with the attributes parsed from its name."""
+
+    __slots__ = ('path', 'name', 'folder', 'suffix', 'date', 'month')
+
+    def __init__(self, root, folder, name):
+        self.folder = folder
+        self.name = name
+        self.path = os.path.join(root, folder, name)
+        self.suffix = file_suffix(name)
+        self.date = file_date(name)
+        self.month = (
+            f'{self.date:%Y-%m}'
+            if self.date is not None
+            else folder_month(os.path.basename(folder))
+        )
+
+    def __repr__(self):
+        return f'Entry({self.path!r})'
+
+
+class Catalog:
+    """Index of the files in a directory tree.
+
+    The tree is scanned once with os.scandir() and files are indexed by
+    name, keyword, suffix (e.g. C.dat or M.dat) and date, so lookups do
+    not walk the tree again. Use Catalog.open() to reuse the catalog
+    persisted by a previous run, rescanning only the changed folders.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        # Relative folder path -> mtime of the folder when scanned
+        self.folders = {}
+        # Relative folder path -> names of the files in the folder
+        self.contents = {}
+        self._index()
+
+    @classmethod
+    def open(cls, root, save=True):
+        """Load the persisted catalog of `root`, updating stale folders."""
+
+        with stage('scan', root):
+            catalog = cls(root)
+            if not catalog._load():
+                catalog.scan()
+            elif not catalog.refresh():
+                # Nothing changed since the last run
+                return catalog
+
+            if save:
+                catalog.save()
+        return catalog
+
+    def scan(self, folder=''):
+        """Scan `folder` (relative to the root) and all its subfolders."""
+
+        stack = [folder]
+        while stack:
+            current = stack.pop()
+            stack.extend(self._scan_folder(current))
+        self._index()
+
+    def refresh(self):
+        """Rescan folders changed since they were catalogued.
+
+        Return True if the files of any folder have changed. Adding,
+        removing or renaming files updates the mtime of their folder, so
+        a single os.stat() per folder is enough to detect changes. Hidden
+        files change the mtime as well, e.g. saving the catalog file in
+        the root, so rescanned folders count as changed only if their
+        files or subfolders differ.
+        """
+
+        changed = []
+        for folder, mtime in list(self.folders.items()):
+            if folder not in self.folders:
+                # Removed along with an already dropped parent folder
+                continue
+            try:
+                current = os.stat(os.path.join(self.root, folder)).st_mtime_ns
+            except OSError:
+                self._drop(folder)
+                changed.append(folder)
+                continue
+            if current != mtime:
+                names = self.contents.get(folder)
+                # Scan new subfolders completely, known ones are checked
+                # by their own mtime
+                stack = [
+                    subfolder
+                    for subfolder in self._scan_folder(folder)
+                    if subfolder not in self.folders
+                ]
+                added = len(stack) > 0
+                while stack:
+                    stack.extend(self._scan_folder(stack.pop()))
+                dropped = self._drop_missing(folder)
+                if added or dropped or self.contents.get(folder) != names:
+                    changed.append(folder)
+
+        if changed:
+            self._index()
+        return len(changed) > 0
+
+    def save(self, catalog_path=None):
+        """Persist the catalog, by default as CATALOG_FILE in the root."""
+
+        if catalog_path is None:
+            catalog_path = os.path.join(self.root, CATALOG_FILE)
+        state = {
+            'version': CATALOG_VERSION,
+            'root': self.root,
+            'folders': self.folders,
+            'contents': self.contents,
+        }
+        tmp_path = f'{catalog_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, catalog_path)
+        except OSError:
+            # Persisting is an optimization only
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def path(self, name):
+        """Return the path of the first file called `name` or None."""
+
+        entries = self.by_name.get(name)
+        return entries[0].path if entries else None
+
+    def files(self, keyword='', suffix='', start=None, end=None):
+        """List paths of files matching `keyword` and `suffix`.
+
+        The `keyword` is matched case-insensitively against the file
+        names, `suffix` against their endings. Files dated (by their
+        name or folder) outside of `start` and `end` (datetime.date) are
+        skipped, undated ones are kept only without the date filter.
+        """
+
+        entries = self._by_suffix(suffix)
+        if keyword:
+            keyword = keyword.lower()
+            entries = [
+                entry for entry in entries if keyword in entry.name.lower()
+            ]
+
+        if start is not None or end is not None:
+            entries = [
+                entry for entry in entries if _within(entry, start, end)
+            ]
+
+        return [entry.path for entry in entries]
+
+    def glob(self, pattern):
+        """List paths of files whose relative path matches `pattern`."""
+
+        pattern = os.path.normcase(pattern)
+        return [
+            entry.path
+            for entry in self.entries
+            if fnmatch.fnmatch(
+                os.path.normcase(os.path.join(entry.folder, entry.name)),
+                pattern,
+            )
+            or fnmatch.fnmatch(os.path.normcase(entry.name), pattern)
+        ]
+
+    def keyword(self, token):
+        """List paths of files with `token` among the words of the name.
+
+        Words are separated by hyphens, underscores, dots and spaces,
+        e.g. 'location' for 2023-04-17_sample_location-C.dat.
+        """
+
+        return [entry.path for entry in self.by_keyword.get(token.lower(), [])]
+
+    def on(self, date):
+        """List paths of files dated `date` (datetime.date)."""
+
+        return [entry.path for entry in self.by_date.get(date, [])]
+
+    def print_tree(self):
+        """Print the catalogued directory tree with proper indents."""
+
+        for folder in sorted(self.contents):
+            depth = 0 if folder == '' else folder.count(os.sep) + 1
+            if folder:
+                print('  ' * (depth - 1) + '+ ' + os.path.basename(folder))
+            for name in self.contents[folder]:
+                print('  ' * depth + '- ' + name)
+
+    def _scan_folder(self, folder):
+        """Catalog the files of one folder and return its subfolders."""
+
+        folder_path = os.path.join(self.root, folder)
+        names, subfolders = [], []
+        try:
+            with os.scandir(folder_path) as it:
+                for item in it:
+                    # Skip hidden items, e.g. caches and the catalog file
+                    if item.name.startswith('.'):
+                        continue
+                    if item.is_dir():
+                        subfolders.append(os.path.join(folder, item.name))
+                    else:
+                        names.append(item.name)
+            mtime = os.stat(folder_path).st_mtime_ns
+        except OSError:
+            self._drop(folder)
+            return []
+
+        self.folders[folder] = mtime
+        self.contents[folder] = sorted(names)
+        return subfolders
+
+    def _drop(self, folder):
+        """Forget `folder` and all its subfolders."""
+
+        prefix = folder + os.sep
+        for known in list(self.folders):
+            if known == folder or known.startswith(prefix):
+                del self.folders[known]
+                self.contents.pop(known, None)
+
+    def _drop_missing(self, folder):
+        """Forget subfolders of `folder` which no longer exist.
+
+        Return True if any subfolder has been forgotten.
+        """
+
+        prefix = '' if folder == '' else folder + os.sep
+        dropped = False
+        for known in list(self.folders):
+            if (
+                known in self.folders
+                and known.startswith(prefix)
+                and known != folder
+                and os.sep not in known[len(prefix) :]
+                and not os.path.isdir(os.path.join(self.root, known))
+            ):
+                self._drop(known)
+                dropped = True
+        return dropped
+
+    def _load(self, catalog_path=None):
+        """Read the persisted state, return False if it is unusable."""
+
+        if catalog_path is None:
+            catalog_path = os.path.join(self.root, CATALOG_FILE)
+        try:
+            with open(catalog_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if (
+            state.get('version') != CATALOG_VERSION
+            or state.get('root') != self.root
+        ):
+            return False
+
+        self.folders = state['folders']
+        self.contents = state['contents']
+        self._index()
+        return True
+
+    def _index(self):
+        """Rebuild the lookup tables from the folder contents."""
+
+        self.entries = [
+            Entry(self.root, folder, name)
+            for folder in sorted(self.contents)
+            for name in self.contents[folder]
+        ]
+        self.by_name, self.by_suffix, self.by_date = {}, {}, {}
+        self.by_keyword = {}
+        for entry in self.entries:
+            self.by_name.setdefault(entry.name, []).append(entry)
+            self.by_suffix.setdefault(entry.suffix, []).append(entry)
+            if entry.date is not None:
+                self.by_date.setdefault(entry.date, []).append(entry)
+            for token in set(_TOKENS.split(entry.name.lower())):
+                self.by_keyword.setdefault(token, []).append(entry)
+
+    def _by_suffix(self, suffix):
+        if not suffix:
+            return self.entries
+        if suffix in self.by_suffix:
+            return self.by_suffix[suffix]
+        return [entry for entry in self.entries if entry.name.endswith(suffix)]
+
+
+def file_date(name):
+    """Parse the date from a file name, e.g. 2023-04-17_location-C.dat."""
+
+    match = _DATE.search(name)
+    if match is None:
+        return None
+    try:
+        return datetime.date(*(int(group) for group in match.groups()))
+    except ValueError:
+        return None
+
+
+def file_suffix(name):
+    """Return the ending of a file name after the last hyphen or dot.
+
+    For MINI-WRAS files it is the file type, e.g. 'C.dat' or 'M.dat'.
+    """
+
+    stem, dot, extension = name.rpartition('.')
+    if not dot:
+        return ''
+    if '-' in stem:
+        return f"{stem.rpartition('-')[2]}.{extension}"
+    return f'.{extension}'
+
+
+def folder_month(folder):
+    """Parse the month from a folder name, e.g. 2023-04."""
+
+    match = _MONTH.fullmatch(folder)
+    return folder if match is not None else None
+
+
+def _within(entry, start, end):
+    if entry.date is not None:
+        first = last = entry.date
+    elif entry.month is not None:
+        # Files dated by their folder span the whole month
+        year, month = (int(part) for part in entry.month.split('-'))
+        first = datetime.date(year, month, 1)
+        last = datetime.date(
+            year + month // 12, month % 12 + 1, 1
+        ) - datetime.timedelta(days=1)
+    else:
+        return False
+    return (start is None or last >= start) and (end is None or first <= end)
+
+
+def main():
+    from helpers import path
+
+    Catalog.open(path).print_tree()
+
+
+if __name__ == '__main__':
+    main()
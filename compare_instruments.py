@@ -0,0 +1,198 @@
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+import numpy as np
+import os
+import pandas as pd
+import sys
+
+import instruments
+import rollup
+
+from matplotlib import ticker
+from catalog import Catalog
+from helpers import (
+    determine_data_file,
+    new_figure,
+    num_to_mass,
+    parse_arguments,
+    read_merged,
+    render_figures,
+    y_formatter_function,
+    mm,
+    path,
+    ro,
+    corr_fact,
+    title_font,
+    label_font,
+    tick_font,
+    within,
+)
+from profiling import stage
+
+
+def main():
+    # Parse the command-line arguments
+    args = parse_arguments(
+        batch=True,
+        mass=True,
+        max_memory=True,
+        nano=True,
+        period=True,
+        profile=True,
+    )
+
+    # Variables to properly name chart files
+    fig_suffix, fig_suffix2 = '', ''
+
+    # Determine the usage of total.csv or nano.csv
+    data_file, column_name, fig_suffix = determine_data_file(args)
+
+    # Logic for determining mass concentration
+    if args.mass:
+        column_name = 'total mass'
+        fig_suffix2 = '-mass'
+        ylabel = 'Mass concentration [$\mathregular{mg/m^3}$]'
+    else:
+        ylabel = 'Number concentration [particles/$\mathregular{cm^3}$]'
+
+    # Merged data of every instrument, see merge_mini_wras_data.py
+    merged = instruments.find_merged(Catalog.open(path), data_file)
+    if len(merged) < 2:
+        sys.exit(f'Merged {data_file} of at least two instruments needed.')
+
+    # Daily means of every instrument, taken from the rollups saved by
+    # the merge, so the merged data isn't read again
+    means = {}
+    for instrument, data_path in merged:
+        label = (
+            str(instrument)
+            if instrument is not None
+            else os.path.dirname(data_path)
+        )
+        means[label] = daily_means(
+            data_path,
+            column_name,
+            args.mass,
+            args.max_memory,
+            args.start,
+            args.stop,
+        )
+    daily = pd.DataFrame(means).sort_index()
+
+    # Nothing to compare, e.g. before or after the measurements
+    if daily.dropna(how='all').empty:
+        sys.exit('No data in the given period.')
+
+    print(format_comparison(daily))
+
+    # Save figure next to the data of all instruments
+    fig_name = f'instruments{fig_suffix}{fig_suffix2}'
+    fig_path = os.path.join(path, f'{fig_name}.png')
+    title = f'Daily means {daily.index[0]:%Y}'
+    render_figures(
+        [(plot_comparison, (daily, title, ylabel), fig_name, fig_path)], args
+    )
+
+
+def daily_means(
+    data_path, column, mass=False, max_memory=None, start=None, stop=None
+):
+    """Return the daily means of `column` of the merged data.
+
+    The means are calculated from the rollups of the data or, if they
+    are missing or outdated, from the merged data read chunk by chunk.
+    With `start` and/or `stop` (datetime64), return the days from
+    `start` up to `stop` (excluded) only.
+    """
+
+    data_rollup = rollup.load(data_path, mass)
+    if data_rollup is None:
+        print(
+            f'Rollups of {data_path} are missing or outdated, '
+            'reading the merged data.'
+        )
+        for chunk in read_merged(data_path, max_memory, start, stop):
+            if mass:
+                chunk = num_to_mass(chunk, ro, corr_fact)
+            with stage('grouping', data_path, len(chunk)):
+                chunk_rollup = rollup.Rollup(chunk.columns).update(chunk)
+            if data_rollup is None:
+                data_rollup = chunk_rollup
+            else:
+                data_rollup.merge(chunk_rollup)
+        if data_rollup is None:
+            return pd.Series(dtype=np.float64)
+
+    sums, counts = data_rollup.frames('day')
+    days = pd.DatetimeIndex([pd.Timestamp(*key) for key in sums.index])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = pd.Series(
+            sums[column].to_numpy() / counts[column].to_numpy(), index=days
+        )
+    return means[within(days, start, stop)]
+
+
+def format_comparison(daily):
+    """Format a table comparing the instruments with the first one.
+
+    For every instrument (column of `daily`), show the number of days
+    measured and the mean of the daily means. The ratio of the means and
+    the correlation of the daily means are calculated over the days
+    measured by both the instrument and the first one.
+    """
+
+    reference = daily.columns[0]
+    width = max(len(label) for label in daily.columns)
+    lines = [
+        f"{'instrument':<{width}} {'days':>5} {'mean':>10} "
+        f"{'ratio':>7} {'r':>6}"
+    ]
+    for label in daily.columns:
+        common = daily[label].notna() & daily[reference].notna()
+        values = daily.loc[common, label]
+        references = daily.loc[common, reference]
+        ratio = values.mean() / references.mean() if common.any() else np.nan
+        # The correlation is undefined for less than 2 days
+        correlation = values.corr(references) if common.sum() > 1 else np.nan
+        lines.append(
+            f'{label:<{width}} {daily[label].count():>5} '
+            f'{daily[label].mean():>10.4g} {ratio:>7.3f} '
+            f'{correlation:>6.3f}'
+        )
+    lines.append(f'Ratios and correlations are relative to {reference}.')
+    return '\n'.join(lines)
+
+
+def plot_comparison(daily, title, ylabel):
+    """Plot the daily means of every instrument (column of `daily`)."""
+
+    new_figure((150 * mm, 90 * mm), layout='constrained')
+    for label in daily.columns:
+        plt.plot(
+            daily.index,
+            daily[label],
+            marker='o',
+            markersize=2,
+            linewidth=0.7,
+            label=label,
+        )
+
+    # X-axis
+    plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%d/%m'))
+    plt.xticks(**tick_font)
+    plt.xlabel('Day [dd/mm]', **label_font)
+
+    # Y-axis
+    plt.gca().yaxis.set_major_formatter(
+        ticker.FuncFormatter(y_formatter_function)
+    )
+    plt.yticks(**tick_font)
+    plt.ylabel(ylabel, **label_font)
+    plt.ylim(bottom=0)
+
+    plt.title(title, **title_font)
+    plt.legend(loc='best', fontsize=6)
+
+
+if __name__ == '__main__':
+    main()
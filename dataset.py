@@ -0,0 +1,196 @@
+import numpy as np
+
+from dataclasses import dataclass
+
+from reader import Header
+
+# Upper diameter [nm] of the nanoparticle size bins
+NANO_LIMIT = 100
+
+
+@dataclass
+class MiniWrasDataset:
+    """Measurements of a MINI-WRAS data file held in plain arrays.
+
+    `times` are the timestamps in seconds since the epoch (int64) and
+    `values` a C-contiguous 2-D array with one column per label in
+    `header.columns`, float64 by default or float32 to halve the memory.
+    The size bins, the total column and the nanoparticle band are views
+    into `values`, so they are never copied. Convert to DataFrames with
+    to_frames() only where pandas is needed, e.g. to save CSV files.
+    """
+
+    header: Header
+    times: np.ndarray
+    values: np.ndarray
+
+    @classmethod
+    def from_arrays(cls, header, timestamps, values, dtype=None):
+        """Build a dataset from read_dat() results.
+
+        `timestamps` are datetime64 values, `values` are converted to
+        `dtype` (float64 if None) unless they already have it.
+        """
+
+        times = np.asarray(timestamps, dtype='datetime64[s]').view(np.int64)
+        values = np.ascontiguousarray(values, dtype=dtype or np.float64)
+        return cls(header, times, values)
+
+    @classmethod
+    def from_frame(cls, dataframe, header=None, dtype=None):
+        """Build a dataset from a DataFrame indexed by date and time.
+
+        The columns of `header` are replaced by the ones of `dataframe`,
+        e.g. for merged data which keeps no header.
+        """
+
+        header = Header() if header is None else Header(**vars(header))
+        header.set_columns([str(column) for column in dataframe.columns])
+        return cls.from_arrays(
+            header,
+            dataframe.index.to_numpy(dtype='datetime64[s]'),
+            dataframe.to_numpy(dtype=dtype or np.float64),
+            dtype,
+        )
+
+    @classmethod
+    def concat(cls, datasets):
+        """Join `datasets` with the same columns, e.g. of several days."""
+
+        first = datasets[0]
+        return cls(
+            first.header,
+            np.concatenate([dataset.times for dataset in datasets]),
+            np.concatenate([dataset.values for dataset in datasets]),
+        )
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, rows):
+        """Return the `rows` (a slice gives views of the arrays)."""
+
+        return MiniWrasDataset(
+            self.header, self.times[rows], self.values[rows]
+        )
+
+    @property
+    def nbytes(self):
+        """Return the memory taken by the arrays in bytes."""
+
+        return self.times.nbytes + self.values.nbytes
+
+    @property
+    def dtype(self):
+        """Return the dtype of `values`."""
+
+        return self.values.dtype
+
+    @property
+    def timestamps(self):
+        """Return the timestamps as datetime64[s] (a view of `times`)."""
+
+        return self.times.view('datetime64[s]')
+
+    @property
+    def diameters(self):
+        """Return the diameters [nm] of the size bins."""
+
+        return self.header.diameters
+
+    @property
+    def bins(self):
+        """Return the size bin columns of `values` (a view)."""
+
+        return self.values[:, self.header.bins]
+
+    @property
+    def total(self):
+        """Return the first column, e.g. 'total counts' (a view)."""
+
+        return self.values[:, 0]
+
+    @property
+    def nano(self):
+        """Return the size bins up to NANO_LIMIT (a view)."""
+
+        start = self.header.bins.start
+        stop = start + np.searchsorted(self.diameters, NANO_LIMIT, 'right')
+        return self.values[:, start:stop]
+
+    def nano_total(self):
+        """Sum the nanoparticle bins of each row, skipping missing ones."""
+
+        return np.nansum(self.nano, axis=1)
+
+    def between(self, start=None, stop=None):
+        """Return the rows from `start` up to `stop` (excluded) as a view.
+
+        Bounds are anything numpy converts to datetime64, e.g. strings
+        such as '2023-04-17' or datetime objects. Timestamps are sorted,
+        so the rows are found by binary search.
+        """
+
+        first, last = 0, len(self.times)
+        if start is not None:
+            first = np.searchsorted(self.times, _seconds(start))
+        if stop is not None:
+            last = np.searchsorted(self.times, _seconds(stop))
+        return MiniWrasDataset(
+            self.header, self.times[first:last], self.values[first:last]
+        )
+
+    def means(self):
+        """Return the means of the columns, skipping missing values.
+
+        Means are accumulated in float64 whatever the dtype of `values`.
+        """
+
+        counts = np.sum(~np.isnan(self.values), axis=0)
+        sums = np.nansum(self.values, axis=0, dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / counts
+
+    def to_mass(self, masses):
+        """Convert number to mass concentrations of the size bins.
+
+        `masses` are the mass concentrations of one particle per bin
+        (see helpers.particle_masses()). Return a dataset with the total
+        mass of each row followed by the masses of the bins.
+        """
+
+        bins = self.header.bins
+        values = np.empty((len(self), bins.stop - bins.start + 1), self.dtype)
+        np.multiply(self.bins, masses, out=values[:, 1:])
+        values[:, 0] = np.nansum(values[:, 1:], axis=1)
+
+        header = Header(**vars(self.header))
+        header.set_columns(['total mass'] + self.header.columns[bins])
+        return MiniWrasDataset(header, self.times, values)
+
+    def to_frames(self):
+        """Return DataFrames of all the columns and of the nanoparticles.
+
+        The nanoparticle DataFrame starts with the 'total nano' column.
+        """
+
+        import pandas as pd
+
+        index = pd.DatetimeIndex(self.timestamps, name='date and time')
+        df = pd.DataFrame(
+            self.values, index=index, columns=self.header.columns
+        )
+
+        start = self.header.bins.start
+        nano_columns = self.header.columns[start:][: self.nano.shape[1]]
+        nano = pd.DataFrame(
+            np.column_stack([self.nano_total(), self.nano]),
+            index=index,
+            columns=['total nano'] + nano_columns,
+        )
+
+        return df, nano
+
+
+def _seconds(moment):
+    return np.datetime64(moment, 's').astype(np.int64)
@@ -1,3 +1,4 @@
+import functools
 import locale
 import math
 import matplotlib.pyplot as plt
@@ -6,17 +7,21 @@ import os
 import pandas as pd
 import sys
 
+import instruments
+import rollup
+
 from matplotlib import ticker
+from catalog import Catalog
 from helpers import (
     determine_data_file,
-    directory_tree,
-    get_path,
-    list_files,
+    merged_data_path,
+    diameter_columns,
+    new_figure,
     num_to_mass,
     parse_arguments,
-    process_file,
-    save_figure,
-    tell_parent,
+    prefetch,
+    read_merged,
+    render_figures,
     mm,
     path,
     ro,
@@ -24,16 +29,31 @@ from helpers import (
     title_font,
     label_font,
     tick_font,
+    within,
 )
+from profiling import stage
 
 
 def main():
+    # Parse the command-line arguments
+    args = parse_arguments(
+        batch=True,
+        combine=True,
+        instrument=True,
+        jobs=True,
+        keyword=True,
+        separately=True,
+        mass=True,
+        max_memory=True,
+        period=True,
+        prefetch=True,
+        profile=True,
+        raw=True,
+    )
+
     # Ensure proper language formatting, e.g. months' names
     locale.setlocale(locale.LC_ALL, 'en_US')
 
-    # Parse the command-line arguments
-    args = parse_arguments(keyword=True, separately=True, mass=True)
-
     # Variables to properly name chart files
     fig_suffix, fig_suffix2 = '', ''
 
@@ -46,84 +66,251 @@ def main():
         if args.keyword and args.separately:
             sys.exit('Only one flag can be used: -k or -s.')
 
-        # Load data
-        dir_tree = directory_tree(path)
-        files = list_files(dir_tree, args.keyword, 'C.dat')
-        for file in files:
-            df, _ = process_file(dir_tree, file)
+        # Logic to plot mass distributions for each file
+        if args.mass:
+            title_prefix = 'Mass'
+            fig_suffix2 = '-mass'
+        else:
+            title_prefix = 'Number'
 
-            # Logic to plot mass distributions for each file
-            if args.mass:
-                df = num_to_mass(df, ro, corr_fact)
-                title_prefix = 'Mass'
-                fig_suffix2 = '-mass'
-            else:
-                title_prefix = 'Number'
+        files = Catalog.open(path).files(args.keyword, 'C.dat')
+        if args.instrument is not None:
+            files = instruments.select_files(files, args.instrument)
+
+        # Logic to plot one distribution chart of all the files, added up
+        # from their summaries
+        if args.combine:
+            means = summary_means(
+                files, args.mass, args.start, args.stop, args.prefetch
+            )
+            if means is None or means.isna().all():
+                sys.exit('No data in the given period.')
+
+            # Save figure if requested
+            fig_name = (
+                f'distribution-({args.keyword}){fig_suffix}{fig_suffix2}'
+            )
+            fig_path = os.path.join(path, f'{fig_name}.png')
+            title = f'{title_prefix} size distribution'
+            render_figures(
+                [(plot_distribution, (means, title), fig_name, fig_path)],
+                args,
+            )
+            sys.exit()
+
+        # Only the files with data in the period get a figure
+        if args.start is not None or args.stop is not None:
+            files = files_with_data(
+                files, args.mass, args.start, args.stop, args.prefetch
+            )
+            if not files:
+                sys.exit('No data in the given period.')
 
-            name_suffix = f"-({file[:file.rfind('-')]})"
-            plot_distribution(df, f'{title_prefix} size distribution')
+        # Figures of the files are independent, so they are collected
+        # first and rendered together, loading the next files while the
+        # current one is plotted
+        figures = []
+        for file in files:
+            file_name = os.path.basename(file)
+            name_suffix = f"-({file_name[:file_name.rfind('-')]})"
 
             # Save figure if requested
-            parent = tell_parent(get_path(dir_tree, file, path))
             fig_name = f"distribution{name_suffix}{fig_suffix}{fig_suffix2}"
-            fig_path = os.path.join(
-                get_path(dir_tree, parent, path), f'{fig_name}.png'
+            fig_path = os.path.join(os.path.dirname(file), f'{fig_name}.png')
+            figures.append(
+                (
+                    plot_distribution,
+                    (
+                        file,
+                        f'{title_prefix} size distribution',
+                        args.mass,
+                        args.start,
+                        args.stop,
+                    ),
+                    fig_name,
+                    fig_path,
+                )
             )
-            save_figure(fig_name, fig_path)
+
+        render_figures(figures, args, load=load_file_summary)
 
         # Exit to avoid saving the plots again
         sys.exit()
 
     # Logic to load data from merged-data
     else:
-        # Load data
-        dir_tree = directory_tree(path)
-        df = pd.read_csv(get_path(dir_tree, data_file, path), index_col=0)
-
-        # Conversion of MINI-WRAS dates to datetime format
-        df.index = pd.to_datetime(df.index, dayfirst=True)
-
         # Logic for determining mass concentration
         if args.mass:
-            df = num_to_mass(df, ro, corr_fact)
             title_prefix = 'Mass'
             fig_suffix2 = '-mass'
         else:
             title_prefix = 'Number'
 
+        # Load monthly sums from the rollups saved by the merge, unless
+        # the raw merged data is requested
+        data_path = merged_data_path(
+            Catalog.open(path), data_file, args.instrument
+        )
+        data_rollup = None if args.raw else rollup.load(data_path, args.mass)
+        period = args.start is not None or args.stop is not None
+        if data_rollup is not None and not period:
+            sums, counts = data_rollup.frames('month')
+
+        # Months of a period are summed up from its days
+        elif data_rollup is not None:
+            sums, counts = data_rollup.frames('day')
+            days = pd.DatetimeIndex([pd.Timestamp(*key) for key in sums.index])
+            selected = within(days, args.start, args.stop)
+            sums = sums[selected].groupby(level=[0, 1]).sum()
+            counts = counts[selected].groupby(level=[0, 1]).sum()
+
+        # Otherwise sum the data up by month chunk by chunk
+        else:
+            if not args.raw:
+                print(
+                    'Rollups are missing or outdated, '
+                    'reading the merged data.'
+                )
+            sums, counts = sum_by_month(
+                read_merged(data_path, args.max_memory, args.start, args.stop),
+                args.mass,
+            )
+
+        # Nothing to plot, e.g. before or after the measurements
+        if sums is None or len(sums) == 0:
+            sys.exit('No data in the given period.')
+
     # Logic to plot distribution charts separately for each month
     if args.separately:
-        # _ is used to ignore the year-month pairs that are generate by
-        # dataframe.groupby(). We're not interested in the year-month pairs,
-        # but only in the group which contains the data for each month.
-        for _, group in df.groupby([df.index.year, df.index.month]):
-            month = f'{group.first_valid_index():%B}'
-            year = f'{group.first_valid_index():%Y}'
-            title = f'{title_prefix} size distribution {month} {year}'
-            name_suffix = f'-{group.first_valid_index():%B}-{year}'
-            plot_distribution(group, title)
+        figures = []
+        for year, month in sums.index:
+            first_day = pd.Timestamp(year=year, month=month, day=1)
+            title = f'{title_prefix} size distribution {first_day:%B %Y}'
+            name_suffix = f'-{first_day:%B}-{year}'
+            means = sums.loc[(year, month)] / counts.loc[(year, month)]
 
             # Save figure if requested
-            parent = tell_parent(get_path(dir_tree, data_file, path))
             fig_name = f'distribution{name_suffix}{fig_suffix}{fig_suffix2}'
             fig_path = os.path.join(
-                get_path(dir_tree, parent, path), f'{fig_name}.png'
+                os.path.dirname(data_path), f'{fig_name}.png'
+            )
+            figures.append(
+                (plot_distribution, (means, title), fig_name, fig_path)
             )
-            save_figure(fig_name, fig_path)
+
+        render_figures(figures, args)
 
     # Logic to plot one distribution chart
     else:
-        title = f'{title_prefix} size distribution {df.first_valid_index():%Y}'
+        year = sums.index[0][0]
+        title = f'{title_prefix} size distribution {year}'
         name_suffix = ''
-        plot_distribution(df, title)
+        means = sums.sum() / counts.sum()
 
         # Save figure if requested
-        parent = tell_parent(get_path(dir_tree, data_file, path))
         fig_name = f'distribution{name_suffix}{fig_suffix}{fig_suffix2}'
-        fig_path = os.path.join(
-            get_path(dir_tree, parent, path), f'{fig_name}.png'
+        fig_path = os.path.join(os.path.dirname(data_path), f'{fig_name}.png')
+        render_figures(
+            [(plot_distribution, (means, title), fig_name, fig_path)], args
         )
-        save_figure(fig_name, fig_path)
+
+
+def sum_by_month(chunks, mass=False):
+    """Sum up and count values of `chunks` (DataFrames) by month.
+
+    Return DataFrames of sums and counts of non-missing values, both
+    indexed by (year, month), so that means of any set of months can
+    be calculated without holding all the rows in memory.
+    """
+
+    sums, counts = None, None
+    for chunk in chunks:
+        if mass:
+            chunk = num_to_mass(chunk, ro, corr_fact)
+
+        with stage('grouping', rows=len(chunk)):
+            grouped = chunk.groupby([chunk.index.year, chunk.index.month])
+            if sums is None:
+                sums, counts = grouped.sum(), grouped.count()
+            else:
+                sums = sums.add(grouped.sum(), fill_value=0)
+                counts = counts.add(grouped.count(), fill_value=0)
+
+    return sums, counts
+
+
+def load_file_summary(file, title, mass=False, start=None, stop=None):
+    """Return the arguments of plot_distribution() for one data file.
+
+    The means are calculated from the summary of the file, see
+    summary_means().
+    """
+
+    return summary_means([file], mass, start, stop), title
+
+
+def summary_means(files, mass=False, start=None, stop=None, depth=0):
+    """Return the means of the columns of `files` from their summaries.
+
+    Every file is summarized by the sums and counts of its columns per
+    day, in number and mass concentrations, which are kept in its
+    rollups in the parse cache (see rollup.file_totals()). Distributions
+    of any files and days are then added up from the summaries without
+    reading the rows again. With `start` and/or `stop` (datetime64), add
+    up the days from `start` up to `stop` (excluded) only. With `depth`,
+    summaries are read ahead in that many threads (see prefetch()).
+    Return None if there are no `files`.
+    """
+
+    totals = file_totals(files, mass, start, stop, depth)
+    columns, sums, counts = None, 0, 0
+    for file, (file_columns, file_sums, file_counts) in zip(files, totals):
+        if columns is None:
+            columns = file_columns
+        elif file_columns != columns:
+            raise ValueError(f'Columns of {file} differ from other files')
+        sums = sums + file_sums
+        counts = counts + file_counts
+
+    if columns is None:
+        return None
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.Series(sums / counts, index=columns)
+
+
+def files_with_data(files, mass=False, start=None, stop=None, depth=0):
+    """List `files` with data from `start` up to `stop` (excluded).
+
+    A file may run over several days after the date in its name, so the
+    files are selected by the days of their summaries instead (see
+    summary_means()).
+    """
+
+    totals = file_totals(files, mass, start, stop, depth)
+    return [
+        file
+        for file, (_, _, counts) in zip(files, totals)
+        if np.sum(counts) > 0
+    ]
+
+
+def file_totals(files, mass=False, start=None, stop=None, depth=0):
+    """Yield the sums and counts of the days of every file of `files`.
+
+    See rollup.file_totals() and, for `depth`, prefetch().
+    """
+
+    return prefetch(
+        functools.partial(
+            rollup.file_totals,
+            dataset=rollup.dataset_name('total', mass),
+            output_files=['total', 'nano'],
+            start=start,
+            stop=stop,
+        ),
+        files,
+        depth,
+    )
 
 
 def plot_distribution(data, title):
@@ -132,7 +319,7 @@ def plot_distribution(data, title):
     # Prepare data for plotting
     averages, dims = process_data(data)
 
-    plt.figure(figsize=(150 * mm, 90 * mm), dpi=300, layout='constrained')
+    new_figure((150 * mm, 90 * mm), layout='constrained')
     plt.bar(
         dims,
         averages.loc['frac'][1:],
@@ -151,8 +338,10 @@ def plot_distribution(data, title):
 def process_data(data):
     """Prepare data for the distribution chart."""
 
-    # Calculate the values needed
-    means = data.mean().to_frame().transpose()
+    # Calculate the values needed, `data` holds either the rows or
+    # already calculated means of the columns
+    means = data if isinstance(data, pd.Series) else data.mean()
+    means = means.to_frame().transpose()
     fractions = means.divide(means.iloc[:, 1:].sum(axis=1), axis=0) * 100
 
     # Concatenate the average and fractions DataFrames along the rows
@@ -161,7 +350,7 @@ def process_data(data):
     averages.set_index(pd.Index(['mean', 'frac']), inplace=True)
 
     # Set particle diameters from MINI-WRAS
-    dims = [int(x) for x in averages.columns[1:]]
+    dims = diameter_columns(averages.columns)[1].tolist()
 
     return averages, dims
 
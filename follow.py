@@ -0,0 +1,173 @@
+import numpy as np
+
+import cache
+import rollup
+
+from dataset import MiniWrasDataset
+from profiling import stage
+from reader import parse_head, parse_rows
+
+# Rows the arrays of a Tail are first allocated for, one day of 1-minute
+# measurements
+INITIAL_ROWS = 1440
+
+
+class Tail:
+    """Follow a MINI-WRAS data file while the instrument appends to it.
+
+    Every poll() reads only the bytes appended since the previous one
+    and parses the complete lines among them; a partly written last line
+    is left for the next poll. Rows are appended to arrays which grow by
+    doubling, and the running means of the total and nanoparticle
+    concentrations and the rollups of the file (see rollup.py) are
+    updated with the new rows only, so a poll costs in proportion to the
+    new lines rather than to the size of the file.
+
+    Whenever the whole file has been parsed, its rollups are kept in the
+    parse cache, as rollup.file_rollups() does, so merging the file or
+    plotting its distribution (distribution.py -k) later doesn't parse
+    it again, as long as it hasn't grown since.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.reset()
+
+    def reset(self):
+        """Forget the data read so far, e.g. when the file is replaced."""
+
+        # Bytes of the file parsed so far
+        self.offset = 0
+        self.header = None
+        self.rows = 0
+        self._times = np.empty(0, dtype=np.int64)
+        self._values = None
+        # Sums and counts of the non-missing values of the total and
+        # nanoparticle concentrations
+        self._sums = np.zeros(2)
+        self._counts = np.zeros(2, dtype=np.int64)
+        # Rollups of the file, as by rollup.file_rollups()
+        self.rollups = {}
+
+    @property
+    def data(self):
+        """Return the rows read so far as a MiniWrasDataset (views)."""
+
+        return MiniWrasDataset(
+            self.header,
+            self._times[: self.rows],
+            self._values[: self.rows],
+        )
+
+    @property
+    def avg_conc(self):
+        """Return the mean total concentration of the rows read so far."""
+
+        return self._mean(0)
+
+    @property
+    def avg_nano_conc(self):
+        """Return the mean nanoparticle concentration read so far."""
+
+        return self._mean(1)
+
+    def poll(self):
+        """Parse the lines appended since the last poll.
+
+        Return the number of new rows. If the file has shrunk, e.g. it
+        was replaced, it is read again from the start.
+        """
+
+        try:
+            # Taken before reading, see cache.store()
+            key = cache.source_key(self.file_path)
+        except OSError:
+            # Not created yet or being replaced
+            return 0
+        size = int(key[1])
+        if size < self.offset:
+            self.reset()
+        if size == self.offset:
+            return 0
+
+        with open(self.file_path, 'rb') as f:
+            f.seek(self.offset)
+            raw = f.read(size - self.offset)
+
+        start = 0
+        if self.header is None:
+            try:
+                self.header, start = parse_head(raw, self.file_path)
+            except ValueError:
+                # The header is still being written
+                self.header = None
+                return 0
+            self._values = np.empty((0, len(self.header.columns)))
+
+        # Only complete lines are parsed
+        end = raw.rfind(b'\n') + 1
+        if end <= start:
+            self.offset += start
+            return 0
+
+        with stage('tail', self.file_path) as measured:
+            timestamps, values = parse_rows(
+                raw[start:end], len(self.header.columns), self.file_path
+            )
+            measured.rows = len(values)
+            self.offset += end
+            self._append(
+                MiniWrasDataset.from_arrays(self.header, timestamps, values)
+            )
+
+        # A partly written last line is missing from the rollups
+        if self.offset == size:
+            rollup.store_file_rollups(self.file_path, key, self.rollups)
+        return len(values)
+
+    def _append(self, new):
+        """Add the rows of `new` to the arrays, means and rollups."""
+
+        rows = self.rows + len(new)
+        if rows > len(self._times):
+            capacity = max(rows, 2 * len(self._times), INITIAL_ROWS)
+            self._times = _grown(self._times, capacity, self.rows)
+            self._values = _grown(self._values, capacity, self.rows)
+        self._times[self.rows : rows] = new.times
+        self._values[self.rows : rows] = new.values
+        self.rows = rows
+
+        if self.header.kind == 'C':
+            totals = [new.total, new.nano_total()]
+            output_files = ['total', 'nano']
+        else:
+            totals = [new.total, np.empty(0)]
+            output_files = ['PMs']
+        for i, values in enumerate(totals):
+            self._sums[i] += np.nansum(values)
+            self._counts[i] += np.count_nonzero(~np.isnan(values))
+
+        # Roll up the new rows as the merge does, merging them into the
+        # days already rolled up
+        df, nano = new.to_frames()
+        for output_file in output_files:
+            frame = nano if 'nano' in output_file else df
+            for dataset, data in rollup.datasets(output_file, frame):
+                new_rollup = rollup.Rollup(data.columns).update(data)
+                if dataset in self.rollups:
+                    self.rollups[dataset].merge(new_rollup)
+                else:
+                    self.rollups[dataset] = new_rollup
+
+    def _mean(self, i):
+        if self._counts[i] == 0:
+            return np.nan
+        return self._sums[i] / self._counts[i]
+
+
+def _grown(array, capacity, rows):
+    """Return a copy of the first `rows` of `array` with more capacity."""
+
+    grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:rows] = array[:rows]
+    return grown
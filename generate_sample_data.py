@@ -0,0 +1,256 @@
+import argparse
+import datetime
+import numpy as np
+import os
+import re
+
+from helpers import particle_masses
+
+# Size bins of MINI-WRAS in nm, as in the header of C.dat files
+DIAMETERS = [
+    10, 14, 19, 27, 37, 52, 72, 100, 139, 193, 253, 298, 352, 414, 488,
+    576, 679, 800, 943, 1112, 1310, 1545, 1821, 2146, 2530, 2982, 3515,
+    4144, 4885, 5758, 6787, 8001, 9431, 11120, 13100, 15450, 18210, 21460,
+    25300, 29820, 35150,
+]  # fmt: skip
+
+PM_COLUMNS = ['PM10', 'PM2.5', 'PM1', 'Inhalable', 'Thoracic', 'Alveolic']
+
+# Upper diameters (nm) of the particles counted in each PM fraction
+PM_CUTS = [10000, 2500, 1000, 100000, 10000, 4000]
+
+# Lognormal modes of the number size distribution: geometric mean
+# diameter (nm), geometric standard deviation and share of the total
+# number concentration, shaped after the sample data
+MODES = [(22, 1.7, 0.15), (110, 1.6, 0.85), (1500, 2.0, 4e-4)]
+
+# The instrument writes the same header to both files, so M.dat files
+# carry the unit of the number concentrations too, although their PM
+# values are in ug/m3 (see sample-data/one_day_sample-M.dat)
+HEADER = """<Header>
+User name:  user_name
+Location:  {location}
+Model: MINI-WRAS
+Serial No.: {serial_no}
+Software revision:  V8-1 Rev II (2017 Sept 26)
+Unit: [1/cm3] 
+Comment:  
+online data
+<Data>
+[d&t31/12/2035 11:50:55]\t{columns}
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic MINI-WRAS data files.'
+    )
+    parser.add_argument('output_dir', help='Folder to write the data files to')
+    parser.add_argument(
+        '--days', type=int, default=7, help='Number of days per instrument'
+    )
+    parser.add_argument(
+        '--sites', type=int, default=1, help='Number of measurement sites'
+    )
+    parser.add_argument(
+        '--instruments',
+        type=int,
+        default=1,
+        help='Number of instruments per site',
+    )
+    parser.add_argument(
+        '--start',
+        type=datetime.date.fromisoformat,
+        default=datetime.date(2023, 4, 17),
+        help='Date of the first day (YYYY-MM-DD)',
+    )
+    parser.add_argument(
+        '--seed', type=int, default=0, help='Seed of the random values'
+    )
+    args = parser.parse_args()
+
+    files = generate(
+        args.output_dir,
+        args.days,
+        args.sites,
+        args.instruments,
+        args.start,
+        args.seed,
+    )
+    print(f'Generated {len(files)} file(s) in {args.output_dir}.')
+
+
+def generate(
+    output_dir,
+    days,
+    sites=1,
+    instruments=1,
+    start=datetime.date(2023, 4, 17),
+    seed=0,
+):
+    """Write C.dat and M.dat files of `days` days to `output_dir`.
+
+    Every site gets its own folder with monthly subfolders, like
+    sample-data, e.g. site-1/2023-04/2023-04-17_site-1_location-C.dat.
+    With several `instruments` per site, their serial numbers end the
+    location in the file names. Return the paths of the written files.
+    """
+
+    rng = np.random.default_rng(seed)
+    files = []
+    for site in range(1, sites + 1):
+        for instrument in range(1, instruments + 1):
+            serial_no = f'71-15-{(site - 1) * instruments + instrument:02d}'
+            location = f'site-{site}_location'
+            name = location
+            if instruments > 1:
+                name = f'{location}_{serial_no}'
+
+            for day in range(days):
+                date = start + datetime.timedelta(days=day)
+                folder = os.path.join(
+                    output_dir, f'site-{site}', f'{date:%Y-%m}'
+                )
+                os.makedirs(folder, exist_ok=True)
+                files.extend(
+                    write_day(folder, name, date, location, serial_no, rng)
+                )
+
+    return files
+
+
+def write_day(folder, name, date, location, serial_no, rng):
+    """Write the C.dat and M.dat files of one day of measurements.
+
+    Files are named after the date and `name`, e.g.
+    2023-04-17_site-1_location-C.dat for the name site-1_location.
+    """
+
+    timestamps, numbers = simulate_numbers(date, rng)
+    pms = simulate_pms(numbers, rng)
+
+    stamps = [f'{stamp:%d/%m/%Y %H:%M:%S}' for stamp in timestamps]
+    total = numbers.sum(axis=1, keepdims=True)
+
+    paths = []
+    for kind, columns, values, fmt in [
+        (
+            'C',
+            ['total counts'] + DIAMETERS,
+            np.hstack([total, numbers]),
+            '%.3E',
+        ),
+        ('M', PM_COLUMNS, pms, '%.1f'),
+    ]:
+        file_path = os.path.join(folder, f'{date:%Y-%m-%d}_{name}-{kind}.dat')
+        header = HEADER.format(
+            location=location,
+            serial_no=serial_no,
+            columns='\t'.join(str(column) for column in columns),
+        )
+        with open(file_path, 'w', newline='\n') as f:
+            f.write(header)
+            f.write(format_rows(stamps, values, fmt))
+        paths.append(file_path)
+
+    return paths
+
+
+def simulate_numbers(date, rng):
+    """Simulate 1-minute number concentrations (1/cm^3) for one day.
+
+    The total concentration follows a daily cycle with autocorrelated
+    noise and occasional spikes, split into the size bins by a varying
+    mix of the lognormal MODES.
+    """
+
+    # Measurements start at a random second, every minute of the day
+    first = datetime.datetime.combine(date, datetime.time()) + (
+        datetime.timedelta(seconds=int(rng.integers(60)))
+    )
+    minutes = np.arange(24 * 60)
+    timestamps = [first + datetime.timedelta(minutes=int(m)) for m in minutes]
+
+    # Daily cycle with the rush hours and a random level of the day
+    hours = minutes / 60
+    cycle = (
+        1
+        + 0.5 * np.exp(-((hours - 8) ** 2) / 4)
+        + 0.4 * np.exp(-((hours - 17) ** 2) / 6)
+        - 0.3 * np.exp(-((hours - 3) ** 2) / 8)
+    )
+    level = 3000 * rng.lognormal(0, 0.3)
+
+    # Autocorrelated (AR(1)) noise in log space
+    noise = np.empty(len(minutes))
+    noise[0] = rng.normal(0, 0.2)
+    innovations = rng.normal(0, 0.05, len(minutes))
+    for i in range(1, len(minutes)):
+        noise[i] = 0.97 * noise[i - 1] + innovations[i]
+
+    total = level * cycle * np.exp(noise)
+    # Short spikes, e.g. from passing vehicles
+    spikes = rng.random(len(minutes)) < 0.004
+    total[spikes] *= rng.uniform(2, 10, spikes.sum())
+
+    # Shares of the bins for every minute, the nucleation mode grows
+    # with the noise and the spikes at the expense of the accumulation
+    # mode
+    log_d = np.log(DIAMETERS)
+    shapes = np.array(
+        [
+            np.exp(-((log_d - np.log(mean)) ** 2) / (2 * np.log(sd) ** 2))
+            for mean, sd, _ in MODES
+        ]
+    )
+    shapes /= shapes.sum(axis=1, keepdims=True)
+    (_, _, nucleation), _, (_, _, coarse) = MODES
+    nucleation = np.clip(nucleation + 0.1 * noise + 0.3 * spikes, 0.02, 0.8)
+    mix = np.column_stack(
+        [
+            nucleation * (1 - coarse),
+            (1 - nucleation) * (1 - coarse),
+            np.full(len(minutes), coarse),
+        ]
+    )
+    shares = mix @ shapes
+    shares *= rng.lognormal(0, 0.05, shares.shape)
+    shares /= shares.sum(axis=1, keepdims=True)
+
+    numbers = total[:, np.newaxis] * shares
+    # Counts below the resolution of the instrument
+    numbers[numbers < 1e-3] = 0
+    return timestamps, numbers
+
+
+def simulate_pms(numbers, rng):
+    """Derive PM mass concentrations (ug/m^3) from number concentrations.
+
+    Besides the mass of the counted particles, coarse dust which is
+    rarely counted adds to the larger fractions.
+    """
+
+    masses = numbers * particle_masses(DIAMETERS, 1680) * 1e3  # ug/m^3
+    diameters = np.array(DIAMETERS)
+    dust = 5 * rng.lognormal(0, 0.3) * np.exp(rng.normal(0, 0.1, len(numbers)))
+    pms = []
+    for cut in PM_CUTS:
+        mass = masses[:, diameters < cut].sum(axis=1)
+        pms.append(mass + dust * min(cut / 10000, 1.2))
+    return np.column_stack(pms)
+
+
+def format_rows(stamps, values, fmt):
+    """Format rows of tab-separated values as MINI-WRAS writes them."""
+
+    lines = [
+        '\t'.join([stamp] + [fmt % value for value in row])
+        for stamp, row in zip(stamps, values.tolist())
+    ]
+    text = '\n'.join(lines) + '\n'
+    # Exponents are written without leading zeros, e.g. 3.228E+3
+    return re.sub(r'E([+-])0*(\d)', r'E\1\2', text)
+
+
+if __name__ == '__main__':
+    main()
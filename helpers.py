@@ -1,12 +1,44 @@
 import argparse
+import collections
+import contextlib
+import functools
+import itertools
 import math
-import matplotlib.pyplot as plt
+import numpy as np
 import os
-import pandas as pd
+import re
+import sys
+
+import cache
+import instruments
+import manifest
+import profiling
+import store
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from dataset import MiniWrasDataset
+from profiling import stage
+from reader import Header, read_dat
+
+# matplotlib and pandas take most of the startup time, so they are
+# imported by the functions that need them, e.g. merging data never
+# imports matplotlib and listing files imports neither of them
 
 # Define the path to the data
 path = r'C:\Users\Adrian\Desktop\repos\mini-wras-analysis'
 
+# Define the folder for the parse cache of data files, None keeps it
+# next to the data files
+cache_dir = None
+
+# Estimated memory needed per value while parsing a chunk of merged
+# data, including pandas parser buffers and the converted copies
+chunk_bytes_per_value = 40
+
+# Rendering session whose figures are reused, see rendering()
+session = None
+
 # Define constants
 mm = 1 / 25.4  # Conversion factor from inches to mm
 ro = 1680  # kg/m^3
@@ -18,27 +50,6 @@ label_font = {'fontname': 'Verdana', 'fontsize': 8, 'weight': 'bold'}
 tick_font = {'fontname': 'Verdana', 'fontsize': 8}
 
 
-def directory_tree(path=os.getcwd()):
-    """Generate nested dictionary representing the directory tree."""
-
-    tree = {}
-    # Iterate over items (folders and files) in the root directory
-    for item in os.listdir(path):
-        # Create the full path to the current item
-        item_path = os.path.join(path, item)
-
-        # Check if the current item is a directory
-        if os.path.isdir(item_path):
-            # If it's a directory, recursively generate the tree for
-            # the subdirectory
-            tree[item] = directory_tree(item_path)
-        else:
-            # If it's a file, add it to the tree with a value of None
-            tree[item] = None
-
-    return tree
-
-
 def determine_data_file(args):
     """Determine usage of particles or nanoparticles concentration."""
 
@@ -51,47 +62,49 @@ def determine_data_file(args):
         return 'total.csv', 'total counts', ''
 
 
-def get_path(tree, tree_item, prefix=os.getcwd()):
-    """Recursively search for a `tree_item` in a directory `tree`."""
+def diameter_columns(columns):
+    """Find the size bin columns among `columns` (hashable sequence).
 
-    for item, subtree in tree.items():
-        # Construct the full path
-        item_path = os.path.join(prefix, item)
+    Return a tuple (positions, diameters) with the positions of the
+    columns named after diameters in nanometers and the diameters as
+    a numpy array. Other columns, e.g. 'total counts', are omitted.
+    """
 
-        # Check if 'item' matches the target_file (base case)
-        if item == tree_item:
-            return item_path
-        # Check if 'subtree' is a subdirectory (a nested dictionary)
-        elif isinstance(subtree, dict):
-            # Recursively search the subdirectory
-            result = get_path(subtree, tree_item, item_path)
-            if result is not None:
-                return result
+    return _diameter_columns(tuple(columns))
 
-    # If target file is not found in this level of the directory tree
-    return None
 
+@functools.lru_cache(maxsize=32)
+def _diameter_columns(columns):
+    positions, diameters = [], []
+    for i, col in enumerate(columns):
+        # Try to convert column name col (str) to diameter d (int)
+        try:
+            diameters.append(int(col))
+        except ValueError:
+            continue
+        positions.append(i)
 
-def list_files(tree, keyword, file_extension):
-    """List files that match `keyword` and `file_extension`."""
+    return positions, np.array(diameters, dtype=np.float64)
 
-    files = []
-    # Iterate through items (keys and values) in the current
-    # directory level
-    for item, subtree in tree.items():
-        # If the item is a file
-        if subtree is None:
-            # Check if it matches the keyword and file extension
-            if item.lower().find(keyword.lower()) > -1 and item.endswith(
-                file_extension
-            ):
-                files.append(item)
-        else:
-            result = list_files(subtree, keyword, file_extension)
-            if len(result) > 0:
-                files.extend(result)
 
-    return files
+def particle_masses(diameters, ro, conv_fact=1):
+    """Calculate the mass concentration of one particle per bin.
+
+    Return mass concentrations in mg/m^3 corresponding to a number
+    concentration of 1/cm^3 of spherical particles with `diameters`
+    in nanometers and density `ro`. For several densities in `ro`,
+    return one row per density.
+    """
+
+    d = np.asarray(diameters, dtype=np.float64) * 1e-9  # Convert nm to m
+
+    # Calculate the volume of a particle using the diameter d
+    V = 4 / 3 * math.pi * (d / 2) ** 3  # m^3
+
+    # Volume of particles in m^3 per m^3 of air (1/cm^3 = 1e6/m^3),
+    # multiplied by the density ro and converted to mg
+    ro = np.asarray(ro, dtype=np.float64)
+    return np.multiply.outer(ro, V * 1e6) * 1e6 * conv_fact
 
 
 def num_to_mass(dataframe, ro, conv_fact=1):
@@ -102,59 +115,117 @@ def num_to_mass(dataframe, ro, conv_fact=1):
     and optionally a conversion factor `conv_fact`. Conversion factor
     improves the consistency of concentrations between results from
     calculations and from MINI-WRAS.
+
+    For a sequence of densities `ro`, return a dictionary mapping each
+    density to its DataFrame, e.g. for sensitivity analyses. Given a
+    MiniWrasDataset, return datasets instead.
     """
 
-    # Create an empty DataFrame with the same index as the input
-    mass_df = pd.DataFrame(index=dataframe.index)
+    with stage('mass', rows=len(dataframe)):
+        if isinstance(dataframe, MiniWrasDataset):
+            densities = list(ro) if np.ndim(ro) > 0 else [ro]
+            masses = particle_masses(dataframe.diameters, densities, conv_fact)
+            mass_datasets = {
+                density: dataframe.to_mass(mass)
+                for density, mass in zip(densities, masses)
+            }
+            return mass_datasets if np.ndim(ro) > 0 else mass_datasets[ro]
 
-    # Loop through columns in the input DataFrame
-    for col in dataframe:
-        # Try to convert column name col (str) to diameter d (int).
-        # Omit col='total counts'.
-        try:
-            d = int(col) * 1e-9  # Convert nanometers to meters
-        except ValueError:
-            continue
+        return _num_to_mass(dataframe, ro, conv_fact)
 
-        # Calculate the volume of a particle using the diameter d
-        V = 4 / 3 * math.pi * (d / 2) ** 3  # m^3
 
-        # Calculate the total volume of particles of a particular size
-        # as pandas.Series and convert to m^3
-        V_total = V * dataframe[col] * 1e6  # m^3
+def _num_to_mass(dataframe, ro, conv_fact):
+    import pandas as pd
 
-        # Calculate the mass of particles using the density ro
-        # as pandas.Series and convert to mg
-        mass = V_total * ro * 1e6  # mg
+    densities = list(ro) if np.ndim(ro) > 0 else [ro]
 
-        # Add the calculated mass pandas.Series to the mass DataFrame
-        mass_df[col] = mass * conv_fact
+    positions, diameters = diameter_columns(dataframe.columns)
+    numbers = dataframe.iloc[:, positions].to_numpy(dtype=np.float64)
+    masses = particle_masses(diameters, densities, conv_fact)
 
-    # Calculate the total mass for each row and insert the 'total mass'
-    # column
-    mass_df.insert(
-        loc=0,
-        column='total mass',
-        value=[mass_df.iloc[i].sum() for i in range(mass_df.shape[0])],
-    )
+    # Calculate the masses of all bins of all rows at once, the total
+    # mass for each row goes to the first column
+    mass_dfs = {}
+    for density, mass in zip(densities, masses):
+        values = np.empty((numbers.shape[0], numbers.shape[1] + 1))
+        np.multiply(numbers, mass, out=values[:, 1:])
+        values[:, 0] = np.nansum(values[:, 1:], axis=1)
+
+        mass_dfs[density] = pd.DataFrame(
+            values,
+            index=dataframe.index,
+            columns=['total mass'] + list(dataframe.columns[positions]),
+        )
 
     # Return the DataFrame containing mass concentrations
-    return mass_df
+    return mass_dfs if np.ndim(ro) > 0 else mass_dfs[ro]
 
 
 def parse_arguments(
+    batch=False,
+    combine=False,
+    coverage=False,
     days=False,
+    decimate=False,
+    follow=False,
+    incremental=False,
+    instrument=False,
+    interval=None,
+    jobs=False,
     keyword=False,
+    limits=False,
     mass=False,
+    max_memory=False,
     nano=False,
     particulate=False,
+    period=False,
+    prefetch=False,
+    profile=False,
+    raw=False,
     separately=False,
+    sketch=False,
+    store=False,
 ):
     """Set up command-line argument parser."""
 
     parser = argparse.ArgumentParser()
 
     # Define optional command-line arguments
+    if batch:
+        parser.add_argument(
+            '-y',
+            '--yes',
+            '--batch',
+            dest='batch',
+            action='store_true',
+            help='Save all figures without prompting, rendered off-screen',
+        )
+        parser.add_argument(
+            '-o',
+            '--output-dir',
+            action='store',
+            metavar='DIR',
+            help='Save figures to DIR instead of next to the data',
+        )
+    if combine:
+        parser.add_argument(
+            '-c',
+            '--combine',
+            action='store_true',
+            help='Plot one chart of all the files found with -k',
+        )
+    if coverage:
+        parser.add_argument(
+            '--coverage',
+            action='store',
+            type=float,
+            default=0.75,
+            metavar='FRACTION',
+            help=(
+                'Average only windows with at least FRACTION of their '
+                'measurements (0.75 by default)'
+            ),
+        )
     if days:
         parser.add_argument(
             '-d',
@@ -162,6 +233,65 @@ def parse_arguments(
             action='store_true',
             help='Plot charts per day in one figure',
         )
+    if decimate:
+        parser.add_argument(
+            '--decimate',
+            action='store_true',
+            help='Plot only the extremes of each pixel column of a series',
+        )
+    if follow:
+        parser.add_argument(
+            '-f',
+            '--follow',
+            action='store',
+            nargs='?',
+            type=float,
+            const=60,
+            metavar='SECONDS',
+            help=(
+                'Follow the newest data file as the instrument appends to '
+                'it, refreshing the figure every SECONDS (60 by default)'
+            ),
+        )
+    if incremental:
+        parser.add_argument(
+            '-i',
+            '--incremental',
+            action='store_true',
+            help='Merge only new or changed files',
+        )
+    if instrument:
+        parser.add_argument(
+            '--instrument',
+            action='store',
+            metavar='NAME',
+            help=(
+                'Use the data of the instrument NAME only (serial number, '
+                'location or the name of its merged-data folder)'
+            ),
+        )
+    if interval is not None:
+        parser.add_argument(
+            '--interval',
+            action='store',
+            type=parse_interval,
+            default=parse_interval(interval),
+            metavar='INTERVAL',
+            help=(
+                'Resample the data to INTERVAL, e.g. 5min, hour or day '
+                f'({interval} by default)'
+            ),
+        )
+    if jobs:
+        parser.add_argument(
+            '-j',
+            '--jobs',
+            action='store',
+            type=int,
+            default=1,
+            metavar='N',
+            help='Process files or figures in N worker processes',
+        )
     if keyword:
         parser.add_argument(
             '-k',
@@ -169,10 +299,32 @@ def parse_arguments(
             action='store',
             help=('Specify KEYWORD to process data for every file'),
         )
+    if limits:
+        parser.add_argument(
+            '--limit',
+            dest='limits',
+            action='append',
+            type=parse_limit,
+            default=[],
+            metavar='CHANNEL[:WINDOW]=VALUE',
+            help=(
+                'Count exceedances of VALUE by the WINDOW (1h, 8h or 24h, '
+                '24h by default) means of CHANNEL, e.g. PM10=50; can be '
+                'given several times'
+            ),
+        )
     if mass:
         parser.add_argument(
             '-m', '--mass', action='store_true', help='Process mass data'
         )
+    if max_memory:
+        parser.add_argument(
+            '--max-memory',
+            action='store',
+            type=float,
+            metavar='MB',
+            help='Stream merged data in chunks fitting in MB megabytes',
+        )
     if nano:
         parser.add_argument(
             '-n',
@@ -187,6 +339,53 @@ def parse_arguments(
             action='store_true',
             help='Process particulate matter (PM) data',
         )
+    if period:
+        parser.add_argument(
+            '--from',
+            dest='start',
+            action='store',
+            type=parse_date,
+            metavar='DATE',
+            help='Use data from DATE (YYYY-MM-DD, YYYY-MM or YYYY)',
+        )
+        parser.add_argument(
+            '--to',
+            dest='stop',
+            action='store',
+            type=parse_date,
+            metavar='DATE',
+            help='Use data up to DATE, including the whole day, month or year',
+        )
+    if prefetch:
+        parser.add_argument(
+            '--prefetch',
+            action='store',
+            type=int,
+            default=2,
+            metavar='N',
+            help=(
+                'Read up to N next data files in background threads while '
+                'plotting (2 by default, 0 reads them one by one)'
+            ),
+        )
+    if profile:
+        parser.add_argument(
+            '--profile',
+            action='store',
+            nargs='?',
+            const='profile.json',
+            metavar='FILE',
+            help=(
+                'Report time and memory of the processing stages, saving '
+                'them to FILE (profile.json by default)'
+            ),
+        )
+    if raw:
+        parser.add_argument(
+            '--raw',
+            action='store_true',
+            help='Aggregate the merged rows instead of reading rollups',
+        )
     if separately:
         parser.add_argument(
             '-s',
@@ -195,65 +394,544 @@ def parse_arguments(
             help='Save separate charts for each month',
         )
 
-    return parser.parse_args()
+    if sketch:
+        parser.add_argument(
+            '--sketch',
+            action='store_true',
+            help='Draw boxplots from mergeable per-day summaries',
+        )
+
+    if store:
+        parser.add_argument(
+            '--store',
+            action='store_true',
+            help='Also save the merged data in a memory-mapped binary store',
+        )
+
+    args = parser.parse_args()
 
+    # Dates are compared with datetime64 values, --to is the first day
+    # after the period
+    if period:
+        if args.start is not None:
+            args.start = args.start.astype('datetime64[D]')
+        if args.stop is not None:
+            args.stop = (args.stop + 1).astype('datetime64[D]')
 
-def print_directory_tree(tree, indent=0):
-    """Print the directory tree with proper indents."""
+    # Measure the stages of the whole run, reporting them at exit
+    if getattr(args, 'profile', None) is not None:
+        profiling.enable(args.profile)
 
-    for item, subtree in tree.items():
-        if subtree is None:
-            print('  ' * indent + '- ' + item)
-        else:
-            print('  ' * indent + '+ ' + item)
-            print_directory_tree(subtree, indent + 1)
+    # Figures are never shown in batch mode, so render them with the
+    # non-interactive Agg backend, which also works without a display
+    if getattr(args, 'batch', False):
+        import matplotlib.pyplot as plt
+
+        plt.switch_backend('Agg')
+
+    return args
+
+
+def parse_date(text):
+    """Parse a date given as YYYY-MM-DD, YYYY-MM or YYYY to datetime64."""
+
+    try:
+        date = np.datetime64(text)
+    except ValueError:
+        date = None
+    if date is None or np.datetime_data(date.dtype)[0] not in ('Y', 'M', 'D'):
+        raise argparse.ArgumentTypeError(f'invalid date: {text!r}')
+    return date
+
+
+def parse_interval(text):
+    """Parse an interval, e.g. 5min, 1h, hour or day, to seconds.
+
+    Intervals have to divide a day, so that they start at midnight.
+    """
+
+    # Units and their lengths in seconds
+    units = {
+        's': 1,
+        'min': 60,
+        'h': 3600,
+        'hour': 3600,
+        'd': 86400,
+        'day': 86400,
+    }
+
+    match = re.fullmatch(r'(\d*)\s*([a-z]+)', text.strip().lower())
+    seconds = 0
+    if match is not None and match[2] in units:
+        seconds = int(match[1] or 1) * units[match[2]]
+    if seconds == 0 or 86400 % seconds != 0:
+        raise argparse.ArgumentTypeError(f'invalid interval: {text!r}')
+    return seconds
+
+
+def parse_limit(text):
+    """Parse a limit given as CHANNEL[:WINDOW]=VALUE, e.g. PM2.5:1h=25.
+
+    Return a tuple (channel, window, value), the window is 24h unless
+    given.
+    """
 
+    name, sep, value = text.rpartition('=')
+    channel, _, window = name.partition(':')
+    try:
+        value = float(value)
+    except ValueError:
+        sep = ''
+    if not sep or not channel:
+        raise argparse.ArgumentTypeError(f'invalid limit: {text!r}')
+    return channel, window or '24h', value
+
+
+def decimate(timestamps, values, width):
+    """Select points of a time series to plot it `width` pixels wide.
+
+    Split the time range into `width` equal buckets, one per pixel
+    column, and keep the first, minimum, maximum and last point of each
+    (M4 decimation). Drawn as a line, the selected points cover the
+    same pixels as the full series, including all spikes. Return the
+    sorted positions of the points to keep, or all positions if the
+    series has no more than 4 points per bucket.
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if width < 1 or n <= 4 * width:
+        return np.arange(n)
+
+    # Bucket of every point, timestamps are sorted
+    x = np.asarray(timestamps, dtype='datetime64[ns]').astype(np.int64)
+    span = max(x[-1] - x[0], 1)
+    buckets = np.minimum((x - x[0]) * width // span, width - 1)
+
+    # First and last points of the buckets
+    first = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    last = np.r_[first[1:] - 1, n - 1]
+
+    # Extremes of the buckets, the first minimum and the last maximum
+    # (missing values are kept apart as +/-inf, so they are never
+    # selected as extremes); reductions over the buckets keep it linear
+    # in the number of points, unlike sorting them
+    positions = np.arange(n)
+    lowest = np.where(np.isnan(values), np.inf, values)
+    lowest = lowest == np.repeat(
+        np.minimum.reduceat(lowest, first), np.diff(np.r_[first, n])
+    )
+    minima = np.minimum.reduceat(np.where(lowest, positions, n), first)
+    highest = np.where(np.isnan(values), -np.inf, values)
+    highest = highest == np.repeat(
+        np.maximum.reduceat(highest, first), np.diff(np.r_[first, n])
+    )
+    maxima = np.maximum.reduceat(np.where(highest, positions, -1), first)
+
+    return np.unique(np.concatenate([first, minima, maxima, last]))
+
+
+def load_file(file_path, use_cache=True):
+    """Read a MINI-WRAS data file, using the parse cache if possible.
+
+    Return a tuple (header, timestamps, values) as read_dat() does.
+    Parsed files are kept in a binary cache (see cache.py), which is
+    invalidated automatically when the size or mtime of the source
+    file changes. Set `use_cache` to False to always parse the text.
+    """
 
-def process_file(tree, file):
+    if use_cache:
+        with stage('cache', file_path) as measured:
+            cached = cache.load(file_path, cache_dir)
+            if cached is not None:
+                header = Header.from_fields(
+                    cached['header'].tolist(), cached['columns'].tolist()
+                )
+                measured.rows = len(cached['values'])
+                return header, cached['timestamps'], cached['values']
+
+    # Take the key before parsing, in case the file is still growing
+    key = cache.source_key(file_path)
+    with stage('parse', file_path) as measured:
+        header, timestamps, values = read_dat(file_path)
+        measured.rows = len(values)
+
+    if use_cache:
+        arrays = {
+            'header': np.array(header.fields(), dtype=str),
+            'columns': np.array(header.columns, dtype=str),
+            'timestamps': timestamps,
+            'values': values,
+        }
+        cache.store(file_path, key, arrays, cache_dir)
+
+    return header, timestamps, values
+
+
+def load_dataset(file_path, dtype=None, use_cache=True):
+    """Read a MINI-WRAS data file to a MiniWrasDataset.
+
+    Values are float64 unless another `dtype` is given, e.g. float32 to
+    halve the memory taken by long series.
+    """
+
+    header, timestamps, values = load_file(file_path, use_cache)
+    return MiniWrasDataset.from_arrays(header, timestamps, values, dtype)
+
+
+def process_file(file_path, use_cache=True):
     """Read data to the pandas.DataFrame and prepare for analysis."""
 
-    df = pd.read_table(get_path(tree, file, path), skiprows=10, index_col=0)
+    # Nanoparticles are in the bins from 10 to 100 nm, the nano
+    # DataFrame starts with their total
+    return load_dataset(file_path, use_cache=use_cache).to_frames()
+
+
+def merged_data_path(catalog, data_file, instrument=None):
+    """Return the path of merged `data_file`, e.g. total.csv.
+
+    With `instrument` (see parse_arguments()), return the data of that
+    instrument. Without it, the data of the first instrument is used if
+    there are several. Exit if there is no such data.
+    """
+
+    merged = instruments.find_merged(catalog, data_file, instrument)
+    if not merged:
+        sys.exit(
+            f'No merged {data_file}'
+            + (f' of the instrument {instrument}' if instrument else '')
+            + ', run merge_mini_wras_data.py first.'
+        )
+    if len(merged) > 1:
+        print(
+            f'{len(merged)} matching instruments, using '
+            f'{merged[0][0] or "the unknown one"} '
+            f'(select one with --instrument).'
+        )
+    return merged[0][1]
+
 
-    # Nanoparticles are in the first 8 columns (from 10 to 100 nm),
-    # without column 0 where the total counts for all particles are
-    nano = df.iloc[:, 1:9]
-    nano.insert(
-        loc=0,
-        column='total nano',
-        value=nano.sum(axis=1),
+def read_merged(data_path, max_memory=None, start=None, stop=None):
+    """Read merged data in chunks with the index converted to datetime.
+
+    Yield DataFrames of at most as many rows as fit in `max_memory`
+    megabytes, or the whole file as one DataFrame if it is None. If the
+    merge saved a current binary store of the data (see store.py), the
+    rows are taken from it instead of parsing the text.
+
+    With `start` and/or `stop` (datetime64), yield only the rows from
+    `start` up to `stop` (excluded). Only the parts of the merged data
+    from the files overlapping this range are read (see manifest.py).
+    """
+
+    import pandas as pd
+
+    data = store.load(data_path, start, stop)
+    if data is not None:
+        yield from read_store(data, data_path, max_memory)
+        return
+
+    # Read only the files overlapping the time range, if the manifest
+    # of the merge is available
+    period = start is not None or stop is not None
+    source = manifest.open_period(data_path, start, stop) if period else None
+
+    with source or contextlib.nullcontext(data_path) as source:
+        if max_memory is None:
+            with stage('read merged', data_path) as measured:
+                chunks = [pd.read_csv(source, index_col=0)]
+                measured.rows = len(chunks[0])
+        else:
+            # Count the columns to size the chunks
+            with open(data_path) as f:
+                n_columns = f.readline().count(',') + 1
+            chunksize = chunk_rows(max_memory, n_columns)
+            chunks = profiling.measured(
+                pd.read_csv(source, index_col=0, chunksize=chunksize),
+                'read merged',
+                data_path,
+            )
+
+        for chunk in chunks:
+            # Merged data holds ISO 8601 dates, which must not be parsed
+            # with dayfirst - a chunk starting e.g. on 2023-09-01 would
+            # be read as %Y-%d-%m
+            with stage('dates', data_path, len(chunk)):
+                try:
+                    chunk.index = pd.to_datetime(chunk.index, format='ISO8601')
+                except ValueError:
+                    # Conversion of MINI-WRAS dates to datetime format,
+                    # as kept in nano.csv by older versions
+                    chunk.index = pd.to_datetime(chunk.index, dayfirst=True)
+            if period:
+                chunk = chunk[within(chunk.index, start, stop)]
+            yield chunk
+
+
+def within(dates, start=None, stop=None):
+    """Check which `dates` are from `start` up to `stop` (excluded).
+
+    Bounds are datetime64 or None for no bound.
+    """
+
+    selected = np.ones(np.shape(dates), dtype=bool)
+    if start is not None:
+        selected &= dates >= start
+    if stop is not None:
+        selected &= dates < stop
+    return selected
+
+
+def read_store(data, data_path, max_memory=None):
+    """Yield DataFrames of e.g. total.csv from its store `data`.
+
+    `data` is the MiniWrasDataset of the store, see read_merged().
+    """
+
+    # The store of total.csv holds nano.csv as well
+    nano = os.path.basename(data_path).startswith('nano')
+    if max_memory is None:
+        n_rows = max(len(data), 1)
+    else:
+        n_rows = chunk_rows(max_memory, len(data.header.columns))
+
+    # Like pandas, yield an empty DataFrame if there are no rows
+    for first in range(0, max(len(data), 1), n_rows):
+        with stage('read store', data_path) as measured:
+            chunk = data[first : first + n_rows].to_frames()[nano]
+            measured.rows = len(chunk)
+        yield chunk
+
+
+def chunk_rows(max_memory, n_columns):
+    """Return the number of rows of merged data fitting in `max_memory`."""
+
+    return max(
+        1, int(max_memory * 2**20 / (n_columns * chunk_bytes_per_value))
     )
 
-    # Convert index to datetime
-    df.index = pd.to_datetime(df.index, dayfirst=True)
 
-    return df, nano
+def save_figure(fig_name, fig_path, batch=False, output_dir=None):
+    """Prompt user to save the current figure.
+
+    With `batch`, save the figure without prompting and close it, unless
+    it is reused by the rendering session (see rendering()). With
+    `output_dir`, save it to that folder instead of the one in
+    `fig_path`.
+    """
 
+    import matplotlib.pyplot as plt
 
-def save_figure(fig_name, fig_path):
-    """Prompt user to save the current figure."""
+    if output_dir is not None:
+        fig_path = os.path.join(output_dir, os.path.basename(fig_path))
 
-    save_figure = input(f'Save figure {fig_name}? (Y/n)\n')
+    save_figure = 'y' if batch else input(f'Save figure {fig_name}? (Y/n)\n')
     if save_figure.lower() != 'n':
-        plt.savefig(fig_path)
+        # Drawing the figure and encoding the PNG; unlike plt.savefig(),
+        # the figure isn't drawn once more to refresh its window
+        with stage('png', fig_path):
+            plt.gcf().savefig(fig_path)
         print(f'Figure saved as {fig_name}.png in\n{fig_path}.')
     else:
         print('Figure not saved.')
 
+    # Free the memory of figures which are not going to be shown
+    if batch and session is None:
+        plt.close()
 
-def tell_parent(item_path):
-    """Extract the parent folder from the given `item_path`."""
 
-    # Find the index of the last backslash in the item_path
-    end = item_path.rfind('\\')
-    # Find the index of the second-to-last backslash, starting
-    # from the beginning of the string
-    start = item_path.rfind('\\', 0, end) + 1
-    # Return parent's folder name if both start and end indices
-    # are valid
-    if start > 0 and end > 0 and end > start:
-        return item_path[start:end]
+class RenderSession:
+    """Figures reused for all the figures rendered in one run.
+
+    new_figure() returns the figure of the session with the same size,
+    resolution and layout, cleared of the artists of the previous plot,
+    instead of creating one for every plot. So however many figures are
+    rendered, a session holds one figure per size, and close() releases
+    them all.
+    """
+
+    def __init__(self):
+        # (figsize, dpi, layout) -> Figure
+        self.figures = {}
+
+    def figure(self, figsize, dpi=300, layout=None):
+        """Return an empty current figure, reused if possible."""
+
+        import matplotlib.pyplot as plt
+
+        key = (tuple(figsize), dpi, layout)
+        fig = self.figures.get(key)
+        # The figure may have been closed, e.g. by the user
+        if fig is not None and plt.fignum_exists(fig.number):
+            fig.clear()
+            plt.figure(fig.number)
+        else:
+            fig = plt.figure(figsize=figsize, dpi=dpi, layout=layout)
+            self.figures[key] = fig
+        return fig
+
+    def close(self):
+        """Close the figures of the session."""
+
+        import matplotlib.pyplot as plt
+
+        for fig in self.figures.values():
+            plt.close(fig)
+        self.figures.clear()
+
+
+@contextlib.contextmanager
+def rendering():
+    """Render the figures plotted within a RenderSession.
+
+    The figures are closed on leaving, even after an exception. Nested
+    calls use the outer session.
+    """
+
+    global session
+
+    if session is not None:
+        yield session
+        return
+
+    session = RenderSession()
+    try:
+        yield session
+    finally:
+        session.close()
+        session = None
+
+
+def new_figure(figsize, dpi=300, layout=None):
+    """Start a new current figure for a plot function.
+
+    Within rendering(), the figure of the session is reused, otherwise
+    a figure is created as by plt.figure().
+    """
+
+    import matplotlib.pyplot as plt
+
+    if session is not None:
+        return session.figure(figsize, dpi, layout)
+    return plt.figure(figsize=figsize, dpi=dpi, layout=layout)
+
+
+def _start_worker():
+    """Prepare a process rendering figures off-screen in a session."""
+
+    import matplotlib.pyplot as plt
+
+    global session
+
+    plt.switch_backend('Agg')
+    # The figures of the session go with the process
+    session = RenderSession()
+
+
+def render_figures(figures, args, load=None):
+    """Plot and save `figures`, in worker processes if possible.
+
+    Each figure is a tuple (plot function, its arguments, figure name,
+    figure path); the function is expected to plot on a new current
+    figure, started with new_figure() so that the figures are reused
+    and released after saving (see rendering()). With `--batch` and
+    `-j N` > 1, figures are rendered in N worker processes, so the
+    arguments must be picklable. Otherwise they are rendered one by
+    one, prompting whether to save each.
+
+    With `load`, the arguments of every figure are first passed to
+    load(), which returns the arguments of the plot function, e.g. the
+    data read from a file. Rendering figures one by one, the data of
+    the next `--prefetch N` figures is loaded in background threads
+    while the current one is plotted (see prefetch()).
+    """
+
+    batch = getattr(args, 'batch', False)
+    output_dir = getattr(args, 'output_dir', None)
+    jobs = getattr(args, 'jobs', 1)
+    depth = getattr(args, 'prefetch', 0)
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    if batch and jobs > 1 and len(figures) > 1:
+        # Every worker renders its figures in a session of its own
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=_start_worker
+        ) as pool:
+            # Consume the results to raise exceptions from the workers
+            for _ in pool.map(
+                render_figure,
+                figures,
+                [batch] * len(figures),
+                [output_dir] * len(figures),
+                [load] * len(figures),
+            ):
+                pass
+    elif load is not None and depth > 0:
+
+        def load_figure(figure):
+            with stage('load', figure[2]):
+                return load(*figure[1])
+
+        loaded = prefetch(load_figure, figures, depth)
+        with rendering():
+            for (plot_function, _, fig_name, fig_path), arguments in zip(
+                figures, loaded
+            ):
+                render_figure(
+                    (plot_function, arguments, fig_name, fig_path),
+                    batch,
+                    output_dir,
+                )
     else:
-        return None
+        with rendering():
+            for figure in figures:
+                render_figure(figure, batch, output_dir, load)
+
+
+def render_figure(figure, batch=False, output_dir=None, load=None):
+    """Plot and save one of the figures of render_figures()."""
+
+    plot_function, arguments, fig_name, fig_path = figure
+    if load is not None:
+        with stage('load', fig_name):
+            arguments = load(*arguments)
+    with stage('render', fig_name):
+        plot_function(*arguments)
+    save_figure(fig_name, fig_path, batch, output_dir)
+
+
+def prefetch(function, items, depth=2):
+    """Yield function(item) for each of `items` in order, working ahead.
+
+    The results for up to `depth` next items are computed in as many
+    background threads while the current one is used, so e.g. reading
+    files from slow storage overlaps plotting them. At most `depth` + 1
+    results are held at once.
+    """
+
+    items = iter(items)
+    if depth < 1:
+        yield from map(function, items)
+        return
+
+    with ThreadPoolExecutor(max_workers=depth) as pool:
+        pending = collections.deque(
+            pool.submit(function, item)
+            for item in itertools.islice(items, depth)
+        )
+        try:
+            while pending:
+                result = pending.popleft().result()
+                # Start on the next item before handing the result over
+                for item in itertools.islice(items, 1):
+                    pending.append(pool.submit(function, item))
+                yield result
+        finally:
+            # Stopped early, e.g. by an exception while plotting
+            for future in pending:
+                future.cancel()
 
 
 def y_formatter_function(x, pos):
@@ -269,9 +947,3 @@ def y_formatter_function(x, pos):
         return '{:,.1f}'.format(float(x))
     else:
         return '{:,}'.format(int(x))
-
-
-if __name__ == '__main__':
-    # One level up from the current working directory
-    tree = directory_tree(os.getcwd()[: os.getcwd().rfind('\\')])
-    print_directory_tree(tree)
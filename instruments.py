@@ -0,0 +1,150 @@
+import os
+import re
+import sys
+
+from dataclasses import asdict, dataclass, field
+
+import manifest
+
+from reader import read_header
+
+# Characters replaced in the folder names of instruments
+_UNSAFE = re.compile(r'[^\w.-]+')
+
+
+@dataclass(frozen=True)
+class Instrument:
+    """MINI-WRAS unit, as given by the file headers.
+
+    Files are told apart by the 'Serial No.' field of their headers
+    rather than by their names, so units measuring at the same site are
+    never mixed up. The 'Location' field is kept as metadata only: it is
+    free text which may be relabelled between files of one unit, so it
+    doesn't split the data of the unit. Instruments of a group of files
+    take the location of the first file.
+    """
+
+    location: str = field(default='', compare=False)
+    serial_no: str = ''
+
+    @classmethod
+    def of(cls, file_path):
+        """Return the instrument which recorded `file_path`."""
+
+        header = read_header(file_path)
+        return cls(header.location, header.serial_no)
+
+    @classmethod
+    def from_dict(cls, fields):
+        return cls(fields.get('location', ''), fields.get('serial_no', ''))
+
+    @property
+    def name(self):
+        """Return a name usable in paths, e.g. 71-15-01.
+
+        The name is that of the serial number, or of the location of
+        units without one, so that it doesn't change with the location.
+        """
+
+        name = _UNSAFE.sub('-', self.serial_no or self.location).strip('-')
+        return name or 'unknown'
+
+    def matches(self, text):
+        """Check if `text` is the serial number, location or name."""
+
+        return text in (self.serial_no, self.location, self.name)
+
+    def to_dict(self):
+        return asdict(self)
+
+    def __str__(self):
+        return f'{self.serial_no or "?"} at {self.location or "?"}'
+
+
+def group_files(files):
+    """Partition `files` by the instrument in their headers.
+
+    Return a dictionary {Instrument: files}, keeping the order of the
+    files. Files without a MINI-WRAS header are skipped with a warning.
+    """
+
+    groups = {}
+    for file in files:
+        try:
+            instrument = Instrument.of(file)
+        except (OSError, ValueError) as error:
+            print(f'Skipping {file}: {error}', file=sys.stderr)
+            continue
+        groups.setdefault(instrument, []).append(file)
+    return groups
+
+
+def select_files(files, instrument):
+    """List `files` recorded by `instrument` (see Instrument.matches())."""
+
+    return [
+        file
+        for group_instrument, group in group_files(files).items()
+        if group_instrument.matches(instrument)
+        for file in group
+    ]
+
+
+def merged_folder(merged_path, instrument, instruments):
+    """Return the folder of the merged data of `instrument`.
+
+    Data of the only instrument of a site is merged to `merged_path`
+    itself, e.g. sample-data/merged-data, so single-instrument sites
+    keep their layout. With several `instruments`, each of them gets its
+    own subfolder named after it.
+    """
+
+    if len(instruments) == 1:
+        return merged_path
+    return os.path.join(merged_path, instrument.name)
+
+
+def instrument_of(data_path):
+    """Return the Instrument of merged data, e.g. total.csv, or None.
+
+    The instrument is recorded in the manifest of the merge, so data
+    merged by older versions has none.
+    """
+
+    fields = manifest.find_instrument(data_path)
+    return Instrument.from_dict(fields) if fields is not None else None
+
+
+def find_merged(catalog, data_file, instrument=None):
+    """List (Instrument, path) of merged `data_file` in the `catalog`.
+
+    With `instrument` (serial number, location or name, see
+    Instrument.matches()), list the data of matching instruments only.
+    Instruments of data without a manifest are None and their data,
+    e.g. merged from several instruments by older versions, is listed
+    last.
+    """
+
+    merged = []
+    for entry in catalog.by_name.get(data_file, []):
+        data_instrument = instrument_of(entry.path)
+        if instrument is None or (
+            data_instrument is not None and data_instrument.matches(instrument)
+        ):
+            merged.append((data_instrument, entry.path))
+    return sorted(merged, key=lambda item: item[0] is None)
+
+
+def main():
+    from catalog import Catalog
+    from helpers import path
+
+    # List the instruments and the merged data of each of them
+    for data_instrument, data_path in find_merged(
+        Catalog.open(path), 'total.csv'
+    ):
+        print(f'{data_instrument or "Unknown instrument"}: {data_path}')
+
+
+if __name__ == '__main__':
+    main()
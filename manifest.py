@@ -0,0 +1,170 @@
+import io
+import json
+import numpy as np
+import os
+
+# Manifests record the files ingested by a merge, in the order of their
+# rows in the merged outputs, with the time span of every file and the
+# byte range of its rows in each output. Since the rows of every file
+# are stored together, the files are the partitions of the outputs: a
+# time range is read by opening only the files overlapping it.
+
+
+def manifest_path(merged_path, output_files):
+    """Return the location of the manifest of `output_files`."""
+
+    return os.path.join(merged_path, '-'.join(output_files) + '-manifest.json')
+
+
+def load(manifest_path, output_paths):
+    """Read manifest entries, return [] if they don't match the outputs."""
+
+    state = read(manifest_path, output_paths)
+    return state['files'] if state is not None else []
+
+
+def read(manifest_path, output_paths):
+    """Read the whole manifest, return None if it doesn't match."""
+
+    try:
+        with open(manifest_path) as f:
+            state = json.load(f)
+        entries = state['files']
+        sizes = [os.path.getsize(output_path) for output_path in output_paths]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    # Outputs modified outside of merge_data() are rebuilt from scratch
+    if entries and entries[-1]['ends'] != sizes:
+        return None
+    return state
+
+
+def save(manifest_path, entries, instrument=None):
+    """Write the manifest of the ingested files.
+
+    The `instrument` which recorded the files (dictionary with its
+    location and serial number) is saved along with them.
+    """
+
+    state = {'files': entries}
+    if instrument is not None:
+        state['instrument'] = instrument
+    tmp_path = f'{manifest_path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+
+def find(data_path):
+    """Return the manifest entries of e.g. total.csv and its position.
+
+    The position is the one of `data_path` among the outputs of the
+    manifest, e.g. 1 for nano.csv in total-nano-manifest.json. Return
+    (None, None) if there is no manifest matching the current data.
+    """
+
+    state, position = _find(data_path)
+    if state is None:
+        return None, None
+    return state['files'], position
+
+
+def find_instrument(data_path):
+    """Return the instrument recorded with e.g. total.csv, or None."""
+
+    state, _ = _find(data_path)
+    return state.get('instrument') if state is not None else None
+
+
+def _find(data_path):
+    merged_path = os.path.dirname(data_path)
+    name = os.path.splitext(os.path.basename(data_path))[0]
+    try:
+        names = os.listdir(merged_path)
+    except OSError:
+        return None, None
+
+    for manifest_name in names:
+        if not manifest_name.endswith('-manifest.json'):
+            continue
+        output_files = manifest_name[: -len('-manifest.json')].split('-')
+        if name not in output_files:
+            continue
+
+        output_paths = [
+            os.path.join(merged_path, f'{output_file}.csv')
+            for output_file in output_files
+        ]
+        state = read(os.path.join(merged_path, manifest_name), output_paths)
+        if state is not None and state['files']:
+            return state, output_files.index(name)
+    return None, None
+
+
+def open_period(data_path, start=None, stop=None):
+    """Open the part of e.g. total.csv holding the rows of a time range.
+
+    Return a binary file-like object reading the header and the rows of
+    the files overlapping the range from `start` up to `stop` (excluded,
+    datetime64 or None for no bound). Rows of these files outside of the
+    range are included, so they still have to be filtered. Return None
+    if the merged data has no current manifest.
+    """
+
+    entries, position = find(data_path)
+    if entries is None:
+        return None
+
+    ranges = []
+    for entry in entries:
+        if entry['first'] is None:
+            # Files without rows
+            continue
+        first = np.datetime64(entry['first'], 's')
+        last = np.datetime64(entry['last'], 's')
+        if (stop is not None and first >= stop) or (
+            start is not None and last < start
+        ):
+            continue
+
+        begin, end = entry['offsets'][position], entry['ends'][position]
+        if ranges and ranges[-1][1] == begin:
+            # Join the ranges of consecutive files
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((begin, end))
+
+    return io.BufferedReader(_Ranges(data_path, ranges))
+
+
+class _Ranges(io.RawIOBase):
+    """Read the header line and the byte `ranges` of a file in turn."""
+
+    def __init__(self, file_path, ranges):
+        self._file = open(file_path, 'rb')
+        header = self._file.readline()
+        self._ranges = [(0, len(header))] + list(ranges)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._ranges:
+            begin, end = self._ranges[0]
+            if begin >= end:
+                self._ranges.pop(0)
+                continue
+
+            self._file.seek(begin)
+            n = self._file.readinto(memoryview(buffer)[: end - begin])
+            if n == 0:
+                # The file is shorter than recorded
+                break
+            self._ranges[0] = (begin + n, end)
+            return n
+        return 0
+
+    def close(self):
+        self._file.close()
+        super().close()
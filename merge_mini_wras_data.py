@@ -1,67 +1,368 @@
 import os
+import shutil
+import tempfile
 
-from helpers import (
-    directory_tree,
-    get_path,
-    list_files,
-    parse_arguments,
-    print_directory_tree,
-    process_file,
-    tell_parent,
-    path,
-)
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import repeat
+
+import cache
+import instruments
+import manifest
+import rollup
+import store
+
+from catalog import Catalog
+from helpers import load_dataset, parse_arguments, process_file, path
+from profiling import stage
 
 
 def main():
     # Set up command-line argument parser and parse arguments
-    args = parse_arguments(particulate=True)
+    args = parse_arguments(
+        incremental=True, jobs=True, particulate=True, profile=True, store=True
+    )
 
-    # Get directory tree and files
-    t = directory_tree(path)
-    # print_directory_tree(t)
+    # Get the catalog of the data files
+    catalog = Catalog.open(path)
 
     if args.particulate:
-        files = list_files(t, 'location', 'M.dat')
+        files = catalog.files('location', 'M.dat')
         # Merge particulate matter data
-        merge_data(t, files, ['PMs'], path)
+        merge_data(files, ['PMs'], args.incremental, args.jobs, args.store)
 
     else:
-        files = list_files(t, 'location', 'C.dat')
+        files = catalog.files('location', 'C.dat')
         # Merge total and nano data
-        merge_data(t, files, ['total', 'nano'], path)
+        merge_data(
+            files, ['total', 'nano'], args.incremental, args.jobs, args.store
+        )
+
+
+def merge_data(
+    files, output_files, incremental=False, jobs=1, binary_store=False
+):
+    """Merge data from input `files` and save into `output files`.
 
+    Every merge records the ingested files in a manifest next to the
+    output files. With `incremental`, files that are unchanged since
+    the last merge are not parsed again: new files are appended and
+    the outputs are rewritten only from the first changed file on.
+    With `jobs` > 1, files are parsed in that many worker processes.
+    Daily and monthly rollups of the outputs (see rollup.py) are saved
+    along with them. With `binary_store`, the data is also saved in a binary
+    store (see store.py), which is then kept up to date by every merge.
 
-def merge_data(tree, files, output_files, prefix):
-    """Merge data from input `files` and save into `output files`."""
+    Files are partitioned by the instrument (serial number) in their
+    headers and each instrument gets its own outputs, see
+    instruments.merged_folder(). With `jobs` > 1, instruments are
+    merged in parallel, sharing the worker processes.
+    """
 
+    # Merged data is saved two levels up from the data file, e.g.
+    # sample-data/merged-data for sample-data/2023-04/*.dat
+    groups = {}
     for file in files:
-        # Find higher level directories
-        parent1 = tell_parent(get_path(tree, file, prefix=prefix))
-        parent2 = tell_parent(get_path(tree, parent1, prefix=prefix))
-        px2 = get_path(tree, parent2, prefix=prefix)
-
-        # Load data
-        # For PMs, nano DataFrame is unnecessary due to data structure
-        df, nano = process_file(tree, file)
-
-        if not os.path.isdir(os.path.join(px2, 'merged-data')):
-            os.mkdir(os.path.join(px2, 'merged-data'))
-
-        for output_file in output_files:
-            data_to_save = nano if 'nano' in output_file else df
-            # Ensure that the file is overwritten if it's the first
-            # file being saved
-            if files.index(file) == 0:
-                data_to_save.to_csv(
-                    os.path.join(px2, 'merged-data', output_file) + '.csv',
-                    mode='w',
+        merged_path = os.path.join(
+            os.path.dirname(os.path.dirname(file)), 'merged-data'
+        )
+        groups.setdefault(merged_path, []).append(file)
+
+    # Streams of files of one instrument and their merged folders
+    streams = []
+    for merged_path, group in groups.items():
+        with stage('headers', merged_path, len(group)):
+            by_instrument = instruments.group_files(group)
+        if len(by_instrument) > 1 and os.path.exists(
+            os.path.join(merged_path, f'{output_files[0]}.csv')
+        ):
+            print(
+                f'Data in {merged_path} is of several instruments, which '
+                'are merged into a folder each. The outputs mixing them '
+                'there can be removed.'
+            )
+        for instrument, instrument_files in by_instrument.items():
+            folder = instruments.merged_folder(
+                merged_path, instrument, by_instrument
+            )
+            os.makedirs(folder, exist_ok=True)
+            streams.append((instrument_files, folder, instrument))
+
+    if jobs > 1 and len(streams) > 1:
+        # Every instrument is merged by its own process, parsing its
+        # files with a share of the jobs
+        workers = min(jobs, len(streams))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(
+                    merge_group,
+                    instrument_files,
+                    output_files,
+                    folder,
+                    incremental,
+                    max(jobs // len(streams), 1),
+                    binary_store,
+                    instrument,
                 )
+                for instrument_files, folder, instrument in streams
+            ]
+            # Raise exceptions from the workers
+            for future in futures:
+                future.result()
+    else:
+        for instrument_files, folder, instrument in streams:
+            merge_group(
+                instrument_files,
+                output_files,
+                folder,
+                incremental,
+                jobs,
+                binary_store,
+                instrument,
+            )
+
+
+def merge_group(
+    files,
+    output_files,
+    merged_path,
+    incremental=False,
+    jobs=1,
+    binary_store=False,
+    instrument=None,
+):
+    """Merge `files` into the `output_files` in the `merged_path`.
+
+    The `instrument` which recorded the files is saved in the manifest.
+    """
+
+    output_paths = [
+        os.path.join(merged_path, output_file) + '.csv'
+        for output_file in output_files
+    ]
+    manifest_path = manifest.manifest_path(merged_path, output_files)
+
+    # Files ingested by the previous merge, in the order of the outputs
+    entries = manifest.load(manifest_path, output_paths) if incremental else []
+    keys = {file: file_key(file) for file in files}
+
+    # Outputs up to the first file that is new, changed, removed or
+    # reordered are kept as they are
+    start = 0
+    while (
+        start < min(len(entries), len(files))
+        and entries[start]['path'] == files[start]
+        and entries[start]['key'] == keys[files[start]]
+    ):
+        start += 1
+
+    # Stores are updated once saved, even without `binary_store`
+    store_dir = store.store_path(merged_path, output_files)
+    binary_store = binary_store or os.path.isdir(store_dir)
+
+    if start == len(entries) == len(files):
+        # Rollups are missing e.g. after merging with an older version
+        if not all(
+            rollup.is_current(output_path) for output_path in output_paths
+        ):
+            save_rollups(files, output_files, merged_path)
+        if binary_store and not all(
+            store.is_current(output_path, store_dir)
+            for output_path in output_paths
+        ):
+            save_store(files, store_dir, output_paths)
+        # Manifests of older versions don't record the instrument
+        if (
+            instrument is not None
+            and manifest.find_instrument(output_paths[0])
+            != instrument.to_dict()
+        ):
+            manifest.save(manifest_path, entries, instrument.to_dict())
+        print(f'Merged data in {merged_path} is up to date.')
+        return
+
+    # Unchanged files after that point are copied from the old outputs
+    # instead of being parsed again
+    reusable = {
+        entry['path']: entry
+        for entry in entries[start:]
+        if keys.get(entry['path']) == entry['key']
+    }
+
+    # Offsets from which the outputs are rewritten
+    if start < len(entries):
+        offsets = entries[start]['offsets']
+    elif entries:
+        offsets = entries[-1]['ends']
+    else:
+        offsets = [0] * len(output_paths)
+
+    with ExitStack() as stack:
+        tmp_dir = stack.enter_context(
+            tempfile.TemporaryDirectory(prefix='.merge-', dir=merged_path)
+        )
+        tail_paths = []
+        for i, (output_path, offset) in enumerate(zip(output_paths, offsets)):
+            # Move the part of the output to be rewritten aside, as it
+            # may contain blocks of unchanged files
+            tail_path = os.path.join(tmp_dir, f'tail-{i}')
+            if reusable:
+                with open(output_path, 'rb') as output, open(
+                    tail_path, 'wb'
+                ) as tail:
+                    output.seek(offset)
+                    shutil.copyfileobj(output, tail)
+            with open(output_path, 'ab') as output:
+                output.truncate(offset)
+            tail_paths.append(tail_path)
+
+        # Keep the outputs open, so that all blocks are written through
+        # one buffered stream per output
+        outputs = [
+            stack.enter_context(open(output_path, 'ab'))
+            for output_path in output_paths
+        ]
+        ingested = ingest_files(
+            [file for file in files[start:] if file not in reusable],
+            output_files,
+            jobs,
+        )
+
+        new_entries = entries[:start]
+        rollups = {}
+        for file in files[start:]:
+            if file in reusable:
+                entry = dict(reusable[file])
+                headers = [None] * len(output_paths)
+                blocks = [
+                    read_block(tail_path, begin - offset, end - begin)
+                    for tail_path, offset, begin, end in zip(
+                        tail_paths, offsets, entry['offsets'], entry['ends']
+                    )
+                ]
             else:
-                data_to_save.to_csv(
-                    os.path.join(px2, 'merged-data', output_file) + '.csv',
-                    mode='a',
-                    header=False,
-                )
+                entry, headers, blocks, rollups[file] = next(ingested)
+                entry['key'] = keys[file]
+
+            append_blocks(outputs, headers, blocks, entry)
+            new_entries.append(entry)
+
+    manifest.save(
+        manifest_path,
+        new_entries,
+        instrument.to_dict() if instrument is not None else None,
+    )
+    save_rollups(files, output_files, merged_path, rollups)
+    if binary_store:
+        save_store(files, store_dir, output_paths)
+
+    parsed = len(files) - start - len(reusable)
+    print(
+        f'Merged {len(files)} file(s) into {merged_path} '
+        f'({parsed} parsed, {start + len(reusable)} reused).'
+    )
+
+
+def ingest_files(files, output_files, jobs=1):
+    """Yield ingest_file() results for `files` in their order."""
+
+    if jobs > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            yield from pool.map(ingest_file, files, repeat(output_files))
+    else:
+        for file in files:
+            yield ingest_file(file, output_files)
+
+
+def ingest_file(file, output_files):
+    """Parse `file` and render its rows for each of the `output_files`.
+
+    Return a manifest entry (without offsets), the header line and the
+    rows of each output as CSV (bytes) and the rollups of the file. The
+    header is written only if the file is the first one saved to an
+    output.
+    """
+
+    # Load data
+    # For PMs, nano DataFrame is unnecessary due to data structure
+    key = cache.source_key(file)
+    df, nano = process_file(file)
+
+    headers, blocks = [], []
+    for output_file in output_files:
+        data_to_save = nano if 'nano' in output_file else df
+        with stage('csv', file, len(data_to_save)):
+            header, _, rows = data_to_save.to_csv().partition(os.linesep)
+        headers.append((header + os.linesep).encode('utf-8'))
+        blocks.append(rows.encode('utf-8'))
+
+    entry = {
+        'path': file,
+        'rows': len(df),
+        'first': f'{df.index[0]}' if len(df) > 0 else None,
+        'last': f'{df.index[-1]}' if len(df) > 0 else None,
+    }
+    with stage('rollups', file, len(df)):
+        rollups = rollup.file_rollups(file, output_files, (df, nano), key)
+    return entry, headers, blocks, rollups
+
+
+def append_blocks(outputs, headers, blocks, entry):
+    """Append one file's `blocks` to the outputs, recording offsets."""
+
+    entry['offsets'], entry['ends'] = [], []
+    for output, header, block in zip(outputs, headers, blocks):
+        # Ensure that the file starts with the header if it's the first
+        # file being saved
+        if output.tell() == 0 and header is not None:
+            output.write(header)
+        entry['offsets'].append(output.tell())
+        output.write(block)
+        entry['ends'].append(output.tell())
+
+
+def save_rollups(files, output_files, merged_path, rollups=None):
+    """Merge the rollups of `files` and save them in `merged_path`.
+
+    Rollups of files missing from `rollups` (dictionary {file: rollups
+    of the file}) are taken from the cache or made again.
+    """
+
+    rollups = rollups or {}
+    merged = {}
+    for file in files:
+        if file not in rollups:
+            rollups[file] = rollup.file_rollups(file, output_files)
+        for dataset, file_rollup in rollups[file].items():
+            if dataset in merged:
+                merged[dataset].merge(file_rollup)
+            else:
+                merged[dataset] = file_rollup
+
+    rollup.save(merged, merged_path)
+
+
+def save_store(files, store_dir, output_paths):
+    """Save the data of `files` in the binary store in `store_dir`.
+
+    Files were parsed by the merge, so they are read from the cache.
+    """
+
+    with stage('store', store_dir):
+        store.save(store_dir, files, load_dataset, output_paths)
+
+
+def file_key(file):
+    """Identify the current state of `file` by its size and mtime."""
+
+    stat = os.stat(file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def read_block(file_path, offset, size):
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,63 @@
+import argparse
+import importlib
+import sys
+
+# Commands and the scripts running them. The scripts are imported only
+# when their command is run, so that e.g. merging data or listing files
+# doesn't spend time importing the plotting libraries
+COMMANDS = {
+    'merge': ('merge_mini_wras_data', 'Merge MINI-WRAS data files'),
+    'filewise': (
+        'number_concentration_filewise',
+        'Plot number concentrations of each data file',
+    ),
+    'boxplots': ('boxplots', 'Plot concentrations on boxplots'),
+    'distribution': ('distribution', 'Plot particle size distributions'),
+    'timeseries': (
+        'timeseries',
+        'Plot statistics of the merged data per time interval',
+    ),
+    'moments': (
+        'moments',
+        'Save the moments of the size distribution of every row',
+    ),
+    'pm': ('pm_analysis', 'Analyse rolling means of the PM data'),
+    'compare': (
+        'compare_instruments',
+        'Compare daily means of the instruments',
+    ),
+    'instruments': ('instruments', 'List the instruments and their data'),
+    'catalog': ('catalog', 'Print the directory tree of the data'),
+}
+
+
+def main(argv=None):
+    """Run the command given as the first argument with the rest."""
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(
+        description='MINI-WRAS data analysis.',
+        epilog='Run "%(prog)s COMMAND -h" to see the options of a command.',
+    )
+    parser.add_argument(
+        'command',
+        choices=COMMANDS,
+        metavar='COMMAND',
+        help='; '.join(
+            f'{command}: {description}'
+            for command, (_, description) in COMMANDS.items()
+        ),
+    )
+
+    # Only the command is parsed here, the options are left to the
+    # parser of the script
+    args = parser.parse_args(argv[:1])
+    module_name, _ = COMMANDS[args.command]
+    sys.argv = [f'{parser.prog} {args.command}'] + argv[1:]
+    importlib.import_module(module_name).main()
+
+
+if __name__ == '__main__':
+    main()
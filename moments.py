@@ -0,0 +1,213 @@
+import functools
+import math
+import numpy as np
+import os
+import sys
+
+import rollup
+
+from catalog import Catalog
+from dataset import MiniWrasDataset
+from helpers import (
+    determine_data_file,
+    diameter_columns,
+    merged_data_path,
+    parse_arguments,
+    read_merged,
+    path,
+)
+from profiling import stage
+
+# pandas is imported by the functions returning DataFrames only, as in
+# helpers.py
+
+# Moments of the size distribution computed for every row and their
+# units; diameters are in nm, surface areas and volumes in um
+MOMENTS = {
+    'number': '1/cm3',
+    'GMD': 'nm',
+    'GSD': '',
+    'surface': 'um2/cm3',
+    'volume': 'um3/cm3',
+}
+
+
+class SizeBins:
+    """Geometry of the size bins of a MINI-WRAS, from their diameters.
+
+    Bin edges are the geometric means of neighbouring diameters, the
+    outer edges are as far from the first and last diameter on the log
+    scale as the inner ones. The log widths (dlogDp) and the weights of
+    the moments of every bin are computed once, so the moments of any
+    number of rows are a single matrix product, see moments().
+    """
+
+    def __init__(self, diameters):
+        self.diameters = np.asarray(diameters, dtype=np.float64)
+        if len(self.diameters) == 0:
+            raise ValueError('No size bins, e.g. in PM data')
+
+        # Edges on the log scale, halfway between the diameters
+        logs = np.log10(self.diameters)
+        middles = (logs[1:] + logs[:-1]) / 2
+        if len(logs) > 1:
+            first, last = 2 * logs[0] - middles[0], 2 * logs[-1] - middles[-1]
+        else:
+            # A single bin is taken as a tenth of a decade wide
+            first, last = logs[0] - 0.05, logs[0] + 0.05
+        log_edges = np.r_[first, middles, last]
+        self.edges = 10**log_edges
+        self.log_widths = np.diff(log_edges)
+
+        # Weights of the bins (rows) for the sums of every row (columns):
+        # the number, the sums of ln(d) and ln(d)^2 for the geometric
+        # mean and standard deviation, the surface area pi * d^2 and the
+        # volume pi / 6 * d^3 of the particles, with d in um
+        ln_d = np.log(self.diameters)
+        d_um = self.diameters / 1000
+        self.weights = np.column_stack(
+            [
+                np.ones_like(ln_d),
+                ln_d,
+                ln_d**2,
+                math.pi * d_um**2,
+                math.pi / 6 * d_um**3,
+            ]
+        )
+
+    @classmethod
+    @functools.lru_cache(maxsize=8)
+    def of(cls, diameters):
+        """Return the SizeBins of `diameters` (tuple), made only once."""
+
+        return cls(diameters)
+
+    def moments(self, numbers, max_rows=None):
+        """Compute the MOMENTS of every row of `numbers`.
+
+        `numbers` is a 2-D array of the number concentrations [1/cm3] of
+        the bins, one row per timestamp; missing values count as no
+        particles, as in the totals. Return a 2-D array with one column
+        per moment. Rows without particles have a NaN GMD and GSD. With
+        `max_rows`, the rows are processed in chunks of that many rows,
+        bounding the memory of the temporary arrays.
+        """
+
+        numbers = np.asarray(numbers)
+        result = np.empty((len(numbers), len(MOMENTS)))
+        step = max_rows or max(len(numbers), 1)
+        for first in range(0, len(numbers), step):
+            rows = slice(first, first + step)
+            result[rows] = self._moments(numbers[rows])
+        return result
+
+    def _moments(self, numbers):
+        # Sums of the weights of all bins, for all rows at once
+        sums = np.nan_to_num(numbers, nan=0.0) @ self.weights
+        number = sums[:, 0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_ln = sums[:, 1] / number
+            variance_ln = sums[:, 2] / number - mean_ln**2
+        return np.column_stack(
+            [
+                number,
+                np.exp(mean_ln),
+                # Rounding may leave a tiny negative variance
+                np.exp(np.sqrt(np.maximum(variance_ln, 0))),
+                sums[:, 3],
+                sums[:, 4],
+            ]
+        )
+
+    def dndlogdp(self, numbers):
+        """Normalise the number concentrations of the bins to dN/dlogDp."""
+
+        return np.asarray(numbers) / self.log_widths
+
+
+def size_bins(columns):
+    """Return the positions of the size bins in `columns` and SizeBins."""
+
+    positions, diameters = diameter_columns(columns)
+    return positions, SizeBins.of(tuple(diameters))
+
+
+def frame_moments(data, max_rows=None):
+    """Return a DataFrame of the MOMENTS of every row of `data`.
+
+    `data` is a DataFrame with size bin columns, e.g. of process_file()
+    or a chunk of merged total.csv or nano.csv, or a MiniWrasDataset.
+    The moments are indexed as `data`. See SizeBins.moments() for
+    `max_rows`.
+    """
+
+    import pandas as pd
+
+    if isinstance(data, MiniWrasDataset):
+        bins = SizeBins.of(tuple(data.diameters))
+        index = pd.DatetimeIndex(data.timestamps, name='date and time')
+        numbers = data.bins
+    else:
+        positions, bins = size_bins(data.columns)
+        index = data.index
+        numbers = data.iloc[:, positions].to_numpy(dtype=np.float64)
+
+    with stage('moments', rows=len(numbers)):
+        values = bins.moments(numbers, max_rows)
+    return pd.DataFrame(values, index=index, columns=list(MOMENTS))
+
+
+def frame_dndlogdp(data):
+    """Return the size bins of a DataFrame `data` as dN/dlogDp."""
+
+    import pandas as pd
+
+    positions, bins = size_bins(data.columns)
+    numbers = data.iloc[:, positions].to_numpy(dtype=np.float64)
+    return pd.DataFrame(
+        bins.dndlogdp(numbers),
+        index=data.index,
+        columns=data.columns[positions],
+    )
+
+
+def main():
+    """Save the moments of every row of the merged data to a CSV file."""
+
+    # Parse the command-line arguments
+    args = parse_arguments(
+        instrument=True, max_memory=True, nano=True, period=True, profile=True
+    )
+
+    # Determine the usage of total.csv or nano.csv
+    data_file, _, _ = determine_data_file(args)
+    data_path = merged_data_path(
+        Catalog.open(path), data_file, args.instrument
+    )
+
+    # Moments are computed and written chunk by chunk, so the merged
+    # data never has to fit in memory
+    dataset = rollup.dataset_name(data_path)
+    output_path = os.path.join(
+        os.path.dirname(data_path), f'{dataset}-moments.csv'
+    )
+    rows = 0
+    with open(output_path, 'w', newline='') as output:
+        for chunk in read_merged(
+            data_path, args.max_memory, args.start, args.stop
+        ):
+            # Chunks may have no rows in the period
+            if len(chunk) == 0:
+                continue
+            moments = frame_moments(chunk)
+            moments.to_csv(output, header=rows == 0)
+            rows += len(moments)
+
+    if rows == 0:
+        os.remove(output_path)
+        sys.exit('No data in the given period.')
+    print(f'Moments of {rows} rows saved in\n{output_path}.')
+
+
+if __name__ == '__main__':
+    main()
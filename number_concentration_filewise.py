@@ -4,60 +4,182 @@ import matplotlib.pyplot as plt
 import os
 import pandas as pd
 
+import instruments
+
 from matplotlib import ticker
+from catalog import Catalog
+from follow import Tail
 from helpers import (
-    directory_tree,
-    get_path,
-    list_files,
-    save_figure,
-    tell_parent,
+    decimate,
+    new_figure,
+    parse_arguments,
+    render_figure,
+    render_figures,
     y_formatter_function,
     process_file,
-    print_directory_tree,
     mm,
     label_font,
     tick_font,
     path,
 )
+from profiling import stage
 
 
 def main():
+    # Parse the command-line arguments
+    args = parse_arguments(
+        batch=True,
+        decimate=True,
+        follow=True,
+        instrument=True,
+        jobs=True,
+        prefetch=True,
+        profile=True,
+    )
+
     # File handling, indexes in col=0, conversion needed in process_file()
-    dir_tree = directory_tree(path)
+    catalog = Catalog.open(path)
 
     # Here you can change keyword and file extension
-    files = list_files(dir_tree, 'location', 'C.dat')  # C.dat for number concentration
+    files = catalog.files('location', 'C.dat')  # C.dat for number concentration
+    # Only the files recorded by the selected instrument
+    if args.instrument is not None:
+        files = instruments.select_files(files, args.instrument)
+
+    # Plot the newest file as it grows instead of all the files
+    if args.follow is not None:
+        follow_files(catalog, files, args)
+        return
 
+    figures = []
     for file in files:
-        df, nano = process_file(dir_tree, file)
+        # Save figure if requested
+        fig_name = generate_fig_name(os.path.basename(file))
+        fig_path = os.path.join(os.path.dirname(file), f'{fig_name}.png')
+        figures.append(
+            (plot_frames, (file, args.decimate), fig_name, fig_path)
+        )
 
-        # Calculate average values
-        avg_conc = df['total counts'].mean()
-        avg_nano_conc = nano['total nano'].mean()
+    # Load and plot the files, in worker processes if requested,
+    # otherwise reading the next files while plotting
+    render_figures(figures, args, load=load_file_data)
 
-        plot_data(df, nano, avg_conc, avg_nano_conc)
-        _, xupper, _, _ = set_axes(df)
-        annotate_averages(avg_conc, avg_nano_conc, xupper)
 
-        # Save figure if requested
-        parent = tell_parent(get_path(dir_tree, file, path))
-        fig_name = generate_fig_name(file)
-        fig_path = os.path.join(
-            get_path(dir_tree, parent, path),
-            f'{fig_name}.png',
+def load_file_data(file, decimated=False):
+    """Load one data file and return the arguments of plot_frames()."""
+
+    df, nano = process_file(file)
+
+    # Calculate average values
+    avg_conc = df['total counts'].mean()
+    avg_nano_conc = nano['total nano'].mean()
+
+    return df, nano, avg_conc, avg_nano_conc, decimated
+
+
+def follow_files(catalog, files, args):
+    """Plot the newest of `files` as it grows, until interrupted.
+
+    Every `args.follow` seconds, the lines appended to the newest file
+    are parsed (see follow.Tail) and if there are any, the figure is
+    plotted again, saved with `--batch` and shown otherwise. New files,
+    e.g. of the next day, are picked up from the `catalog`.
+    """
+
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    tail = None
+    try:
+        while True:
+            if files:
+                newest = max(files, key=modified)
+                if tail is not None and tail.file_path != newest:
+                    # Plot the last lines of the previous file first
+                    if tail.poll() > 0:
+                        plot_tail(tail, args)
+                    tail = None
+                if tail is None:
+                    tail = Tail(newest)
+                    print(f'Following {newest}.')
+                if tail.poll() > 0:
+                    plot_tail(tail, args)
+
+            # Keep the figure window responsive while waiting
+            plt.pause(args.follow)
+
+            # Adding files changes the mtime of their folder only, so
+            # checking the catalog costs a stat per folder
+            if catalog.refresh():
+                known = set(files)
+                new_files = [
+                    file
+                    for file in catalog.files('location', 'C.dat')
+                    if file not in known
+                ]
+                if args.instrument is not None:
+                    new_files = instruments.select_files(
+                        new_files, args.instrument
+                    )
+                files = files + new_files
+    except KeyboardInterrupt:
+        print('Stopped following.')
+
+
+def plot_tail(tail, args):
+    """Plot the data of a followed file read so far."""
+
+    df, nano = tail.data.to_frames()
+    fig_name = generate_fig_name(os.path.basename(tail.file_path))
+    fig_path = os.path.join(os.path.dirname(tail.file_path), f'{fig_name}.png')
+    arguments = (df, nano, tail.avg_conc, tail.avg_nano_conc, args.decimate)
+
+    if args.batch:
+        render_figure(
+            (plot_frames, arguments, fig_name, fig_path),
+            True,
+            args.output_dir,
         )
-        save_figure(fig_name, fig_path)
+    else:
+        # Replace the figure of the previous refresh
+        plt.close('all')
+        with stage('render', fig_name):
+            plot_frames(*arguments)
+        plt.show(block=False)
+
+
+def plot_frames(df, nano, avg_conc, avg_nano_conc, decimated=False):
+    """Plot the data of one file with its averages."""
 
+    plot_data(df, nano, avg_conc, avg_nano_conc, decimated)
+    _, xupper, _, _ = set_axes(df)
+    annotate_averages(avg_conc, avg_nano_conc, xupper)
 
-def plot_data(df, nano, avg_conc, avg_nano_conc):
-    """Generate plot."""
 
-    plt.figure(figsize=(160 * mm, 120 * mm), dpi=300)
+def plot_data(df, nano, avg_conc, avg_nano_conc, decimated=False):
+    """Generate plot.
+
+    With `decimated`, plot only the points of the series which define
+    their shape at the resolution of the figure (see decimate()).
+    """
+
+    fig = new_figure((160 * mm, 120 * mm))
+
+    # Series to plot, by default all their points
+    total_index, total = df.index, df['total counts']
+    nano_index, nano_total = df.index, nano['total nano']
+    if decimated:
+        # Points defining the shape, one bucket per pixel column
+        width = int(fig.get_figwidth() * fig.dpi)
+        shown = decimate(total_index, total, width)
+        total_index, total = total_index[shown], total.iloc[shown]
+        shown = decimate(nano_index, nano_total, width)
+        nano_index, nano_total = nano_index[shown], nano_total.iloc[shown]
 
     # Plot total particles concentration and average
     plt.plot(
-        df.index,
-        df['total counts'],
+        total_index,
+        total,
         'k.:',
         linewidth=1,
         label='Total particles',
@@ -72,7 +194,11 @@ def plot_data(df, nano, avg_conc, avg_nano_conc):
 
     # Plot nanoparticles concentration and average
     plt.plot(
-        df.index, nano['total nano'], 'r.:', linewidth=1, label='Nanoparticles'
+        nano_index,
+        nano_total,
+        'r.:',
+        linewidth=1,
+        label='Nanoparticles',
     )
     plt.plot(
         [df.index[0], df.index[-1]],
@@ -137,6 +263,15 @@ def annotate_averages(avg_conc, avg_nano_conc, xupper):
         )
 
 
+def modified(file):
+    """Return the mtime of `file`, 0 if it has been removed."""
+
+    try:
+        return os.path.getmtime(file)
+    except OSError:
+        return 0
+
+
 def generate_fig_name(file):
     return f"Total Number and Nano ({file[:file.rfind('-')]})"
 
@@ -0,0 +1,287 @@
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+import numpy as np
+import os
+import sys
+
+from matplotlib import ticker
+from catalog import Catalog
+from helpers import (
+    decimate,
+    merged_data_path,
+    new_figure,
+    parse_arguments,
+    read_merged,
+    render_figures,
+    y_formatter_function,
+    mm,
+    path,
+    title_font,
+    label_font,
+    tick_font,
+    within,
+)
+from profiling import stage
+
+# Windows of the rolling means and their lengths in seconds
+WINDOWS = {'1h': 3600, '8h': 8 * 3600, '24h': 24 * 3600}
+
+# Default limits [ug/m3] of the rolling means by channel and window,
+# the 24-hour guideline levels of the WHO (2021)
+LIMITS = {('PM10', '24h'): 45, ('PM2.5', '24h'): 15}
+
+# Line styles of the rolling means of each window
+STYLES = {'1h': 'c-', '8h': 'b-', '24h': 'k-'}
+
+
+def main():
+    # Parse the command-line arguments
+    args = parse_arguments(
+        batch=True,
+        coverage=True,
+        instrument=True,
+        jobs=True,
+        limits=True,
+        max_memory=True,
+        period=True,
+        profile=True,
+    )
+
+    # Merged PM data, see merge_mini_wras_data.py -p
+    data_path = merged_data_path(
+        Catalog.open(path), 'PMs.csv', args.instrument
+    )
+
+    # The rolling means at the start of the period are taken over the
+    # measurements before it as well
+    before = None
+    if args.start is not None:
+        before = args.start - np.timedelta64(max(WINDOWS.values()), 's')
+    times, values, columns = read_pms(
+        data_path, args.max_memory, before, args.stop
+    )
+
+    # Limits given on the command line are added to the defaults
+    limits = dict(LIMITS)
+    for channel, window, value in args.limits:
+        if channel not in columns or window not in WINDOWS:
+            sys.exit(
+                f'Invalid limit {channel}:{window}, channels are '
+                f'{", ".join(columns)} and windows {", ".join(WINDOWS)}.'
+            )
+        limits[channel, window] = value
+
+    # Rows of the period, for which the statistics are reported
+    selected = within(times.view('datetime64[s]'), args.start, args.stop)
+    if not selected.any():
+        sys.exit('No data in the given period.')
+
+    stats, series = analyse(
+        times, values, columns, limits, args.coverage, selected
+    )
+    print(format_stats(stats))
+
+    # Save figures of every channel next to the merged data
+    figures = []
+    for channel in columns:
+        fig_name = f'PMs-{channel}'
+        fig_path = os.path.join(os.path.dirname(data_path), f'{fig_name}.png')
+        channel_limits = {
+            window: limits[channel, window]
+            for window in WINDOWS
+            if (channel, window) in limits
+        }
+        figures.append(
+            (
+                plot_channel,
+                (channel, series[channel], channel_limits),
+                fig_name,
+                fig_path,
+            )
+        )
+    render_figures(figures, args)
+
+
+def read_pms(data_path, max_memory=None, start=None, stop=None):
+    """Read the merged PM data from `start` up to `stop` (excluded).
+
+    Return a tuple (times, values, columns) with the timestamps in
+    seconds since the epoch (int64) and the values as a 2-D array.
+    """
+
+    times, values, columns = [], [], []
+    for chunk in read_merged(data_path, max_memory, start, stop):
+        times.append(chunk.index.to_numpy(dtype='datetime64[s]'))
+        values.append(chunk.to_numpy(dtype=np.float64))
+        columns = list(chunk.columns)
+    times = np.concatenate(times).view(np.int64)
+    values = np.concatenate(values)
+
+    # Files merged out of order are sorted, as the windows need
+    if np.any(times[1:] < times[:-1]):
+        order = np.argsort(times, kind='stable')
+        times, values = times[order], values[order]
+    return times, values, columns
+
+
+def rolling_means(times, values, window, cadence, coverage=0.75):
+    """Return the means of `values` over the `window` ending at each row.
+
+    The window of a row covers the rows of the last `window` seconds,
+    including the row itself, so gaps in the measurements shorten the
+    windows instead of stretching them over older rows. Windows holding
+    less than `coverage` of the values expected every `cadence` seconds
+    are left NaN.
+
+    The sums and counts of the windows are differences of cumulative
+    sums at the rows starting and ending them, so the means of all the
+    windows take a few passes over the rows whatever their length.
+    """
+
+    valid = ~np.isnan(values)
+    # Values are summed around their means, which keeps the cumulative
+    # sums of long series small and their differences precise
+    offsets = np.nansum(values, axis=0) / np.maximum(valid.sum(axis=0), 1)
+    sums = np.zeros((len(values) + 1, values.shape[1]))
+    np.cumsum(np.where(valid, values - offsets, 0), axis=0, out=sums[1:])
+    counts = np.zeros((len(values) + 1, values.shape[1]), dtype=np.int64)
+    np.cumsum(valid, axis=0, out=counts[1:])
+
+    # First row of the window ending at each row, times are sorted
+    first = np.searchsorted(times, times - window, side='right')
+    window_counts = counts[1:] - counts[first]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (sums[1:] - sums[first]) / window_counts + offsets
+    means[window_counts < coverage * window / cadence] = np.nan
+    return means
+
+
+def analyse(times, values, columns, limits, coverage=0.75, selected=None):
+    """Compute the rolling means of every channel and their statistics.
+
+    `limits` is a dictionary {(channel, window): limit}. Statistics are
+    taken over the `selected` rows (all if None). Return a tuple (stats,
+    series): a list of dictionaries, one per channel and window, with
+    the mean, the maximum, the limit, the number of days on which it
+    was exceeded and the hours above it, and a dictionary {channel:
+    {window: (timestamps, means)}} of the rolling means decimated to
+    be plotted (see decimate()).
+    """
+
+    if selected is None:
+        selected = np.ones(len(times), dtype=bool)
+
+    # Measurements are expected every minute, the typical step is used
+    cadence = np.median(np.diff(times)) if len(times) > 1 else 60
+    days = times[selected] // 86400
+    timestamps = times[selected].view('datetime64[s]')
+    # Width of the figures in pixels, see plot_channel()
+    width = int(160 * mm * 300)
+
+    stats, series = [], {channel: {} for channel in columns}
+    for window, seconds in WINDOWS.items():
+        with stage(f'rolling {window}', rows=len(times)):
+            means = rolling_means(times, values, seconds, cadence, coverage)
+        means = means[selected]
+        for i, channel in enumerate(columns):
+            limit = limits.get((channel, window))
+            above = means[:, i] > limit if limit is not None else None
+            stats.append(
+                {
+                    'channel': channel,
+                    'window': window,
+                    'mean': _nan_stat(np.nanmean, means[:, i]),
+                    'max': _nan_stat(np.nanmax, means[:, i]),
+                    'limit': limit,
+                    'days': (
+                        len(np.unique(days[above]))
+                        if above is not None
+                        else None
+                    ),
+                    'hours': (
+                        np.count_nonzero(above) * cadence / 3600
+                        if above is not None
+                        else None
+                    ),
+                }
+            )
+            shown = decimate(timestamps, means[:, i], width)
+            series[channel][window] = (timestamps[shown], means[shown, i])
+    return stats, series
+
+
+def _nan_stat(function, values):
+    # Windows may all lack the coverage, e.g. in a short period
+    if np.all(np.isnan(values)):
+        return np.nan
+    return function(values)
+
+
+def format_stats(stats):
+    """Format a table of the statistics returned by analyse()."""
+
+    lines = [
+        f"{'channel':<10} {'window':>6} {'mean':>8} {'max':>8} "
+        f"{'limit':>7} {'days':>5} {'hours':>7}"
+    ]
+    # Rows of every channel together, in the order of the channels
+    channels = list(dict.fromkeys(row['channel'] for row in stats))
+    for row in sorted(stats, key=lambda row: channels.index(row['channel'])):
+        exceeded = (
+            f"{row['limit']:>7g} {row['days']:>5} {row['hours']:>7.1f}"
+            if row['limit'] is not None
+            else f"{'-':>7} {'-':>5} {'-':>7}"
+        )
+        lines.append(
+            f"{row['channel']:<10} {row['window']:>6} {row['mean']:>8.2f} "
+            f"{row['max']:>8.2f} {exceeded}"
+        )
+    lines.append(
+        'Rolling means in ug/m3; days on which the means exceeded the '
+        'limits and hours above them.'
+    )
+    return '\n'.join(lines)
+
+
+def plot_channel(channel, series, limits):
+    """Plot the rolling means of one channel along with its limits."""
+
+    new_figure((160 * mm, 90 * mm), layout='constrained')
+    for window, (timestamps, means) in series.items():
+        plt.plot(
+            timestamps,
+            means,
+            STYLES[window],
+            linewidth=0.5,
+            label=f'{window} mean',
+        )
+    for window, limit in limits.items():
+        plt.axhline(
+            limit,
+            color='r',
+            linestyle='--',
+            linewidth=0.7,
+            label=f'{window} limit',
+        )
+
+    # X-axis
+    locator = mdates.AutoDateLocator()
+    plt.gca().xaxis.set_major_locator(locator)
+    plt.gca().xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    plt.xticks(**tick_font)
+    plt.xlabel('Date and time', **label_font)
+
+    # Y-axis
+    plt.gca().yaxis.set_major_formatter(
+        ticker.FuncFormatter(y_formatter_function)
+    )
+    plt.yticks(**tick_font)
+    plt.ylabel(f'{channel} [$\\mathregular{{\\mu g/m^3}}$]', **label_font)
+    plt.ylim(bottom=0)
+
+    plt.title(f'{channel} rolling means', **title_font)
+    plt.legend(loc='best', fontsize=6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+import atexit
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where the memory isn't measured
+    resource = None
+
+# Stages are measured only after enable(), otherwise stage() returns a
+# shared object doing nothing, so the instrumentation costs a function
+# call per stage
+enabled = False
+
+# Measurements of the finished stages, in the order they finished
+records = []
+
+_started = None
+
+
+def peak_memory():
+    """Return the peak resident memory of the process in MB, or None.
+
+    The peak is kept by the operating system, so measuring it costs
+    nothing while the stages run, unlike tracing the allocations.
+    """
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (2**20 if sys.platform == 'darwin' else 2**10)
+
+
+class Stage:
+    """Measured stage of processing, used as a context manager.
+
+    Records the wall time, the number of rows processed (set `rows`
+    inside the block if it's not known in advance), the peak memory of
+    the process at the end of the stage and how much the stage raised
+    it. Stages may be nested, e.g. parsing the dates of a file while
+    parsing the file.
+    """
+
+    def __init__(self, name, file=None, rows=None):
+        self.name = name
+        self.file = file
+        self.rows = rows
+
+    def __enter__(self):
+        self.memory = peak_memory()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        memory = peak_memory()
+
+        records.append(
+            {
+                'stage': self.name,
+                'file': self.file,
+                'rows': self.rows,
+                'seconds': seconds,
+                'peak_mb': memory,
+                'raised_mb': (
+                    memory - self.memory if memory is not None else None
+                ),
+            }
+        )
+        return False
+
+
+class _Disabled:
+    """Stage doing nothing, returned by stage() when not profiling."""
+
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __setattr__(self, name, value):
+        # Ignore e.g. `rows` set inside the block
+        pass
+
+
+_DISABLED = _Disabled()
+
+
+def stage(name, file=None, rows=None):
+    """Measure a stage of processing, e.g. `with stage('parse', file):`."""
+
+    if not enabled:
+        return _DISABLED
+    return Stage(name, file, rows)
+
+
+def measured(iterable, name, file=None):
+    """Iterate over `iterable`, measuring how long each item takes.
+
+    Useful for lazily read data, e.g. chunks of a CSV file.
+    """
+
+    if not enabled:
+        return iterable
+    return _measured(iter(iterable), name, file)
+
+
+def _measured(iterator, name, file):
+    while True:
+        with Stage(name, file) as measured_stage:
+            item = next(iterator, _DISABLED)
+            if item is not _DISABLED and hasattr(item, '__len__'):
+                measured_stage.rows = len(item)
+        if item is _DISABLED:
+            return
+        yield item
+
+
+def enable(report_path=None):
+    """Start profiling, reporting the results at exit.
+
+    The JSON report is saved to `report_path` if given and a summary is
+    printed to stderr. Stages run in worker processes (-j) are not
+    recorded.
+    """
+
+    global enabled, _started
+
+    if enabled:
+        return
+    enabled = True
+    _started = time.perf_counter()
+    atexit.register(report, report_path)
+
+
+def report(report_path=None):
+    """Save the JSON report to `report_path` and print a summary."""
+
+    total = time.perf_counter() - _started
+    stages = summarize(records)
+
+    if report_path is not None:
+        with open(report_path, 'w') as f:
+            json.dump(
+                {
+                    'command': sys.argv,
+                    'seconds': total,
+                    'peak_mb': peak_memory(),
+                    'summary': stages,
+                    'records': records,
+                },
+                f,
+                indent=1,
+            )
+
+    print(format_summary(stages, total), file=sys.stderr)
+    if report_path is not None:
+        print(f'Profile saved to {report_path}.', file=sys.stderr)
+
+
+def summarize(records):
+    """Sum up the records per stage, in the order the stages first ran."""
+
+    stages = {}
+    for record in records:
+        summary = stages.setdefault(
+            record['stage'],
+            {'calls': 0, 'seconds': 0.0, 'rows': 0, 'raised_mb': 0.0},
+        )
+        summary['calls'] += 1
+        summary['seconds'] += record['seconds']
+        summary['rows'] += record['rows'] or 0
+        summary['raised_mb'] += record['raised_mb'] or 0
+
+        # The slowest file of the stage
+        if record['file'] is not None and record['seconds'] >= summary.get(
+            'slowest_seconds', 0
+        ):
+            summary['slowest_file'] = record['file']
+            summary['slowest_seconds'] = record['seconds']
+    return stages
+
+
+def format_summary(stages, total):
+    """Format the summary of the stages as a table."""
+
+    lines = [
+        f"{'stage':<14} {'calls':>6} {'time [s]':>9} {'share':>6} "
+        f"{'rows':>10} {'+peak [MB]':>10}  slowest file"
+    ]
+    for name, summary in stages.items():
+        slowest = summary.get('slowest_file')
+        lines.append(
+            f"{name:<14} {summary['calls']:>6} {summary['seconds']:>9.3f} "
+            f"{summary['seconds'] / total:>6.1%} {summary['rows']:>10} "
+            f"{summary['raised_mb']:>10.1f}  "
+            + (
+                f"{os.path.basename(slowest)} "
+                f"({summary['slowest_seconds']:.3f} s)"
+                if slowest is not None
+                else ''
+            )
+        )
+
+    peak = peak_memory()
+    lines.append(
+        f'Total {total:.3f} s'
+        + (f', peak memory {peak:.0f} MB' if peak is not None else '')
+        + ' (stages may be nested, +peak is how much they raised it).'
+    )
+    return '\n'.join(lines)
@@ -0,0 +1,260 @@
+import io
+import numpy as np
+
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from profiling import stage
+
+# MINI-WRAS writes timestamps as 'dd/mm/YYYY HH:MM:SS'
+TIMESTAMP_FORMAT = '%d/%m/%Y %H:%M:%S'
+TIMESTAMP_LENGTH = 19
+
+# Positions of the digits and separators within a timestamp
+_DIGITS = [0, 1, 3, 4, 6, 7, 8, 9, 11, 12, 14, 15, 17, 18]
+_SEPARATORS = {2: '/', 5: '/', 10: ' ', 13: ':', 16: ':'}
+
+# Header keys of the MINI-WRAS files and the matching Header fields
+_HEADER_FIELDS = {
+    'User name': 'user_name',
+    'Location': 'location',
+    'Model': 'model',
+    'Serial No.': 'serial_no',
+    'Software revision': 'software_revision',
+    'Unit': 'unit',
+    'Comment': 'comment',
+}
+
+
+@dataclass
+class Header:
+    """Metadata from the <Header> block of a MINI-WRAS data file."""
+
+    user_name: str = ''
+    location: str = ''
+    model: str = ''
+    serial_no: str = ''
+    software_revision: str = ''
+    unit: str = ''
+    comment: str = ''
+    # Lines without a key, e.g. 'online data'
+    mode: str = ''
+    # Column labels of the <Data> block, without the date and time
+    columns: list = field(default_factory=list)
+    # Numeric diameters [nm] of the size bins, empty for M.dat files
+    diameters: np.ndarray = field(
+        default_factory=lambda: np.empty(0, dtype=np.float64)
+    )
+
+    @property
+    def bins(self):
+        """Return the slice of `columns` holding the size bins."""
+
+        start = len(self.columns) - len(self.diameters)
+        return slice(start, len(self.columns))
+
+    @property
+    def kind(self):
+        """Return 'C' for size distribution and 'M' for PM data."""
+
+        return 'C' if len(self.diameters) > 0 else 'M'
+
+    def fields(self):
+        """Return the text fields as a list, see from_fields()."""
+
+        return [getattr(self, name) for name in _text_fields()]
+
+    @classmethod
+    def from_fields(cls, fields, columns):
+        """Rebuild a Header from fields() and the data `columns`."""
+
+        header = cls(**dict(zip(_text_fields(), fields)))
+        header.set_columns(columns)
+        return header
+
+    def set_columns(self, columns):
+        """Set `columns` and derive the bin diameters from them."""
+
+        self.columns = list(columns)
+        diameters = []
+        # Size bins are the trailing numeric labels, e.g. '10'...'35150'
+        for column in reversed(self.columns):
+            try:
+                diameters.append(float(column))
+            except ValueError:
+                break
+        self.diameters = np.array(diameters[::-1], dtype=np.float64)
+
+
+def _text_fields():
+    return list(_HEADER_FIELDS.values()) + ['mode']
+
+
+def read_dat(file_path):
+    """Read a MINI-WRAS C.dat or M.dat file.
+
+    Return a tuple (header, timestamps, values), where `timestamps` is
+    a datetime64[s] array and `values` a 2-D float64 array with one
+    column per label in `header.columns`.
+    """
+
+    with open(file_path, 'rb') as f:
+        raw = f.read()
+
+    header, data_start = parse_head(raw, file_path)
+    timestamps, values = parse_rows(
+        raw[data_start:], len(header.columns), file_path
+    )
+    return header, timestamps, values
+
+
+def parse_head(raw, file_path=None):
+    """Parse the header block and the column labels of a data file.
+
+    Return a tuple (header, offset) with the offset of the first data
+    line in `raw` (bytes). Raise ValueError if `raw` has no <Data> block
+    or its column labels are incomplete, e.g. in a file just created.
+    """
+
+    # Split the file into the header block, the column labels and
+    # the numeric block
+    try:
+        data_start = raw.index(b'<Data>')
+        labels_start = raw.index(b'\n', data_start) + 1
+        labels_end = raw.index(b'\n', labels_start)
+    except ValueError:
+        raise ValueError(f'No <Data> block in {file_path}') from None
+
+    header = parse_header(raw[:data_start].decode('latin-1'))
+    labels = raw[labels_start:labels_end].decode('latin-1').rstrip('\r')
+    # The first label is the bogus '[d&t31/12/2035 ...]' date column
+    header.set_columns(labels.split('\t')[1:])
+    return header, labels_end + 1
+
+
+def parse_rows(block, n_columns, file_path=None):
+    """Parse lines of data with `n_columns` values after the timestamp.
+
+    Return a tuple (timestamps, values) as read_dat() does. Blank lines
+    are skipped, `file_path` only names the file in the profile.
+    """
+
+    lines = [line for line in block.splitlines() if line.strip()]
+    with stage('dates', file_path, len(lines)):
+        timestamps = parse_timestamps(
+            [line.partition(b'\t')[0] for line in lines]
+        )
+
+    if len(lines) > 0:
+        values = np.loadtxt(
+            io.BytesIO(block),
+            delimiter='\t',
+            usecols=range(1, n_columns + 1),
+            max_rows=len(lines),
+            ndmin=2,
+        )
+    else:
+        values = np.empty((0, n_columns), dtype=np.float64)
+
+    return timestamps, values
+
+
+def read_header(file_path, block_size=4096):
+    """Read only the <Header> block of a MINI-WRAS data file.
+
+    Return a Header without the data columns. The file is read block by
+    block up to the <Data> tag, so it costs about one read whatever the
+    size of the file, e.g. to sort files by instrument.
+    """
+
+    raw = b''
+    with open(file_path, 'rb') as f:
+        while b'<Data>' not in raw:
+            block = f.read(block_size)
+            if not block:
+                raise ValueError(f'No <Data> block in {file_path}')
+            raw += block
+
+    return parse_header(raw[: raw.index(b'<Data>')].decode('latin-1'))
+
+
+def parse_header(text):
+    """Parse the <Header> block into a Header."""
+
+    header = Header()
+    modes = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line == '<Header>':
+            continue
+
+        key, sep, value = line.partition(':')
+        if sep and key.strip() in _HEADER_FIELDS:
+            setattr(header, _HEADER_FIELDS[key.strip()], value.strip())
+        else:
+            modes.append(line)
+
+    header.mode = ', '.join(modes)
+    return header
+
+
+def parse_timestamps(stamps):
+    """Convert MINI-WRAS timestamps (bytes) to datetime64[s].
+
+    The fixed 'dd/mm/YYYY HH:MM:SS' layout is decoded with array
+    arithmetic. Timestamps not following it fall back to strptime.
+    """
+
+    if len(stamps) == 0:
+        return np.empty(0, dtype='datetime64[s]')
+
+    joined = b''.join(stamps)
+    if len(joined) != TIMESTAMP_LENGTH * len(stamps):
+        return _parse_timestamps_slow(stamps)
+
+    chars = np.frombuffer(joined, dtype=np.uint8).reshape(
+        len(stamps), TIMESTAMP_LENGTH
+    )
+    for position, separator in _SEPARATORS.items():
+        if np.any(chars[:, position] != ord(separator)):
+            return _parse_timestamps_slow(stamps)
+
+    digits = chars[:, _DIGITS].astype(np.int64) - ord('0')
+    if np.any((digits < 0) | (digits > 9)):
+        return _parse_timestamps_slow(stamps)
+
+    # Combine pairs (and the year quadruple) of digits into numbers
+    day = digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 2] * 10 + digits[:, 3]
+    year = digits[:, 4:8] @ np.array([1000, 100, 10, 1])
+    seconds = (
+        (digits[:, 8] * 10 + digits[:, 9]) * 3600
+        + (digits[:, 10] * 10 + digits[:, 11]) * 60
+        + digits[:, 12] * 10
+        + digits[:, 13]
+    )
+
+    months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    days = months.astype('datetime64[D]') + (day - 1)
+
+    # Reject impossible dates, e.g. 31/04, instead of rolling them over
+    if (
+        np.any((month < 1) | (month > 12) | (day < 1))
+        or np.any(days.astype('datetime64[M]') != months)
+        or np.any(seconds >= 24 * 3600)
+    ):
+        return _parse_timestamps_slow(stamps)
+
+    return days.astype('datetime64[s]') + seconds
+
+
+def _parse_timestamps_slow(stamps):
+    """Parse timestamps one by one, raising ValueError when invalid."""
+
+    return np.array(
+        [
+            datetime.strptime(stamp.decode('latin-1'), TIMESTAMP_FORMAT)
+            for stamp in stamps
+        ],
+        dtype='datetime64[s]',
+    )
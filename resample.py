@@ -0,0 +1,307 @@
+import numpy as np
+
+import cache
+
+from dataclasses import dataclass
+
+from helpers import (
+    cache_dir,
+    corr_fact,
+    num_to_mass,
+    read_merged,
+    ro,
+)
+from profiling import stage
+
+# pandas is imported by the methods returning DataFrames only, as in
+# helpers.py
+
+# Bump when the layout of the cached arrays changes, so old entries are
+# computed again instead of being misread
+RESAMPLE_VERSION = 1
+
+# Percentiles computed for every interval and column, along with the
+# counts and means; the 50th is the median
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+@dataclass
+class Resampled:
+    """Statistics of every column of a dataset per time interval.
+
+    `times` are the starts of the intervals in seconds since the epoch
+    (int64), intervals without any row are left out. `counts` and
+    `means` of the non-missing values are 2-D arrays with one row per
+    interval and one column per label in `columns`, `percentiles` a 3-D
+    array with one such array per value of PERCENTILES.
+    """
+
+    seconds: int
+    columns: list
+    times: np.ndarray
+    counts: np.ndarray
+    means: np.ndarray
+    percentiles: np.ndarray
+
+    @classmethod
+    def concat(cls, parts, seconds, columns):
+        """Join resampled `parts` of consecutive rows of a dataset."""
+
+        if not parts:
+            return cls.empty(seconds, columns)
+        return cls(
+            seconds,
+            list(columns),
+            np.concatenate([part.times for part in parts]),
+            np.concatenate([part.counts for part in parts]),
+            np.concatenate([part.means for part in parts]),
+            np.concatenate([part.percentiles for part in parts], axis=1),
+        )
+
+    @classmethod
+    def empty(cls, seconds, columns):
+        """Return the statistics of a dataset without rows."""
+
+        k = len(columns)
+        return cls(
+            seconds,
+            list(columns),
+            np.empty(0, dtype=np.int64),
+            np.empty((0, k), dtype=np.int64),
+            np.empty((0, k)),
+            np.empty((len(PERCENTILES), 0, k)),
+        )
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def timestamps(self):
+        """Return the starts of the intervals as datetime64[s]."""
+
+        return self.times.view('datetime64[s]')
+
+    def between(self, start=None, stop=None):
+        """Return the intervals starting from `start` up to `stop`.
+
+        Bounds are datetime64 or None for no bound, `stop` is excluded.
+        """
+
+        first, last = 0, len(self.times)
+        if start is not None:
+            first = np.searchsorted(self.times, _seconds(start))
+        if stop is not None:
+            last = np.searchsorted(self.times, _seconds(stop))
+        return Resampled(
+            self.seconds,
+            self.columns,
+            self.times[first:last],
+            self.counts[first:last],
+            self.means[first:last],
+            self.percentiles[:, first:last],
+        )
+
+    def frame(self, stat='mean'):
+        """Return a DataFrame of one statistic indexed by the intervals.
+
+        `stat` is 'count', 'mean', 'median' or one of PERCENTILES.
+        """
+
+        import pandas as pd
+
+        if stat == 'count':
+            values = self.counts
+        elif stat == 'mean':
+            values = self.means
+        else:
+            q = 50 if stat == 'median' else stat
+            if q not in PERCENTILES:
+                raise ValueError(f'Percentile {stat!r} is not computed')
+            values = self.percentiles[PERCENTILES.index(q)]
+        return pd.DataFrame(
+            values,
+            index=pd.DatetimeIndex(self.timestamps, name='date and time'),
+            columns=self.columns,
+        )
+
+    def to_arrays(self):
+        """Return the statistics as a dictionary of numpy arrays."""
+
+        return {
+            'version': np.array([RESAMPLE_VERSION]),
+            'seconds': np.array([self.seconds]),
+            'percentile-values': np.array(PERCENTILES),
+            'columns': np.array(self.columns, dtype=str),
+            'times': self.times,
+            'counts': self.counts,
+            'means': self.means,
+            'percentiles': self.percentiles,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild the statistics from to_arrays()."""
+
+        return cls(
+            int(arrays['seconds'][0]),
+            arrays['columns'].tolist(),
+            arrays['times'],
+            arrays['counts'],
+            arrays['means'],
+            arrays['percentiles'],
+        )
+
+
+def resample(times, values, seconds, columns):
+    """Compute the statistics of `values` per interval of `seconds`.
+
+    `times` are sorted timestamps in seconds since the epoch (int64)
+    and `values` a 2-D array with one column per label in `columns`.
+    Intervals are aligned to midnight, e.g. hours start at full hours.
+    Return a Resampled with the counts, means and PERCENTILES of the
+    non-missing values of every interval and column.
+
+    All the columns are done at once: the rows of every interval are
+    laid out in a 3-D array padded with NaN, (intervals, columns, rows),
+    which is sorted along the rows. Percentiles are then interpolated
+    between the sorted values at the positions given by the counts, as
+    numpy.nanpercentile() does, without a loop over the intervals.
+    """
+
+    n, k = values.shape
+    if n == 0:
+        return Resampled.empty(seconds, columns)
+
+    # First row and number of rows of every interval
+    intervals = times // seconds
+    starts = np.flatnonzero(np.r_[True, intervals[1:] != intervals[:-1]])
+    lengths = np.diff(np.r_[starts, n])
+
+    # Missing values and the padding are sorted to the end; the rows of
+    # an interval are the last axis, so that they are sorted in place
+    padded = np.full((len(starts), k, lengths.max()), np.nan)
+    padded[
+        np.repeat(np.arange(len(starts)), lengths),
+        :,
+        np.arange(n) - np.repeat(starts, lengths),
+    ] = values
+    padded.sort(axis=2)
+
+    counts = np.count_nonzero(~np.isnan(padded), axis=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.nansum(padded, axis=2) / counts
+
+    # Positions of the percentiles among the sorted values, intervals
+    # without values of a column take the padding, i.e. NaN
+    last = np.maximum(counts - 1, 0)[:, :, None]
+    percentiles = np.empty((len(PERCENTILES), len(starts), k))
+    for i, q in enumerate(PERCENTILES):
+        position = last * (q / 100)
+        lower = position.astype(np.int64)
+        below = np.take_along_axis(padded, lower, axis=2)
+        above = np.take_along_axis(padded, np.minimum(lower + 1, last), axis=2)
+        percentiles[i] = (below + (above - below) * (position - lower))[
+            :, :, 0
+        ]
+
+    return Resampled(
+        seconds,
+        list(columns),
+        intervals[starts] * seconds,
+        counts,
+        means,
+        percentiles,
+    )
+
+
+def resample_chunks(chunks, seconds, data_path=None):
+    """Resample consecutive DataFrames, e.g. chunks of merged data.
+
+    The rows of the last interval of a chunk are held back and joined to
+    the next chunk, so that intervals split between chunks are computed
+    over all their rows. Return a Resampled of all the chunks or None if
+    there are none. `data_path` only names the data in the profile.
+    """
+
+    parts = []
+    columns = None
+    held_times = held_values = None
+    for chunk in chunks:
+        columns = list(chunk.columns)
+        times = chunk.index.to_numpy(dtype='datetime64[s]').view(np.int64)
+        values = chunk.to_numpy(dtype=np.float64)
+        if held_times is not None:
+            times = np.concatenate([held_times, times])
+            values = np.concatenate([held_values, values])
+        if len(times) == 0:
+            continue
+
+        # Merged data is sorted, but files may overlap
+        if np.any(times[1:] < times[:-1]):
+            order = np.argsort(times, kind='stable')
+            times, values = times[order], values[order]
+
+        last = np.searchsorted(
+            times, times[-1] // seconds * seconds, side='left'
+        )
+        with stage('resample', data_path, last):
+            parts.append(
+                resample(times[:last], values[:last], seconds, columns)
+            )
+        held_times, held_values = times[last:], values[last:]
+
+    if columns is None:
+        return None
+    if held_times is not None and len(held_times) > 0:
+        with stage('resample', data_path, len(held_times)):
+            parts.append(resample(held_times, held_values, seconds, columns))
+    return Resampled.concat(parts, seconds, columns)
+
+
+def load(
+    data_path, seconds, mass=False, max_memory=None, start=None, stop=None
+):
+    """Return the Resampled merged data at intervals of `seconds`.
+
+    With `mass`, resample the mass concentrations calculated from the
+    merged number concentrations. Statistics of the whole merged data
+    are kept in the parse cache (see cache.py), one entry per interval,
+    and computed again only when the merged data changes. With `start`
+    and/or `stop` (datetime64), return the intervals from `start` up to
+    `stop` (excluded) only; if they are not cached yet, only the merged
+    data of that period is read and the result is not cached. Return
+    None if there is no merged data.
+    """
+
+    kind = f"resample{'-mass' if mass else ''}-{seconds}s"
+    cached = cache.load(data_path, cache_dir, kind=kind)
+    if (
+        cached is not None
+        and cached['version'][0] == RESAMPLE_VERSION
+        and np.array_equal(cached['percentile-values'], PERCENTILES)
+    ):
+        return Resampled.from_arrays(cached).between(start, stop)
+
+    # Take the key before reading, in case the data is being merged
+    key = cache.source_key(data_path)
+    chunks = read_merged(data_path, max_memory, start, stop)
+    if mass:
+        chunks = (num_to_mass(chunk, ro, corr_fact) for chunk in chunks)
+    resampled = resample_chunks(chunks, seconds, data_path)
+
+    if resampled is not None and start is None and stop is None:
+        cache.store(data_path, key, resampled.to_arrays(), cache_dir, kind)
+    return resampled
+
+
+def _seconds(moment):
+    return np.datetime64(moment, 's').astype(np.int64)
+
+
+def interval_name(seconds):
+    """Name an interval of `seconds` for file names, e.g. '5min'."""
+
+    for unit, length in (('d', 86400), ('h', 3600), ('min', 60)):
+        if seconds % length == 0:
+            return f'{seconds // length}{unit}'
+    return f'{seconds}s'
@@ -0,0 +1,473 @@
+import numpy as np
+import os
+
+import cache
+
+from helpers import (
+    cache_dir,
+    corr_fact,
+    diameter_columns,
+    num_to_mass,
+    process_file,
+    ro,
+    within,
+)
+from sketch import Summary
+
+# pandas is imported by the methods returning DataFrames only, as in
+# helpers.py
+
+# Bump when the layout of the stored arrays changes, so old rollups are
+# rebuilt instead of being misread
+ROLLUP_VERSION = 1
+
+# Periods rolled up and the lengths of their keys, i.e. (year, month,
+# day) and (year, month)
+LEVELS = {'day': 3, 'month': 2}
+
+
+class Rollup:
+    """Aggregates of a dataset, e.g. total.csv, per day and month.
+
+    For every period, keeps the counts and sums of the non-missing
+    values of each column and a Summary of the first column, e.g.
+    'total counts', from which its quartiles and outliers are estimated.
+    Rollups of single files merge into the rollup of the merged data and
+    months are merged from their days, so the merged rows never have to
+    be grouped again.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        # Period key -> [sums, counts, Summary], by level
+        self.periods = {level: {} for level in LEVELS}
+        # Months are merged from the days when first needed
+        self._stale_months = False
+
+    def update(self, df):
+        """Add the rows of `df` (DataFrame with a DatetimeIndex)."""
+
+        index = df.index
+        for key, group in df.groupby([index.year, index.month, index.day]):
+            values = group.to_numpy(dtype=np.float64)
+            self._add(
+                'day',
+                tuple(int(part) for part in key),
+                np.nansum(values, axis=0),
+                np.count_nonzero(~np.isnan(values), axis=0),
+                Summary().update(values[:, 0]),
+            )
+        self._stale_months = True
+        return self
+
+    def merge(self, other):
+        """Add the rows aggregated by `other` to this rollup."""
+
+        if other.columns != self.columns:
+            raise ValueError('Rollups of different columns')
+
+        for key, (sums, counts, summary) in other.days.items():
+            self._add('day', key, sums, counts, summary)
+        self._stale_months = True
+        return self
+
+    @property
+    def days(self):
+        return self.periods['day']
+
+    @property
+    def months(self):
+        self._update_months()
+        return self.periods['month']
+
+    def summaries(self, level='day'):
+        """Return a dictionary mapping period keys to their Summary."""
+
+        self._update_months()
+        return {
+            key: summary
+            for key, (_, _, summary) in self.periods[level].items()
+        }
+
+    def frames(self, level='month'):
+        """Return DataFrames of sums and counts indexed by period keys."""
+
+        import pandas as pd
+
+        self._update_months()
+        periods = self.periods[level]
+        index = pd.MultiIndex.from_tuples(list(periods))
+        sums = pd.DataFrame(
+            [sums for sums, _, _ in periods.values()],
+            index=index,
+            columns=self.columns,
+        )
+        counts = pd.DataFrame(
+            [counts for _, counts, _ in periods.values()],
+            index=index,
+            columns=self.columns,
+        )
+        return sums, counts
+
+    def stats(self, level='day'):
+        """Return statistics of the first column per period."""
+
+        import pandas as pd
+
+        self._update_months()
+        periods = self.periods[level]
+        stats = pd.DataFrame(
+            [
+                {
+                    'count': summary.count,
+                    'sum': summary.sum,
+                    'mean': summary.mean,
+                    'min': summary.min,
+                    'q1': summary.quantile(0.25),
+                    'median': summary.quantile(0.5),
+                    'q3': summary.quantile(0.75),
+                    'max': summary.max,
+                }
+                for _, _, summary in periods.values()
+            ],
+            index=pd.MultiIndex.from_tuples(list(periods)),
+        )
+        stats.columns.name = self.columns[0]
+        return stats
+
+    def totals(self, start=None, stop=None):
+        """Return the sums and counts of the columns over all the days.
+
+        With `start` and/or `stop` (datetime64), add up the days from
+        `start` up to `stop` (excluded) only.
+        """
+
+        days = self.days
+        return _totals(
+            np.array(list(days), dtype=np.int64).reshape(len(days), 3),
+            np.array(
+                [sums for sums, _, _ in days.values()], dtype=np.float64
+            ).reshape(len(days), len(self.columns)),
+            np.array(
+                [counts for _, counts, _ in days.values()], dtype=np.int64
+            ).reshape(len(days), len(self.columns)),
+            start,
+            stop,
+        )
+
+    def to_arrays(self):
+        """Return the rollup as a dictionary of numpy arrays."""
+
+        self._update_months()
+        arrays = {
+            'version': np.array([ROLLUP_VERSION]),
+            'columns': np.array(self.columns, dtype=str),
+        }
+        for level, length in LEVELS.items():
+            periods = self.periods[level]
+            summaries = [summary for _, _, summary in periods.values()]
+            n = len(periods)
+            arrays[f'{level}-keys'] = np.array(
+                list(periods), dtype=np.int64
+            ).reshape(n, length)
+            arrays[f'{level}-sums'] = np.array(
+                [sums for sums, _, _ in periods.values()], dtype=np.float64
+            ).reshape(n, len(self.columns))
+            arrays[f'{level}-counts'] = np.array(
+                [counts for _, counts, _ in periods.values()], dtype=np.int64
+            ).reshape(n, len(self.columns))
+            # Quartiles are kept for readers which don't need the
+            # summaries themselves
+            arrays[f'{level}-quartiles'] = np.array(
+                [
+                    [summary.quantile(q) for q in (0.25, 0.5, 0.75)]
+                    for summary in summaries
+                ]
+            ).reshape(n, 3)
+            arrays.update(
+                {
+                    f'{level}-summary-{name}': value
+                    for name, value in pack_summaries(summaries).items()
+                }
+            )
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild a rollup from to_arrays()."""
+
+        rollup = cls(arrays['columns'].tolist())
+        for level in LEVELS:
+            summaries = unpack_summaries(
+                {
+                    name[len(f'{level}-summary-') :]: value
+                    for name, value in arrays.items()
+                    if name.startswith(f'{level}-summary-')
+                }
+            )
+            rollup.periods[level] = {
+                tuple(int(part) for part in key): [sums, counts, summary]
+                for key, sums, counts, summary in zip(
+                    arrays[f'{level}-keys'],
+                    arrays[f'{level}-sums'],
+                    arrays[f'{level}-counts'],
+                    summaries,
+                )
+            }
+        return rollup
+
+    def _update_months(self):
+        """Merge the months from the days if any day has changed."""
+
+        if self._stale_months:
+            self.periods['month'] = {}
+            for key, (sums, counts, summary) in self.days.items():
+                self._add('month', key[:2], sums, counts, summary)
+            self._stale_months = False
+
+    def _add(self, level, key, sums, counts, summary):
+        periods = self.periods[level]
+        if key in periods:
+            period = periods[key]
+            period[0] = period[0] + sums
+            period[1] = period[1] + counts
+            period[2].merge(summary)
+        else:
+            # Copy, so that merged rollups never share their state
+            periods[key] = [
+                np.array(sums, dtype=np.float64),
+                np.array(counts, dtype=np.int64),
+                Summary.combine([summary]),
+            ]
+
+
+def _totals(keys, sums, counts, start=None, stop=None):
+    """Add up the `sums` and `counts` of the days with `keys` in range."""
+
+    if start is not None or stop is not None:
+        days = np.array(
+            [
+                f'{year:04d}-{month:02d}-{day:02d}'
+                for year, month, day in keys.tolist()
+            ],
+            dtype='datetime64[D]',
+        )
+        selected = within(days, start, stop)
+        sums, counts = sums[selected], counts[selected]
+    return sums.sum(axis=0), counts.sum(axis=0)
+
+
+def pack_summaries(summaries):
+    """Pack a list of summaries into a few flat numpy arrays."""
+
+    parts = [summary.to_arrays() for summary in summaries]
+    packed = {
+        'scalars': (
+            np.stack([part['scalars'] for part in parts])
+            if parts
+            else np.empty((0, 7))
+        )
+    }
+    # Variable-length arrays are concatenated, along with their lengths
+    dtypes = {
+        'keys': np.int64,
+        'counts': np.int64,
+        'lowest': np.float64,
+        'highest': np.float64,
+    }
+    for name, dtype in dtypes.items():
+        packed[name] = np.concatenate(
+            [np.empty(0, dtype)] + [part[name] for part in parts]
+        )
+        packed[f'{name}-lengths'] = np.array(
+            [len(part[name]) for part in parts], dtype=np.int64
+        )
+    return packed
+
+
+def unpack_summaries(packed):
+    """Unpack the summaries packed by pack_summaries()."""
+
+    split = {
+        name: np.split(packed[name], np.cumsum(packed[f'{name}-lengths'])[:-1])
+        for name in ('keys', 'counts', 'lowest', 'highest')
+    }
+    return [
+        Summary.from_arrays(
+            {
+                'scalars': scalars,
+                **{name: split[name][i] for name in split},
+            }
+        )
+        for i, scalars in enumerate(packed['scalars'])
+    ]
+
+
+def rollup_path(data_path, dataset):
+    """Return the location of the rollups of `dataset` by `data_path`."""
+
+    return os.path.join(os.path.dirname(data_path), f'{dataset}-rollups.npz')
+
+
+def data_key(data_path):
+    """Identify the state of the merged data the rollups were made of."""
+
+    stat = os.stat(data_path)
+    return np.array(
+        [ROLLUP_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64
+    )
+
+
+def is_current(data_path, mass=False):
+    """Check if the rollups of the merged data are up to date."""
+
+    dataset = dataset_name(data_path, mass)
+    try:
+        with np.load(rollup_path(data_path, dataset)) as stored:
+            return np.array_equal(stored['key'], data_key(data_path))
+    except (OSError, KeyError, ValueError):
+        return False
+
+
+def dataset_name(data_file, mass=False):
+    """Name the dataset of e.g. total.csv, or of its mass concentrations."""
+
+    name = os.path.splitext(os.path.basename(data_file))[0]
+    return f'{name}-mass' if mass else name
+
+
+def load(data_path, mass=False):
+    """Return the Rollup of the merged data or None if missing or stale.
+
+    With `mass`, return the rollup of the mass concentrations calculated
+    from the merged number concentrations.
+    """
+
+    dataset = dataset_name(data_path, mass)
+    try:
+        with np.load(rollup_path(data_path, dataset)) as stored:
+            if not np.array_equal(stored['key'], data_key(data_path)):
+                return None
+            return Rollup.from_arrays(
+                {name: stored[name] for name in stored.files}
+            )
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def save(rollups, merged_path):
+    """Save `rollups` (dictionary {dataset: Rollup}) in `merged_path`.
+
+    Each rollup is tied to the current state of its merged data file,
+    so that they are ignored once the merged data changes.
+    """
+
+    for dataset, rollup in rollups.items():
+        data_path = os.path.join(
+            merged_path, f"{dataset.removesuffix('-mass')}.csv"
+        )
+        stored_path = rollup_path(data_path, dataset)
+        tmp_path = f'{stored_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, key=data_key(data_path), **rollup.to_arrays())
+        os.replace(tmp_path, stored_path)
+
+
+def datasets(output_file, frame):
+    """List (dataset, DataFrame) pairs rolled up for an output file.
+
+    Outputs with size bins, i.e. total and nano, are rolled up for the
+    mass concentrations too.
+    """
+
+    pairs = [(output_file, frame)]
+    if len(diameter_columns(frame.columns)[0]) > 0:
+        pairs.append(
+            (f'{output_file}-mass', num_to_mass(frame, ro, corr_fact))
+        )
+    return pairs
+
+
+def file_totals(file_path, dataset, output_files, start=None, stop=None):
+    """Return the sums and counts of the columns of one data file.
+
+    The sums and counts of `dataset`, e.g. 'total-mass', are read from
+    the daily rollups of the file kept in the parse cache, skipping the
+    summaries, so adding up the totals of many files is fast. Files not
+    rolled up yet are rolled up for the `output_files` first, see
+    file_rollups(). Return a tuple (columns, sums, counts) of the days
+    from `start` up to `stop` (excluded, datetime64 or None).
+    """
+
+    names = ['version'] + [
+        f'{dataset}::{name}'
+        for name in ('columns', 'day-keys', 'day-sums', 'day-counts')
+    ]
+    cached = cache.load(file_path, cache_dir, kind='rollups', names=names)
+    if cached is None or cached['version'][0] != ROLLUP_VERSION:
+        file_rollup = file_rollups(file_path, output_files)[dataset]
+        return (file_rollup.columns,) + file_rollup.totals(start, stop)
+
+    columns, keys, sums, counts = (cached[name] for name in names[1:])
+    return (columns.tolist(),) + _totals(keys, sums, counts, start, stop)
+
+
+def file_rollups(file_path, output_files, frames=None, key=None):
+    """Roll up one data file for each of the `output_files`.
+
+    Return a dictionary {dataset: Rollup}. Rollups are kept in the parse
+    cache (see cache.py), so unchanged files are not read again. The
+    `frames` (df, nano) and the cache `key` taken before parsing them
+    can be passed if the file has already been processed.
+    """
+
+    cached = cache.load(file_path, cache_dir, kind='rollups')
+    if cached is not None and cached['version'][0] == ROLLUP_VERSION:
+        return {
+            dataset: Rollup.from_arrays(
+                {
+                    name[len(dataset) + 2 :]: value
+                    for name, value in cached.items()
+                    if name.startswith(f'{dataset}::')
+                }
+            )
+            for dataset in cached['datasets'].tolist()
+        }
+
+    if frames is None:
+        key = cache.source_key(file_path)
+        frames = process_file(file_path)
+    df, nano = frames
+
+    rollups = {}
+    for output_file in output_files:
+        frame = nano if 'nano' in output_file else df
+        for dataset, data in datasets(output_file, frame):
+            rollups[dataset] = Rollup(data.columns).update(data)
+
+    if key is not None:
+        store_file_rollups(file_path, key, rollups)
+
+    return rollups
+
+
+def store_file_rollups(file_path, key, rollups):
+    """Keep the `rollups` of one data file in the parse cache.
+
+    `rollups` is a dictionary {dataset: Rollup} as returned by
+    file_rollups(), of the file in the state given by the cache `key`
+    (see cache.store()).
+    """
+
+    arrays = {
+        'version': np.array([ROLLUP_VERSION]),
+        'datasets': np.array(list(rollups), dtype=str),
+    }
+    for dataset, rollup in rollups.items():
+        arrays.update(
+            {
+                f'{dataset}::{name}': value
+                for name, value in rollup.to_arrays().items()
+            }
+        )
+    cache.store(file_path, key, arrays, cache_dir, kind='rollups')
@@ -0,0 +1,227 @@
+import math
+import numpy as np
+
+
+class Summary:
+    """Mergeable summary of a sample of values.
+
+    Keeps the count, sum, minimum and maximum of the values, the most
+    extreme values as outlier candidates and a histogram with buckets
+    growing geometrically by `gamma` (as in DDSketch). Quantiles taken
+    from the histogram are within the relative `accuracy` of the exact
+    ones, whatever the number of values, and summaries of e.g. days
+    can be merged into summaries of months or years. Concentrations are
+    non-negative, the rare zero or negative readings are only counted
+    in a bucket of their own, below the histogram.
+    """
+
+    def __init__(self, accuracy=0.005, extremes=500):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.extremes = extremes
+
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        # Values too small for the logarithmic buckets, zeros and
+        # negative values
+        self.zeros = 0
+        # Sorted bucket indexes and the number of values in each
+        self.keys = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        # The smallest and the largest values in ascending order
+        self.lowest = np.empty(0)
+        self.highest = np.empty(0)
+
+    def update(self, values):
+        """Add `values` (array-like), ignoring missing ones."""
+
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        positive = values[values > np.finfo(np.float64).tiny]
+        self.zeros += len(values) - len(positive)
+        keys, counts = np.unique(
+            np.ceil(np.log(positive) / math.log(self.gamma)).astype(np.int64),
+            return_counts=True,
+        )
+        self._add_buckets(keys, counts)
+        self._add_extremes(values, values)
+        return self
+
+    def merge(self, other):
+        """Add the values summarized by `other` to this summary."""
+
+        if other.gamma != self.gamma:
+            raise ValueError('Summaries of different accuracy')
+
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.zeros += other.zeros
+        self._add_buckets(other.keys, other.counts)
+        self._add_extremes(other.lowest, other.highest)
+        return self
+
+    @classmethod
+    def combine(cls, summaries):
+        """Merge `summaries` into a new Summary."""
+
+        summaries = list(summaries)
+        combined = cls(summaries[0].accuracy, summaries[0].extremes)
+        for summary in summaries:
+            combined.merge(summary)
+        return combined
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count > 0 else math.nan
+
+    def quantile(self, q):
+        """Estimate the `q` quantile (0 <= q <= 1) of the values."""
+
+        if self.count == 0:
+            return math.nan
+
+        # Rank of the quantile as in numpy's default (linear) method
+        rank = q * (self.count - 1)
+        lower = self._value_at(math.floor(rank))
+        upper = self._value_at(math.ceil(rank))
+        return lower + (upper - lower) * (rank - math.floor(rank))
+
+    def stats(self, whis=1.5):
+        """Return box statistics as expected by matplotlib's Axes.bxp().
+
+        Whiskers reach the most extreme values within `whis` times the
+        interquartile range from the box, values beyond them are drawn
+        as fliers from the kept outlier candidates.
+        """
+
+        q1, med, q3 = (self.quantile(q) for q in (0.25, 0.5, 0.75))
+        iqr = q3 - q1
+        low_limit, high_limit = q1 - whis * iqr, q3 + whis * iqr
+
+        candidates = np.concatenate([self.lowest, self.highest])
+        fliers = np.unique(
+            candidates[(candidates < low_limit) | (candidates > high_limit)]
+        )
+
+        return {
+            'med': med,
+            'q1': q1,
+            'q3': q3,
+            'mean': self.mean,
+            'whislo': self._lowest_above(low_limit, q1),
+            'whishi': self._highest_below(high_limit, q3),
+            'fliers': fliers,
+        }
+
+    def to_arrays(self):
+        """Return the summary as a dictionary of numpy arrays."""
+
+        return {
+            'scalars': np.array(
+                [
+                    self.accuracy,
+                    self.extremes,
+                    self.count,
+                    self.sum,
+                    self.min,
+                    self.max,
+                    self.zeros,
+                ]
+            ),
+            'keys': self.keys,
+            'counts': self.counts,
+            'lowest': self.lowest,
+            'highest': self.highest,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild a summary from to_arrays()."""
+
+        accuracy, extremes, count, total, low, high, zeros = arrays['scalars']
+        summary = cls(float(accuracy), int(extremes))
+        summary.count, summary.zeros = int(count), int(zeros)
+        summary.sum = float(total)
+        summary.min, summary.max = float(low), float(high)
+        summary.keys, summary.counts = arrays['keys'], arrays['counts']
+        summary.lowest, summary.highest = arrays['lowest'], arrays['highest']
+        return summary
+
+    def _add_buckets(self, keys, counts):
+        keys = np.concatenate([self.keys, keys])
+        counts = np.concatenate([self.counts, counts])
+        self.keys, positions = np.unique(keys, return_inverse=True)
+        self.counts = np.bincount(
+            positions, weights=counts, minlength=len(self.keys)
+        ).astype(np.int64)
+
+    def _add_extremes(self, lowest, highest):
+        k = self.extremes
+        lowest = np.concatenate([self.lowest, lowest])
+        highest = np.concatenate([self.highest, highest])
+        if len(lowest) > k:
+            lowest = np.partition(lowest, k - 1)[:k]
+        if len(highest) > k:
+            highest = np.partition(highest, len(highest) - k)[-k:]
+        self.lowest, self.highest = np.sort(lowest), np.sort(highest)
+
+    def _value_at(self, rank):
+        """Estimate the value of the given rank (0-based) in the sample."""
+
+        # Exact values are known for the extremes
+        if rank < len(self.lowest):
+            return float(self.lowest[rank])
+        if rank >= self.count - len(self.highest):
+            return float(self.highest[rank - (self.count - len(self.highest))])
+        if rank < self.zeros:
+            # Between the kept lowest values and zero
+            return min(0.0, self.max)
+
+        position = np.searchsorted(
+            np.cumsum(self.counts), rank - self.zeros, side='right'
+        )
+        # The value halfway (relative) between the bucket bounds
+        value = 2 * self.gamma ** self.keys[position] / (self.gamma + 1)
+        return min(max(value, self.min), self.max)
+
+    def _lowest_above(self, limit, default):
+        """Estimate the smallest value not below `limit`."""
+
+        if self.min >= limit:
+            return self.min
+        kept = self.lowest[self.lowest >= limit]
+        if len(kept) > 0 and len(kept) < len(self.lowest):
+            return float(kept[0])
+        # Bucket estimate of the first bucket reaching over the limit
+        upper = self.gamma ** self.keys.astype(np.float64)
+        above = upper[upper >= limit]
+        if len(above) == 0:
+            return default
+        return min(max(2 * above[0] / (self.gamma + 1), limit), default)
+
+    def _highest_below(self, limit, default):
+        """Estimate the largest value not above `limit`."""
+
+        if self.max <= limit:
+            return self.max
+        kept = self.highest[self.highest <= limit]
+        if len(kept) > 0 and len(kept) < len(self.highest):
+            return float(kept[-1])
+        lower = self.gamma ** (self.keys.astype(np.float64) - 1)
+        below = lower[lower <= limit]
+        if len(below) == 0:
+            return default
+        estimate = 2 * self.gamma * below[-1] / (self.gamma + 1)
+        return max(min(estimate, limit), default)
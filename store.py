@@ -0,0 +1,229 @@
+import json
+import numpy as np
+import os
+
+from dataset import MiniWrasDataset
+from reader import Header
+
+# Bump when the layout of the store changes, so old stores are rebuilt
+# instead of being misread
+STORE_VERSION = 1
+
+# Files of a store: the timestamps (int64 seconds since the epoch), the
+# values (rows x columns, C order) and the metadata sidecar
+TIMES_FILE = 'times.bin'
+VALUES_FILE = 'values.bin'
+META_FILE = 'meta.json'
+
+
+def store_path(merged_path, output_files):
+    """Return the folder of the store of `output_files`, e.g. total-nano.
+
+    One store holds the data of all the outputs merged from the same
+    files, as e.g. nano.csv is a subset of the columns of total.csv.
+    """
+
+    return os.path.join(merged_path, '-'.join(output_files) + '-store')
+
+
+def find(data_path):
+    """Return the folder of the store holding e.g. total.csv, or None."""
+
+    merged_path = os.path.dirname(data_path)
+    name = os.path.splitext(os.path.basename(data_path))[0]
+    try:
+        folders = os.listdir(merged_path)
+    except OSError:
+        return None
+    for folder in folders:
+        if folder.endswith('-store') and name in folder[:-6].split('-'):
+            return os.path.join(merged_path, folder)
+    return None
+
+
+def file_key(file_path):
+    """Identify the current state of `file_path` by its size and mtime."""
+
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def read_meta(store_dir):
+    """Return the metadata of a store, or None if it's missing or broken.
+
+    Stores of an older version or with binary files not matching the
+    metadata, e.g. after an interrupted write, are treated as missing.
+    """
+
+    try:
+        with open(os.path.join(store_dir, META_FILE)) as f:
+            meta = json.load(f)
+        if meta['version'] != STORE_VERSION:
+            return None
+        itemsize = np.dtype(meta['dtype']).itemsize
+        sizes = [
+            meta['rows'] * 8,
+            meta['rows'] * len(meta['columns']) * itemsize,
+        ]
+        if sizes != [
+            os.path.getsize(os.path.join(store_dir, name))
+            for name in (TIMES_FILE, VALUES_FILE)
+        ]:
+            return None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return meta
+
+
+def is_current(data_path, store_dir=None):
+    """Check if the store holds the current state of e.g. total.csv."""
+
+    store_dir = store_dir or find(data_path)
+    meta = read_meta(store_dir) if store_dir is not None else None
+    return meta is not None and _holds(meta, data_path)
+
+
+def _holds(meta, data_path):
+    try:
+        key = file_key(data_path)
+    except OSError:
+        return False
+    return meta['outputs'].get(os.path.basename(data_path)) == key
+
+
+def save(store_dir, files, load, output_paths, dtype=np.float64):
+    """Save the data of `files` in the store, in their order.
+
+    `load` reads a file to a MiniWrasDataset, e.g. load_dataset() of
+    helpers.py. If the store already holds the leading `files` in their
+    current state, only the rest is appended. The store is tied to the
+    current state of the merged `output_paths`, see is_current().
+    """
+
+    os.makedirs(store_dir, exist_ok=True)
+    meta = read_meta(store_dir)
+    keys = [file_key(file) for file in files]
+
+    # Files stored before up to the first new, changed or removed one
+    # are kept
+    entries = []
+    if meta is not None and np.dtype(meta['dtype']) == np.dtype(dtype):
+        for entry, file, key in zip(meta['files'], files, keys):
+            if entry['path'] != file or entry['key'] != key:
+                break
+            entries.append(entry)
+    rows = sum(entry['rows'] for entry in entries)
+    row_size = (
+        len(meta['columns']) * np.dtype(dtype).itemsize if entries else 0
+    )
+    # Last time of the kept rows, the appended ones must not be earlier
+    last = int(_times(store_dir, rows)[-1]) if rows > 0 else None
+
+    # Without the metadata, the store is invalid until it's complete
+    meta_path = os.path.join(store_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    # Header of the kept files, or of the first file appended
+    if entries:
+        fields, columns = meta['header'], meta['columns']
+    else:
+        fields, columns = Header().fields(), None
+    is_sorted = meta['sorted'] if entries else True
+    with open(os.path.join(store_dir, TIMES_FILE), 'ab') as times, open(
+        os.path.join(store_dir, VALUES_FILE), 'ab'
+    ) as values:
+        times.truncate(rows * 8)
+        values.truncate(rows * row_size)
+
+        for file, key in zip(files[len(entries) :], keys[len(entries) :]):
+            data = load(file)
+            if columns is None:
+                fields, columns = data.header.fields(), data.header.columns
+            elif data.header.columns != columns:
+                raise ValueError(f'Columns of {file} differ from the store')
+
+            # Timestamps have to be sorted for the binary search
+            if len(data) > 0:
+                if (last is not None and data.times[0] < last) or np.any(
+                    np.diff(data.times) < 0
+                ):
+                    is_sorted = False
+                last = int(data.times[-1])
+
+            times.write(np.ascontiguousarray(data.times, np.int64).data)
+            values.write(np.ascontiguousarray(data.values, dtype).data)
+            entries.append({'path': file, 'key': key, 'rows': len(data)})
+            rows += len(data)
+
+    meta = {
+        'version': STORE_VERSION,
+        'dtype': np.dtype(dtype).str,
+        'header': fields,
+        'columns': columns or [],
+        'rows': rows,
+        'sorted': is_sorted,
+        'files': entries,
+        'outputs': {
+            os.path.basename(output_path): file_key(output_path)
+            for output_path in output_paths
+        },
+    }
+    tmp_path = f'{meta_path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp_path, meta_path)
+
+
+def load(data_path, start=None, stop=None):
+    """Open the store of e.g. total.csv as a MiniWrasDataset.
+
+    The arrays are memory-mapped, so only the pages of the rows used are
+    read from the disk. With `start` and/or `stop`, return the rows of
+    that time range (see MiniWrasDataset.between()), found by binary
+    search on the timestamps. Return None if there is no current store.
+    """
+
+    store_dir = find(data_path)
+    meta = read_meta(store_dir) if store_dir is not None else None
+    if meta is None or not _holds(meta, data_path):
+        return None
+
+    rows, columns = meta['rows'], meta['columns']
+    times = _times(store_dir, rows)
+    if rows > 0:
+        values = np.memmap(
+            os.path.join(store_dir, VALUES_FILE),
+            dtype=meta['dtype'],
+            mode='r',
+            shape=(rows, len(columns)),
+        )
+    else:
+        values = np.empty((0, len(columns)), dtype=meta['dtype'])
+
+    data = MiniWrasDataset(
+        Header.from_fields(meta['header'], columns), times, values
+    )
+    if start is None and stop is None:
+        return data
+    if meta['sorted']:
+        return data.between(start, stop)
+
+    # Unsorted data, e.g. of overlapping files, is filtered row by row
+    selected = np.ones(rows, dtype=bool)
+    if start is not None:
+        selected &= times >= np.datetime64(start, 's').astype(np.int64)
+    if stop is not None:
+        selected &= times < np.datetime64(stop, 's').astype(np.int64)
+    return MiniWrasDataset(data.header, times[selected], values[selected])
+
+
+def _times(store_dir, rows):
+    if rows == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.memmap(
+        os.path.join(store_dir, TIMES_FILE),
+        dtype=np.int64,
+        mode='r',
+        shape=(rows,),
+    )
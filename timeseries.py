@@ -0,0 +1,149 @@
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+import numpy as np
+import os
+import pandas as pd
+import sys
+
+import resample
+
+from matplotlib import ticker
+from catalog import Catalog
+from helpers import (
+    determine_data_file,
+    merged_data_path,
+    new_figure,
+    parse_arguments,
+    render_figures,
+    y_formatter_function,
+    mm,
+    path,
+    title_font,
+    label_font,
+    tick_font,
+)
+
+
+def main():
+    # Parse the command-line arguments
+    args = parse_arguments(
+        batch=True,
+        instrument=True,
+        interval='hour',
+        mass=True,
+        max_memory=True,
+        nano=True,
+        period=True,
+        profile=True,
+    )
+
+    # Variables to properly name chart files
+    fig_suffix, fig_suffix2 = '', ''
+
+    # Determine the usage of total.csv or nano.csv
+    data_file, column_name, fig_suffix = determine_data_file(args)
+
+    # Logic for determining mass concentration
+    if args.mass:
+        column_name = 'total mass'
+        fig_suffix2 = '-mass'
+        ylabel = 'Mass concentration [$\mathregular{mg/m^3}$]'
+    else:
+        ylabel = 'Number concentration [particles/$\mathregular{cm^3}$]'
+
+    # Statistics of the merged data per interval, computed once per
+    # interval and kept in the cache, see resample.py
+    data_path = merged_data_path(
+        Catalog.open(path), data_file, args.instrument
+    )
+    resampled = resample.load(
+        data_path,
+        args.interval,
+        args.mass,
+        args.max_memory,
+        args.start,
+        args.stop,
+    )
+    if resampled is None or len(resampled) == 0:
+        sys.exit('No data in the given period.')
+
+    # Save figure next to the merged data
+    interval = resample.interval_name(args.interval)
+    fig_name = f'timeseries-{interval}{fig_suffix}{fig_suffix2}'
+    fig_path = os.path.join(os.path.dirname(data_path), f'{fig_name}.png')
+    title = f'{interval} statistics {resampled.timestamps[0].item():%Y}'
+    render_figures(
+        [
+            (
+                plot_timeseries,
+                (resampled, column_name, title, ylabel),
+                fig_name,
+                fig_path,
+            )
+        ],
+        args,
+    )
+
+
+def plot_timeseries(resampled, column, title, ylabel):
+    """Plot the median, percentile bands and mean of `column`."""
+
+    # Intervals without data are left as gaps instead of being bridged
+    index = pd.date_range(
+        resampled.timestamps[0],
+        resampled.timestamps[-1],
+        freq=f'{resampled.seconds}s',
+    )
+
+    def series(stat):
+        return resampled.frame(stat)[column].reindex(index)
+
+    median, mean = series('median'), series('mean')
+    bands = {q: series(q) for q in (5, 25, 75, 95)}
+
+    new_figure((160 * mm, 90 * mm), layout='constrained')
+    plt.fill_between(
+        median.index,
+        bands[5],
+        bands[95],
+        color='tab:blue',
+        alpha=0.15,
+        linewidth=0,
+        label='5th-95th percentile',
+    )
+    plt.fill_between(
+        median.index,
+        bands[25],
+        bands[75],
+        color='tab:blue',
+        alpha=0.35,
+        linewidth=0,
+        label='25th-75th percentile',
+    )
+    plt.plot(median.index, median, 'k-', linewidth=0.6, label='Median')
+    plt.plot(mean.index, mean, 'r:', linewidth=0.6, label='Mean')
+
+    # X-axis
+    locator = mdates.AutoDateLocator()
+    plt.gca().xaxis.set_major_locator(locator)
+    plt.gca().xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    plt.xticks(**tick_font)
+    plt.xlabel('Date and time', **label_font)
+
+    # Y-axis, logarithmic for the spikes of number concentrations
+    if np.nanmax(bands[95].to_numpy(), initial=0) > 4e4:
+        plt.yscale('log')
+    else:
+        plt.ylim(bottom=0)
+    plt.gca().yaxis.set_major_formatter(
+        ticker.FuncFormatter(y_formatter_function)
+    )
+    plt.yticks(**tick_font)
+    plt.ylabel(ylabel, **label_font)
+
+    plt.title(title, **title_font)
+    plt.legend(loc='best', fontsize=6)
+
+
+if __name__ == '__main__':
+    main()